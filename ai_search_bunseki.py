@@ -1,89 +1,471 @@
-from openpyxl import load_workbook
+import re
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
 import pandas as pd
 
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_CELL_REF = re.compile(r"([A-Z]+)")
+_UNCOLORED_RGB = {"FFFFFFFF", "00000000"}  # 白 or 無色
+
+
+def _column_index(cell_ref):
+    """セル参照（例: "AB12"）から0始まりの列番号を返す"""
+    letters = _CELL_REF.match(cell_ref).group(1)
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+
+def _active_sheet_path(zf):
+    """workbook.xml と rels からアクティブシートのXMLパスを解決"""
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    view = workbook.find(f"{_NS_MAIN}bookViews/{_NS_MAIN}workbookView")
+    active_tab = int(view.get("activeTab", 0)) if view is not None else 0
+    sheets = workbook.findall(f"{_NS_MAIN}sheets/{_NS_MAIN}sheet")
+    rel_id = sheets[active_tab].get(f"{_NS_REL}id")
+
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels.iter(f"{_NS_PKG_REL}Relationship"):
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target")
+            if target.startswith("/"):
+                return target.lstrip("/")
+            return posixpath.normpath(posixpath.join("xl", target))
+    raise KeyError(f"シートのリレーションが見つかりません: {rel_id}")
+
+
+def _colored_style_ids(zf):
+    """
+    styles.xml を読み、「白/無色以外の solid 塗りつぶし」を持つスタイル番号の集合を返す
+
+    openpyxl の判定（fill_type == "solid" かつ fgColor.rgb が白/無色以外）に合わせ、
+    theme / indexed 指定の色も色付きとみなす
+    """
+    if "xl/styles.xml" not in zf.namelist():
+        return set()
+
+    colored_fills = []
+    colored_styles = set()
+    with zf.open("xl/styles.xml") as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == f"{_NS_MAIN}fill":
+                pattern = elem.find(f"{_NS_MAIN}patternFill")
+                colored = False
+                if pattern is not None and pattern.get("patternType") == "solid":
+                    fg = pattern.find(f"{_NS_MAIN}fgColor")
+                    if fg is not None:
+                        rgb = fg.get("rgb")
+                        colored = rgb not in _UNCOLORED_RGB if rgb else len(fg.attrib) > 0
+                colored_fills.append(colored)
+                elem.clear()
+            elif elem.tag == f"{_NS_MAIN}cellXfs":
+                for style_id, xf in enumerate(elem.findall(f"{_NS_MAIN}xf")):
+                    fill_id = int(xf.get("fillId", 0))
+                    if fill_id < len(colored_fills) and colored_fills[fill_id]:
+                        colored_styles.add(style_id)
+                elem.clear()
+    return colored_styles
+
+
+def _rich_text(elem):
+    """
+    si / is 要素の文字列を返す
+
+    openpyxl と同じく直下の <t> と書式付きの <r><t> のみを連結し、ふりがな（<rPh><t>）は含めない
+    """
+    t = elem.find(f"{_NS_MAIN}t")
+    parts = [t.text or ""] if t is not None else []
+    parts.extend(t.text or "" for t in elem.iterfind(f"{_NS_MAIN}r/{_NS_MAIN}t"))
+    return "".join(parts)
+
+
+def _resolve_shared_strings(zf, needed):
+    """sharedStrings.xml をストリーミングし、必要なインデックスの文字列のみを返す"""
+    if not needed or "xl/sharedStrings.xml" not in zf.namelist():
+        return {}
+
+    resolved = {}
+    index = 0
+    last = max(needed)
+    with zf.open("xl/sharedStrings.xml") as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag != f"{_NS_MAIN}si":
+                continue
+            if index in needed:
+                resolved[index] = _rich_text(elem)
+            elem.clear()
+            index += 1
+            if index > last:
+                break
+    return resolved
+
+
+def _raw_cell_value(cell):
+    """セルの値を (種別, 値) で返す。共有文字列はインデックスのまま返す"""
+    cell_type = cell.get("t")
+    if cell_type == "inlineStr":
+        inline = cell.find(f"{_NS_MAIN}is")
+        return "str", _rich_text(inline) if inline is not None else None
+    v = cell.find(f"{_NS_MAIN}v")
+    if v is None or v.text is None:
+        return "str", None
+    if cell_type == "s":
+        return "sst", int(v.text)
+    if cell_type in ("str", "e", "d"):
+        return "str", v.text
+    if cell_type == "b":
+        return "str", v.text == "1"
+    number = float(v.text)
+    return "str", int(number) if number.is_integer() and "." not in v.text and "E" not in v.text.upper() else number
+
+
 def extract_used_docs_from_colored_cells(filename, id_column="query_id"):
-    wb = load_workbook(filename)
-    sheet = wb.active
+    """
+    色付きセルからLLM採択文書を抽出
+
+    xlsx内の styles.xml とシートXMLを iterparse で直接ストリーミングするため、
+    ワークブック全体をメモリに展開しない。1行目をヘッダー、A列をクエリIDとし、
+    B列以降で色付きのセルのヘッダー名を used_docs とする。
+    """
+    with zipfile.ZipFile(filename) as zf:
+        colored_styles = _colored_style_ids(zf)
+        sheet_path = _active_sheet_path(zf)
 
-    headers = [cell.value for cell in sheet[1]]
-    results = []
+        headers = {}
+        rows = []  # (クエリID, 色付き列番号リスト)
+        needed_sst = set()
 
-    for row in sheet.iter_rows(min_row=2):
-        query_id = row[0].value
-        used_docs = []
-        for cell, header in zip(row[1:], headers[1:]):
-            if cell.fill and cell.fill.fill_type == "solid":
-                fg = cell.fill.fgColor.rgb
-                if fg and fg not in ["FFFFFFFF", "00000000"]:  # 白 or 無色でなければ色付きとみなす
-                    used_docs.append(header)
-        results.append({"query_id": query_id, "used_docs": used_docs})
-    return pd.DataFrame(results)
+        with zf.open(sheet_path) as f:
+            sheet_data = None
+            row_number = 0
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    if elem.tag == f"{_NS_MAIN}sheetData":
+                        sheet_data = elem
+                    continue
+                if elem.tag != f"{_NS_MAIN}row":
+                    continue
 
+                # r属性は省略可能なため、無い場合は直前の行・列の次とみなす
+                row_number = int(elem.get("r", row_number + 1))
+                query_id = ("str", None)
+                colored_columns = []
+                col = -1
+                for cell in elem.iter(f"{_NS_MAIN}c"):
+                    cell_ref = cell.get("r")
+                    col = _column_index(cell_ref) if cell_ref else col + 1
+                    if row_number == 1:
+                        headers[col] = _raw_cell_value(cell)
+                        continue
+                    if col == 0:
+                        query_id = _raw_cell_value(cell)
+                    elif int(cell.get("s", 0)) in colored_styles:
+                        colored_columns.append(col)
 
+                if row_number == 1:
+                    needed_sst.update(v for kind, v in headers.values() if kind == "sst")
+                else:
+                    if query_id[0] == "sst":
+                        needed_sst.add(query_id[1])
+                    rows.append((query_id, colored_columns))
+                # 処理済みの行要素を親から外してメモリを一定に保つ
+                if sheet_data is not None:
+                    sheet_data.clear()
 
+        strings = _resolve_shared_strings(zf, needed_sst)
 
+    def resolve(raw):
+        kind, value = raw
+        return strings.get(value) if kind == "sst" else value
 
+    header_names = {col: resolve(raw) for col, raw in headers.items()}
+    results = [
+        {
+            "query_id": resolve(query_id),
+            "used_docs": [header_names.get(col) for col in colored_columns],
+        }
+        for query_id, colored_columns in rows
+    ]
+    return pd.DataFrame(results, columns=["query_id", "used_docs"])
+
+
+
+
+
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 from scipy.stats import ttest_rel, wilcoxon, chi2_contingency
 import matplotlib.pyplot as plt
 
-# --- ファイル読み込み ---
-df_a = pd.read_excel("rag_a.xlsx")  # query_id, topk_docs
-df_b = pd.read_excel("rag_b.xlsx")
-df_llm = extract_used_docs_from_colored_cells("llm_used.xlsx")
-
-# --- 前処理 ---
-# カンマ区切りの文字列 → リスト
-for df in [df_a, df_b, df_llm]:
-    df.columns = [col.lower() for col in df.columns]  # 小文字化（安全のため）
-    df["topk_docs" if "topk_docs" in df.columns else "used_docs"] = \
-        df["topk_docs" if "topk_docs" in df.columns else "used_docs"].fillna("").apply(lambda x: x.split(",") if x else [])
-
-# --- 結合 ---
-merged = df_llm.merge(df_a, on="query_id", suffixes=("", "_a")).merge(
-    df_b, on="query_id", suffixes=("", "_b"))
-merged = merged.rename(columns={"topk_docs": "rag_a_topk", "topk_docs_b": "rag_b_topk", "used_docs": "llm_used_docs"})
-
-# --- 採択率計算 ---
-merged["a_hit"] = merged.apply(lambda row: len(set(row["rag_a_topk"]) & set(row["llm_used_docs"])), axis=1)
-merged["b_hit"] = merged.apply(lambda row: len(set(row["rag_b_topk"]) & set(row["llm_used_docs"])), axis=1)
-merged["a_hit_ratio"] = merged["a_hit"] / merged["rag_a_topk"].apply(len)
-merged["b_hit_ratio"] = merged["b_hit"] / merged["rag_b_topk"].apply(len)
-
-# --- 統計分析（t検定） ---
-t_stat, p_val = ttest_rel(merged["a_hit_ratio"], merged["b_hit_ratio"])
-print(f"[t検定] 採択率比較: t={t_stat:.3f}, p={p_val:.3f}")
-
-# --- Jaccard類似度 ---
-def jaccard(a, b):
-    return len(set(a) & set(b)) / len(set(a) | set(b)) if (a or b) else 0
-merged["jaccard_topk"] = merged.apply(lambda row: jaccard(row["rag_a_topk"], row["rag_b_topk"]), axis=1)
-
-# --- 採択元カテゴリ ---
-def adoption_source(row):
-    in_a = any(doc in row["rag_a_topk"] for doc in row["llm_used_docs"])
-    in_b = any(doc in row["rag_b_topk"] for doc in row["llm_used_docs"])
-    if in_a and in_b:
-        return "both"
-    elif in_a:
-        return "only_a"
-    elif in_b:
-        return "only_b"
-    else:
-        return "neither"
-merged["adopt_type"] = merged.apply(adoption_source, axis=1)
-
-# --- カイ二乗検定 ---
-adopt_counts = merged["adopt_type"].value_counts().reindex(["only_a", "only_b", "both", "neither"], fill_value=0)
-chi2, p, dof, expected = chi2_contingency([adopt_counts.values])
-print(f"[カイ二乗検定] 採択元の偏り: chi2={chi2:.3f}, p={p:.3f}")
-
-# --- 可視化 ---
-plt.boxplot([merged["a_hit_ratio"], merged["b_hit_ratio"]], labels=["RAG-A", "RAG-B"])
-plt.title("LLM採択率比較")
-plt.ylabel("採択率")
-plt.grid(True)
-plt.show()
-
-# --- 結果保存 ---
-merged.to_excel("merged_rag_analysis.xlsx", index=False)
+RANK_METRICS = ["mrr", "ndcg", "recall"]
+
+
+def to_doc_list(value):
+    """カンマ区切り文字列 / リスト / 欠損値 を文書IDのリストに正規化"""
+    if isinstance(value, (list, tuple)):
+        return [str(d).strip() for d in value if str(d).strip()]
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    return [d.strip() for d in str(value).split(",") if d.strip()]
+
+
+def build_hit_matrix(query_ids, topk_lists, used_lists, k):
+    """
+    各クエリの上位k件がLLM採択文書に含まれるかを (n_queries, k) のbool行列で返す
+
+    explode + MultiIndex.isin で全クエリを一括判定する（行ごとのPythonループなし）
+    """
+    n = len(query_ids)
+    pos = pd.RangeIndex(n)
+
+    ranked = pd.DataFrame({"row": pos, "doc": list(topk_lists)}).explode("doc").dropna()
+    ranked["rank"] = ranked.groupby("row").cumcount()
+    ranked = ranked[ranked["rank"] < k].drop_duplicates(["row", "doc"])
+
+    used = pd.DataFrame({"row": pos, "doc": list(used_lists)}).explode("doc").dropna()
+    used_keys = pd.MultiIndex.from_frame(used[["row", "doc"]])
+
+    is_hit = pd.MultiIndex.from_frame(ranked[["row", "doc"]]).isin(used_keys)
+
+    hits = np.zeros((n, k), dtype=bool)
+    hits[ranked["row"].to_numpy(dtype=int), ranked["rank"].to_numpy(dtype=int)] = is_hit
+    return hits
+
+
+def compute_rank_metrics(hits, n_relevant):
+    """
+    bool行列からクエリごとの MRR / nDCG@k / recall@k を計算
+
+    Args:
+        hits: (n_queries, k) のbool行列
+        n_relevant: クエリごとのLLM採択文書数
+
+    Returns:
+        Dict[str, np.ndarray]: 指標名 → (n_queries,) の配列
+    """
+    n, k = hits.shape
+    n_relevant = np.asarray(n_relevant, dtype=float)
+
+    any_hit = hits.any(axis=1)
+    first_rank = hits.argmax(axis=1)
+    mrr = np.where(any_hit, 1.0 / (first_rank + 1), 0.0)
+
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = hits.astype(float) @ discounts
+    ideal_cum = np.concatenate([[0.0], np.cumsum(discounts)])
+    idcg = ideal_cum[np.minimum(n_relevant, k).astype(int)]
+    ndcg = np.divide(dcg, idcg, out=np.zeros(n), where=idcg > 0)
+
+    recall = np.divide(hits.sum(axis=1), n_relevant, out=np.zeros(n), where=n_relevant > 0)
+
+    return {"mrr": mrr, "ndcg": ndcg, "recall": recall}
+
+
+def _bootstrap_chunk(deltas, n_samples, seed):
+    """
+    ブートストラップ標本ごとのベースラインとの差分の平均を計算 → (n_variants, n_metrics, n_samples)
+
+    各クエリの抽出回数（多項分布）で重み付けして平均するため、
+    リサンプリング後のスコア (n_variants, n_metrics, n_samples, n_queries) は作らない
+    """
+    rng = np.random.default_rng(seed)
+    n = deltas.shape[-1]
+    counts = rng.multinomial(n, np.full(n, 1.0 / n), size=n_samples)
+    return deltas @ counts.T / n
+
+
+def paired_bootstrap_ci(scores, baseline_idx=0, n_boot=1000, alpha=0.05, seed=0,
+                        n_jobs=4, chunk_size=100):
+    """
+    対応のあるブートストラップで、ベースラインとの差分の信頼区間を計算
+
+    ベースラインとのクエリ別の差分をリサンプリングするため、クエリ間の対応が保たれる。
+    リサンプリングはチャンク単位でスレッドプールに分散し、チャンクごとの差分の平均のみを保持する。
+
+    Args:
+        scores: (n_variants, n_metrics, n_queries) のクエリ別スコア
+        baseline_idx: ベースラインとするバリアントの添字
+        n_boot: ブートストラップ回数
+        alpha: 有意水準
+        seed: 乱数シード
+        n_jobs: 並列ワーカー数
+        chunk_size: 1チャンクあたりのリサンプル数
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]:
+            (差分の下限, 差分の上限, 差分が0以下となる割合) 各 (n_variants, n_metrics)
+
+    Raises:
+        ValueError: クエリが0件の場合
+    """
+    if scores.shape[-1] == 0:
+        raise ValueError("クエリが0件のため、ブートストラップ信頼区間を計算できません")
+    sizes = [min(chunk_size, n_boot - start) for start in range(0, n_boot, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    deltas = scores - scores[baseline_idx]
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        chunks = list(executor.map(lambda a: _bootstrap_chunk(deltas, *a), zip(sizes, seeds)))
+
+    diffs = np.concatenate(chunks, axis=-1)
+    lower = np.quantile(diffs, alpha / 2, axis=-1)
+    upper = np.quantile(diffs, 1 - alpha / 2, axis=-1)
+    p_le_zero = (diffs <= 0).mean(axis=-1)
+    return lower, upper, p_le_zero
+
+
+def evaluate_variants(variant_dfs, df_llm, k=10, baseline=None, n_boot=1000,
+                      alpha=0.05, seed=0, n_jobs=4):
+    """
+    N個の検索バリアントをLLM採択文書に対して一括評価
+
+    Args:
+        variant_dfs: バリアント名 → DataFrame(query_id, topk_docs)
+        df_llm: DataFrame(query_id, used_docs)
+        k: 評価するランク上限
+        baseline: 差分の基準とするバリアント名（Noneの場合は先頭）
+        n_boot: ブートストラップ回数
+        alpha: 有意水準
+        seed: 乱数シード
+        n_jobs: ブートストラップの並列ワーカー数
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: (クエリ別スコア, バリアント別サマリー)
+
+    Raises:
+        ValueError: バリアントが無い場合、または評価対象のクエリが0件の場合
+    """
+    names = list(variant_dfs)
+    if not names:
+        raise ValueError("評価するバリアントがありません")
+    baseline = baseline or names[0]
+
+    llm = df_llm[["query_id", "used_docs"]].copy()
+    llm["used_docs"] = llm["used_docs"].apply(to_doc_list)
+    # 採択文書が無いクエリは順位指標が定義できないため除外
+    llm = llm[llm["used_docs"].str.len() > 0]
+
+    # 全バリアントに存在するクエリのみを対象にする（対応のある比較のため）
+    common_ids = set(llm["query_id"])
+    for df in variant_dfs.values():
+        common_ids &= set(df["query_id"])
+    llm = llm[llm["query_id"].isin(common_ids)].sort_values("query_id").reset_index(drop=True)
+    if llm.empty:
+        raise ValueError("評価対象のクエリがありません（LLM採択文書があり、全バリアントに存在するクエリが0件）")
+
+    per_query = llm[["query_id"]].copy()
+    n_relevant = llm["used_docs"].str.len().to_numpy()
+    scores = np.empty((len(names), len(RANK_METRICS), len(llm)))
+
+    for v, name in enumerate(names):
+        df = variant_dfs[name].drop_duplicates("query_id").set_index("query_id")
+        topk = df.loc[llm["query_id"], "topk_docs"].apply(to_doc_list)
+        hits = build_hit_matrix(llm["query_id"], topk, llm["used_docs"], k)
+        metrics = compute_rank_metrics(hits, n_relevant)
+        for m, metric in enumerate(RANK_METRICS):
+            scores[v, m] = metrics[metric]
+            per_query[f"{name}_{metric}"] = metrics[metric]
+
+    lower, upper, p_le_zero = paired_bootstrap_ci(
+        scores, names.index(baseline), n_boot=n_boot, alpha=alpha, seed=seed, n_jobs=n_jobs
+    )
+
+    rows = []
+    for v, name in enumerate(names):
+        row = {"variant": name, "n_queries": len(llm)}
+        for m, metric in enumerate(RANK_METRICS):
+            label = f"{metric}@{k}" if metric != "mrr" else metric
+            row[label] = scores[v, m].mean()
+            row[f"{label}_diff"] = scores[v, m].mean() - scores[names.index(baseline), m].mean()
+            row[f"{label}_diff_lo"] = lower[v, m]
+            row[f"{label}_diff_hi"] = upper[v, m]
+            row[f"{label}_p_le_0"] = p_le_zero[v, m]
+        rows.append(row)
+
+    return per_query, pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # --- ファイル読み込み ---
+    df_a = pd.read_excel("rag_a.xlsx")  # query_id, topk_docs
+    df_b = pd.read_excel("rag_b.xlsx")
+    df_llm = extract_used_docs_from_colored_cells("llm_used.xlsx")
+
+    # --- 前処理 ---
+    # カンマ区切りの文字列 → リスト
+    for df in [df_a, df_b, df_llm]:
+        df.columns = [col.lower() for col in df.columns]  # 小文字化（安全のため）
+        df["topk_docs" if "topk_docs" in df.columns else "used_docs"] = \
+            df["topk_docs" if "topk_docs" in df.columns else "used_docs"].fillna("").apply(lambda x: x.split(",") if x else [])
+
+    # --- 結合 ---
+    merged = df_llm.merge(df_a, on="query_id", suffixes=("", "_a")).merge(
+        df_b, on="query_id", suffixes=("", "_b"))
+    merged = merged.rename(columns={"topk_docs": "rag_a_topk", "topk_docs_b": "rag_b_topk", "used_docs": "llm_used_docs"})
+
+    # --- 採択率計算 ---
+    merged["a_hit"] = merged.apply(lambda row: len(set(row["rag_a_topk"]) & set(row["llm_used_docs"])), axis=1)
+    merged["b_hit"] = merged.apply(lambda row: len(set(row["rag_b_topk"]) & set(row["llm_used_docs"])), axis=1)
+    merged["a_hit_ratio"] = merged["a_hit"] / merged["rag_a_topk"].apply(len)
+    merged["b_hit_ratio"] = merged["b_hit"] / merged["rag_b_topk"].apply(len)
+
+    # --- 統計分析（t検定） ---
+    t_stat, p_val = ttest_rel(merged["a_hit_ratio"], merged["b_hit_ratio"])
+    print(f"[t検定] 採択率比較: t={t_stat:.3f}, p={p_val:.3f}")
+
+    # --- Jaccard類似度 ---
+    def jaccard(a, b):
+        return len(set(a) & set(b)) / len(set(a) | set(b)) if (a or b) else 0
+    merged["jaccard_topk"] = merged.apply(lambda row: jaccard(row["rag_a_topk"], row["rag_b_topk"]), axis=1)
+
+    # --- 採択元カテゴリ ---
+    def adoption_source(row):
+        in_a = any(doc in row["rag_a_topk"] for doc in row["llm_used_docs"])
+        in_b = any(doc in row["rag_b_topk"] for doc in row["llm_used_docs"])
+        if in_a and in_b:
+            return "both"
+        elif in_a:
+            return "only_a"
+        elif in_b:
+            return "only_b"
+        else:
+            return "neither"
+    merged["adopt_type"] = merged.apply(adoption_source, axis=1)
+
+    # --- カイ二乗検定 ---
+    adopt_counts = merged["adopt_type"].value_counts().reindex(["only_a", "only_b", "both", "neither"], fill_value=0)
+    chi2, p, dof, expected = chi2_contingency([adopt_counts.values])
+    print(f"[カイ二乗検定] 採択元の偏り: chi2={chi2:.3f}, p={p:.3f}")
+
+    # --- Nバリアント評価（MRR / nDCG@k / recall@k + 対応ありブートストラップCI） ---
+    # rag_*.xlsx をすべて読み込み、ファイル名（拡張子なし）をバリアント名とする
+    variant_dfs = {}
+    for path in sorted(glob.glob("rag_*.xlsx")):
+        vdf = pd.read_excel(path)
+        vdf.columns = [col.lower() for col in vdf.columns]
+        variant_dfs[os.path.splitext(os.path.basename(path))[0]] = vdf
+
+    if variant_dfs:
+        per_query_scores, variant_summary = evaluate_variants(variant_dfs, df_llm, k=10)
+        print(variant_summary.to_string(index=False))
+        with pd.ExcelWriter("variant_rank_metrics.xlsx") as writer:
+            variant_summary.to_excel(writer, sheet_name="summary", index=False)
+            per_query_scores.to_excel(writer, sheet_name="per_query", index=False)
+
+    # --- 可視化 ---
+    plt.boxplot([merged["a_hit_ratio"], merged["b_hit_ratio"]], labels=["RAG-A", "RAG-B"])
+    plt.title("LLM採択率比較")
+    plt.ylabel("採択率")
+    plt.grid(True)
+    plt.show()
+
+    # --- 結果保存 ---
+    merged.to_excel("merged_rag_analysis.xlsx", index=False)
@@ -11,11 +11,12 @@
 
 import os, time, json, logging, requests, argparse, re, glob, random
 from typing import Dict, Tuple, Optional, Any
-from requests.auth import HTTPBasicAuth
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from git import Repo, GitCommandError
 from dotenv import load_dotenv
+from flask_app.tag_index import TAG_PATTERN, fetch_tag_summary
+from flask_app.jenkins_client import JenkinsClient
 load_dotenv()
 
 
@@ -60,9 +61,6 @@ PROXY_CERT = os.getenv('REQUESTS_CA_BUNDLE')
 # タグ情報保存ファイル
 TAG_INFO_FILE = "tag_info.json"
 
-# タグ形式: NNN-YYYYMMDD（例: 008-20250904）
-TAG_PATTERN = re.compile(r"^(\d{3})-(\d{8})$")
-
 PARAMS = {
     "NEW_TAG":   os.getenv("NEW_TAG", ""),
     "OLD_TAG":   os.getenv("OLD_TAG", ""),
@@ -74,7 +72,6 @@ PARAMS = {
 
 QUEUE_WAIT_SEC = int(300)
 BUILD_WAIT_SEC = int(1800)
-POLL_INTERVAL  = float(2)
 
 # n8n
 N8N_FLOW1_URL = os.getenv("N8N_FLOW1_URL", "")
@@ -100,62 +97,6 @@ def parse_args():
                        help="インデックス名の短縮名を指定")
     return parser.parse_args()
 
-# ===== Jenkins =====
-def jenkins_url(path: str) -> str:
-    return f"{JENKINS_BASE.rstrip('/')}/{path.lstrip('/')}"
-
-def trigger_jenkins_build(session: requests.Session, params: Dict[str, str]) -> str:
-    url = jenkins_url(f"/job/{JENKINS_JOB}/buildWithParameters?token={JENKINS_JOB_TOKEN}")
-    # Jenkins認証情報をauthパラメータで渡す
-    auth = (JENKINS_USER, JENKINS_TOKEN)
-    
-    r = session.post(url, params=params, auth=auth,
-                     allow_redirects=False, timeout=TIMEOUT, verify=VERIFY_SSL)
-    r.raise_for_status()
-    queue_url = r.headers.get("Location")
-    if not queue_url:
-        raise RuntimeError("Jenkins: queue Location header がありません。")
-    return queue_url
-
-def resolve_queue_to_build(session: requests.Session, queue_url: str, wait_sec: int) -> str:
-    api = queue_url.rstrip("/") + "/api/json"
-    deadline = time.time() + wait_sec
-    
-    # Jenkins認証情報をauthパラメータで渡す
-    auth = (JENKINS_USER, JENKINS_TOKEN)
-    
-    while time.time() < deadline:
-        q = session.get(api, auth=auth, timeout=TIMEOUT, verify=VERIFY_SSL)
-        q.raise_for_status()
-        data = q.json()
-        if data.get("cancelled"):
-            raise RuntimeError("Jenkins: queue cancelled")
-        exe = data.get("executable")
-        if exe and exe.get("url"):
-            build_url = exe["url"]
-            logging.info("Queue resolved to build: %s", build_url)
-            return build_url
-        time.sleep(POLL_INTERVAL)
-    raise TimeoutError("Jenkins: queue → build 解決タイムアウト")
-
-def wait_for_build_result(session: requests.Session, build_url: str, wait_sec: int) -> str:
-    api = build_url.rstrip("/") + "/api/json"
-    deadline = time.time() + wait_sec
-    
-    # Jenkins認証情報をauthパラメータで渡す
-    auth = (JENKINS_USER, JENKINS_TOKEN)
-    
-    while time.time() < deadline:
-        r = session.get(api, auth=auth, timeout=TIMEOUT, verify=VERIFY_SSL)
-        r.raise_for_status()
-        j = r.json()
-        result = j.get("result")
-        if result is not None:
-            logging.info("Jenkins result: %s", result)
-            return result
-        time.sleep(POLL_INTERVAL)
-    raise TimeoutError("Jenkins: ビルド完了待ちタイムアウト")
-
 # ===== n8n =====
 def build_n8n_payload() -> Dict[str, str]:
     # タグからNNN部分を抽出（例: "008-20250117" → "008"）
@@ -329,7 +270,7 @@ def checkout_branch(workdir: str, branch: str):
         logging.warning(f"ブランチ '{branch}' のリセットに失敗しました: {exc}")
 
 
-def iter_tags(api_base: str, project_id: str, token: str, per_page: int = 100):
+def iter_tags(api_base: str, project_id: str, token: str, per_page: int = 100, order_by: str = "updated"):
     headers = {"PRIVATE-TOKEN": token}
     
     # プロキシ設定
@@ -342,7 +283,7 @@ def iter_tags(api_base: str, project_id: str, token: str, per_page: int = 100):
     page = 1
     while True:
         url = f"{api_base}/projects/{project_id}/repository/tags"
-        params = {"order_by": "updated", "sort": "desc", "per_page": per_page, "page": page}
+        params = {"order_by": order_by, "sort": "desc", "per_page": per_page, "page": page}
         resp = requests.get(url, headers=headers, params=params, proxies=proxies, timeout=30)
         resp.raise_for_status()
         batch = resp.json()
@@ -361,25 +302,9 @@ def get_max_seq_from_tags(api_base: str, project_id: str, token: str) -> int:
     initial-tagのみの場合は 0 を返す。
     一致が無ければ 0。
     """
-    max_seq = 0
-    has_valid_tags = False
-    
-    for name in iter_tags(api_base, project_id, token):
-        # initial-tagは無視
-        if name == "initial-tag":
-            continue
-            
-        m = TAG_PATTERN.match(name)
-        if not m:
-            continue
-            
-        has_valid_tags = True
-        seq = int(m.group(1))
-        if seq > max_seq:
-            max_seq = seq
-    
-    # 有効なタグがない場合（initial-tagのみの場合）は0を返す
-    return max_seq if has_valid_tags else 0
+    return fetch_tag_summary(
+        lambda order_by: iter_tags(api_base, project_id, token, order_by=order_by)
+    ).max_seq
 
 
 def gitlab_request(method: str, url: str, token: str, *, params: Optional[Dict[str, Any]] = None,
@@ -487,9 +412,9 @@ def create_tag(api_base: str, project_id: str, token: str, tag_name: str, ref: s
     if message:
         payload["message"] = message
     resp = requests.post(url, headers=headers, data=payload, proxies=proxies, timeout=30)
-    # 重複タグ（already exists）は成功扱いで返す
+    # 重複タグ（already exists）は採番の競合のためエラーにする（同じタグ名で別のデプロイを上書きしない）
     if resp.status_code == 400 and "already exists" in resp.text:
-        return
+        raise RuntimeError(f"タグ {tag_name} は既に存在します")
     resp.raise_for_status()
 
 # ===== タグ情報管理 =====
@@ -515,17 +440,9 @@ def save_tag_info(new_tag: str, old_tag: str):
 
 def get_latest_tag_from_git() -> str:
     """Git上の最新タグ（NNN-YYYYMMDD形式）を取得"""
-    latest_tag = ""
-    for name in iter_tags(API_BASE, PROJECT_ID, GIT_TOKEN):
-        # initial-tagは無視
-        if name == "initial-tag":
-            continue
-            
-        m = TAG_PATTERN.match(name)
-        if m:
-            latest_tag = name
-            break  # iter_tagsは降順でソートされているので最初の一致が最新
-    return latest_tag
+    return fetch_tag_summary(
+        lambda order_by: iter_tags(API_BASE, PROJECT_ID, GIT_TOKEN, order_by=order_by)
+    ).latest_tag
 
 def has_tag_changes() -> bool:
     """Git上の最新タグとtag_info.jsonのnew_tagを比較して差分があるかチェック"""
@@ -654,29 +571,15 @@ def create_new_tag():
 
 
 def run_jenkins_flow():
-    s = requests.Session()
-    s.auth = HTTPBasicAuth(JENKINS_USER, JENKINS_TOKEN)
-
-    s.auth = None
-    s.proxies = {}
-    s.verify = VERIFY_SSL
-    original_http_proxy = os.environ.pop('HTTP_PROXY', None)
-    original_https_proxy = os.environ.pop('HTTPS_PROXY', None)
-
     try:
-        queue_url = trigger_jenkins_build(s, PARAMS)
-        build_url = resolve_queue_to_build(s, queue_url, QUEUE_WAIT_SEC)
-        result_status = wait_for_build_result(s, build_url, BUILD_WAIT_SEC)
+        with JenkinsClient(JENKINS_BASE, JENKINS_JOB, JENKINS_USER, JENKINS_TOKEN,
+                           JENKINS_JOB_TOKEN, VERIFY_SSL, TIMEOUT) as client:
+            result_status = client.run(PARAMS, QUEUE_WAIT_SEC, BUILD_WAIT_SEC)
         if result_status not in ("SUCCESS", "UNSTABLE"):
             raise SystemExit(f"Jenkins finished with {result_status} → n8n は実行しません。")
     except Exception as e:
         logging.error(f"Jenkinsフローエラー: {e}")
         raise SystemExit(f"Jenkinsフローに失敗しました: {e}")
-    finally:
-        if original_http_proxy:
-            os.environ['HTTP_PROXY'] = original_http_proxy
-        if original_https_proxy:
-            os.environ['HTTPS_PROXY'] = original_https_proxy
 
 
 def main():
@@ -2,22 +2,27 @@
 Flaskアプリケーション - ファイルアップローダー
 """
 from flask import Flask, render_template, request, jsonify, Response, stream_with_context, send_file
-from werkzeug.utils import secure_filename
 import os
 import uuid
-import threading
-import time
 import re
 import json
-from datetime import datetime
-from pathlib import Path
+import shutil
+import sys
+import subprocess
+from datetime import datetime, timedelta
 
 from database import (
-    init_db, create_upload_record, get_all_uploads,
-    get_upload_by_task_id, get_logs_by_task_id,
-    get_lock_status, is_locked, set_lock
+    init_db, create_upload_record, get_uploads_page, get_latest_upload_for_index,
+    get_upload_by_task_id, get_logs_by_task_id, get_logs_since,
+    get_active_jobs
 )
-from processor_new import run_processing, OUTPUT_DIR
+import processor_new
+from processor_new import job_input_dir
+from progress_events import progress_notifier
+from job_queue import JobQueue, JOB_WORKERS
+from worker import worker_supervisor_running
+from excel_to_index_processor import preflight_validate_excel
+from upload_stream import HashingRequest
 
 app = Flask(__name__)
 
@@ -26,32 +31,67 @@ app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'data', 'input_data')
 ALLOWED_EXTENSIONS = {'xlsx'}
 
+# アップロードファイルは保存先と同じディレクトリへ直接書き込み、受信中にSHA-256を計算する
+HashingRequest.upload_dir = app.config['UPLOAD_FOLDER']
+app.request_class = HashingRequest
+
 # エラーシミュレーション（デバッグ用）
 # Trueにするとエラーが発生するテストが実行されます（80%の確率でエラー発生）
 SIMULATE_ERROR = False
 
+# SSEの待機時間（秒）: 進捗の更新（ワーカープロセスの更新もDB経由で届く）で起きるため、待機は保険
+SSE_NOTIFY_TIMEOUT_SEC = 15.0
+
+# アップロード一覧の1ページの件数（APIは limit で指定可能、上限あり）
+UPLOADS_PAGE_SIZE = 50
+UPLOADS_PAGE_SIZE_MAX = 200
+# インデックス名（短縮形）の既定値と形式（同じインデックス名のジョブは1件ずつ実行する）
+DEFAULT_INDEX_NAME_SHORT = os.getenv("INDEX_NAME_SHORT", "default_index")
+INDEX_NAME_SHORT_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+# 同じインデックスの前回の処理と同一のファイルは、この日数以内であれば処理をスキップする
+DUPLICATE_UPLOAD_WINDOW_DAYS = float(os.getenv("DUPLICATE_UPLOAD_WINDOW_DAYS", "7"))
+
 # データベース初期化
 init_db()
 
-# サーバー起動時にロックを解除（前回の異常終了時の残留ロックをクリア）
-try:
-    lock_status = get_lock_status()
-    if lock_status.get('is_locked'):
-        print(f"[WARNING] 起動時にロックが残っていました。解除します...")
-        print(f"  - 前回のタスクID: {lock_status.get('current_task_id')}")
-        print(f"  - ロック時刻: {lock_status.get('locked_at')}")
-        set_lock(False)
-        print("[INFO] ロックを解除しました。")
+# 前回の異常終了で実行中のまま残ったジョブは、リースの期限切れ後にワーカーがエラーにする
+# （他のサーバープロセスが実行中のジョブもあるため、起動時に強制的に解除しない）
+
+# ジョブの実行方法
+#   external: Webサーバーはキューへの登録のみ行う（worker.py を別途起動する）
+#   process : Webサーバーの起動時に、このホストでワーカー（worker.py）が動いていなければ起動する
+#             （ワーカーはWebサーバーから切り離して起動するため、Webサーバーを再起動しても処理は継続）
+#   thread  : Webサーバー内のスレッドで実行する
+JOB_RUNNER = os.getenv("JOB_RUNNER", "external")
+# 同じプロセスで実行する場合、進捗の通知はプロセス内のみで行う（DBへの記録と確認を省く）
+progress_notifier.shared = JOB_RUNNER != 'thread'
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+
+def run_job(job):
+    """ジョブキューから取り出したジョブを処理（JOB_RUNNER=thread の場合）"""
+    # コミットとタグ作成は、他のプロセスのジョブも含めて1件ずつ行う
+    deploy_lock = job_queue.lease_lock('git_deploy', job['task_id'])
+    processor_new.run_job(job, deploy_lock, SIMULATE_ERROR)
+
+# キューへの登録と待ち状況の取得に使用（ワーカーを起動するのは JOB_RUNNER=thread の場合のみ）
+job_queue = JobQueue(run_job)
+
+def start_job_workers():
+    """JOB_RUNNER に応じてジョブのワーカーを起動"""
+    if JOB_RUNNER == 'thread':
+        job_queue.start()
+    elif JOB_RUNNER == 'process':
+        # 複数のWebサーバープロセスから起動しても、ホストごとのリースを取得できた1つ以外はすぐに終了する
+        if worker_supervisor_running():
+            print("[INFO] このホストのワーカーは起動済みです")
+            return
+        worker = subprocess.Popen([sys.executable, WORKER_SCRIPT, '--processes', str(JOB_WORKERS)],
+                                  start_new_session=True)
+        print(f"[INFO] ワーカープロセスを起動しました (pid: {worker.pid})")
+    elif JOB_RUNNER == 'external':
+        print("[INFO] ジョブは外部のワーカー（worker.py）で実行されます")
     else:
-        print("[INFO] ロック状態: 正常（解除済み）")
-except Exception as e:
-    print(f"[WARNING] ロック状態の確認に失敗しました: {e}")
-    print("[INFO] 念のためロックを解除します...")
-    try:
-        set_lock(False)
-        print("[INFO] ロックを解除しました。")
-    except Exception as reset_error:
-        print(f"[ERROR] ロック解除に失敗しました: {reset_error}")
+        raise ValueError(f"JOB_RUNNER の値が不正です: {JOB_RUNNER}（process / external / thread）")
 
 def allowed_file(filename):
     """ファイルの拡張子をチェック"""
@@ -87,38 +127,52 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@gmail\.com$'
     return re.match(pattern, email) is not None
 
-def cleanup_old_index_files():
+def find_duplicate_upload(index_name_short, file_hash):
     """
-    古いインデックス化データ一覧ファイルを削除
-    最新5件のみを保持し、それ以降は削除する
+    同じインデックスの最新のアップロードが同一ファイルの場合、そのアップロード記録を返す
+    
+    完了済みの場合は DUPLICATE_UPLOAD_WINDOW_DAYS 以内のもののみ、待機中・処理中の場合はそのまま返す。
+    最新のアップロードが別のファイルやエラーの場合は、デプロイ済みの内容と異なる可能性があるためNone
     """
-    try:
-        # すべてのアップロード記録を取得（新しい順）
-        uploads = get_all_uploads()
-        
-        # 6件目以降のインデックスファイルを削除
-        if len(uploads) > 5:
-            for upload in uploads[5:]:
-                index_excel_path = upload.get('index_excel_path')
-                if index_excel_path and os.path.exists(index_excel_path):
-                    try:
-                        os.remove(index_excel_path)
-                        print(f"[INFO] 古いインデックスファイルを削除: {index_excel_path}")
-                    except Exception as e:
-                        print(f"[ERROR] ファイル削除失敗: {e}")
-    except Exception as e:
-        print(f"[ERROR] cleanup_old_index_files: {e}")
+    latest = get_latest_upload_for_index(index_name_short)
+    if not latest or latest.get('file_hash') != file_hash:
+        return None
+    
+    if latest['status'] in ('queued', 'processing'):
+        return latest
+    if latest['status'] == 'completed':
+        completed_at = datetime.strptime(latest['end_time'] or latest['upload_date'], '%Y-%m-%d %H:%M:%S')
+        if datetime.now() - completed_at <= timedelta(days=DUPLICATE_UPLOAD_WINDOW_DAYS):
+            return latest
+    return None
+
+def parse_uploads_cursor(cursor):
+    """ページングのカーソル文字列（"upload_date|id"）を (upload_date, id) に変換（不正な場合はNone）"""
+    if not cursor:
+        return None
+    upload_date, sep, upload_id = cursor.rpartition('|')
+    if not sep or not upload_id.isdigit():
+        return None
+    return upload_date, int(upload_id)
+
+def format_uploads_cursor(cursor):
+    """(upload_date, id) をページングのカーソル文字列に変換"""
+    if cursor is None:
+        return None
+    return f"{cursor[0]}|{cursor[1]}"
 
 @app.route('/')
 def index():
     """メインページ"""
-    return render_template('index.html')
+    return render_template('index.html', default_index_name_short=DEFAULT_INDEX_NAME_SHORT)
 
 @app.route('/uploads')
 def uploads_list():
     """アップロード一覧ページ"""
-    uploads = get_all_uploads()
-    return render_template('uploads.html', uploads=uploads)
+    cursor = parse_uploads_cursor(request.args.get('cursor'))
+    uploads, next_cursor = get_uploads_page(UPLOADS_PAGE_SIZE, cursor)
+    return render_template('uploads.html', uploads=uploads,
+                           next_cursor=format_uploads_cursor(next_cursor))
 
 @app.route('/logs/<task_id>')
 def logs_view(task_id):
@@ -143,13 +197,6 @@ def processing_view(task_id):
 def upload_file():
     """ファイルアップロードエンドポイント"""
     
-    # ロック状態をチェック
-    if is_locked():
-        return jsonify({
-            'success': False,
-            'error': '現在、別の処理が実行中です。しばらくお待ちください。'
-        }), 400
-    
     # ファイルのチェック
     if 'file' not in request.files:
         return jsonify({'success': False, 'error': 'ファイルが選択されていません'}), 400
@@ -175,47 +222,93 @@ def upload_file():
     if not validate_email(worker_email):
         return jsonify({'success': False, 'error': '作業者のメールアドレスが無効です'}), 400
     
+    index_name_short = request.form.get('index_name_short', '').strip() or DEFAULT_INDEX_NAME_SHORT
+    if not INDEX_NAME_SHORT_PATTERN.match(index_name_short):
+        return jsonify({'success': False, 'error': 'インデックス名は英数字・ハイフン・アンダースコアで入力してください'}), 400
+    
+    # 受信時に計算したファイルのハッシュで、同じインデックスの前回の処理と同一のファイルか確認
+    file_hash = file.stream.hexdigest()
+    force = request.form.get('force', '').lower() in ('1', 'true', 'on')
+    duplicate = None if force else find_duplicate_upload(index_name_short, file_hash)
+    if duplicate:
+        # 埋め込み・コミット・デプロイを再実行せず、前回のタスクを返す（受信したファイルはリクエスト終了時に削除）
+        if duplicate['status'] == 'completed':
+            return jsonify({
+                'success': True,
+                'task_id': duplicate['task_id'],
+                'duplicate': True,
+                'no_changes': True,
+                'previous': {
+                    'upload_date': duplicate['upload_date'],
+                    'end_time': duplicate['end_time'],
+                    'duration': duplicate['duration'],
+                    'record_count': duplicate['record_count'],
+                    'has_index_excel': bool(duplicate['index_excel_path']),
+                },
+                'message': '前回処理したファイルと同一のため、処理をスキップしました（変更なし）。'
+            })
+        return jsonify({
+            'success': True,
+            'task_id': duplicate['task_id'],
+            'duplicate': True,
+            'no_changes': False,
+            'queue': job_queue.queue_info(duplicate['task_id']),
+            'message': '同じファイルを処理中（または処理待ち）のため、そのタスクの状況を表示します。'
+        })
+    
+    # ヘッダー行と先頭行のみで事前検証（不正なファイルで処理枠を占有しない）
+    try:
+        file.stream.seek(0)
+        preflight_validate_excel(file.stream)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'ファイルの検証に失敗しました: {str(e)}'}), 400
+    
     # ファイルを保存
     original_filename = file.filename  # 元のファイル名を保存（日本語対応）
     task_id = str(uuid.uuid4())
     safe_name = safe_filename(original_filename)  # 安全なファイル名を生成
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], safe_name)
+    # タスクごとのディレクトリに保存（待機中のファイルを他のタスクが読み込まないように）
+    task_dir = job_input_dir(task_id)
+    file_path = os.path.join(task_dir, safe_name)
     
     try:
-        file.save(file_path)
+        os.makedirs(task_dir, exist_ok=True)
+        # 受信済みのファイルを移動（コピーしない）
+        file.stream.save_as(file_path)
     except Exception as e:
+        shutil.rmtree(task_dir, ignore_errors=True)
         return jsonify({'success': False, 'error': f'ファイルの保存に失敗しました: {str(e)}'}), 500
     
-    # データベースに記録（元のファイル名を使用）
+    # データベースに記録（元のファイル名を使用）し、ジョブキューに追加
     try:
-        create_upload_record(task_id, original_filename, approver_email, worker_email)
+        create_upload_record(task_id, original_filename, approver_email, worker_email,
+                             index_name_short, status='queued', file_hash=file_hash,
+                             total_steps=len(processor_new.PROCESSING_STEPS))
+        job_queue.submit(task_id, index_name_short, file_path)
     except Exception as e:
         # ファイルを削除
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        shutil.rmtree(task_dir, ignore_errors=True)
         return jsonify({'success': False, 'error': f'データベースへの記録に失敗しました: {str(e)}'}), 500
     
-    # バックグラウンド処理を開始
-    thread = threading.Thread(
-        target=run_processing,
-        args=(task_id, file_path, SIMULATE_ERROR),  # エラーシミュレーションフラグを使用
-        daemon=True
-    )
-    thread.start()
-    
+    queue_info = job_queue.queue_info(task_id)
     return jsonify({
         'success': True,
         'task_id': task_id,
-        'message': 'ファイルのアップロードに成功しました。処理を開始します。'
+        'queue': queue_info,
+        'message': ('ファイルのアップロードに成功しました。処理待ちのキューに追加しました。' if queue_info
+                    else 'ファイルのアップロードに成功しました。処理を開始します。')
     })
 
 @app.route('/api/lock_status')
 def lock_status():
-    """ロック状態を取得"""
-    status = get_lock_status()
+    """処理状態を取得（実行中・待機中のジョブ数）"""
+    jobs = get_active_jobs()
+    running = [job for job in jobs if job['status'] == 'running']
     return jsonify({
-        'is_locked': bool(status['is_locked']),
-        'current_task_id': status.get('current_task_id')
+        'is_locked': bool(running),
+        'current_task_id': running[0]['task_id'] if running else None,
+        'running_count': len(running),
+        'queued_count': len(jobs) - len(running)
     })
 
 @app.route('/api/stream/<task_id>')
@@ -231,55 +324,64 @@ def stream_logs(task_id):
             yield f"data: {{'error': 'タスクが見つかりません'}}\n\n"
             return
         
-        # 処理が完了するまでループ
-        while True:
-            upload = get_upload_by_task_id(task_id)
-            logs = get_logs_by_task_id(task_id)
-            
-            # 新しいログのみを送信
-            new_logs = logs[last_log_id:]
-            for log in new_logs:
-                log_data = {
-                    'type': 'log',
-                    'timestamp': log['timestamp'],
-                    'level': log['level'],
-                    'step_name': log['step_name'],
-                    'message': log['message'],
-                    'progress': log['progress']
-                }
-                yield f"data: {json.dumps(log_data)}\n\n"
-                last_log_id += 1
-            
-            # ステップ進捗情報を送信
-            if upload:
-                step_data = {
-                    'type': 'step_progress',
-                    'current_step': upload.get('current_step', ''),
-                    'current_step_index': upload.get('current_step_index', 0),
-                    'total_steps': upload.get('total_steps', 10),
-                    'step_progress': upload.get('step_progress', 0),
-                    'estimated_remaining_time': upload.get('estimated_remaining_time', 0),
-                    'record_count': upload.get('record_count', 0),
-                    'json_files_created': upload.get('json_files_created', 0),
-                    'json_files_deleted': upload.get('json_files_deleted', 0)
-                }
-                yield f"data: {json.dumps(step_data)}\n\n"
-            
-            # 処理が完了したかチェック
-            if upload['status'] in ['completed', 'error']:
-                # 最終ステータスを送信
-                final_data = {
-                    'type': 'final',
-                    'status': upload['status'],
-                    'duration': upload.get('duration', 0),
-                    'error_message': upload.get('error_message'),
-                    'is_final': True
-                }
-                yield f"data: {json.dumps(final_data)}\n\n"
-                break
-            
-            # 1秒待機
-            time.sleep(1)
+        last_step_data = None
+        
+        # 表示中はタスクの更新が通知される（ワーカープロセスによる更新はDB経由）
+        with progress_notifier.watch(task_id):
+            # 処理が完了するまでループ
+            while True:
+                # DBを読む前の更新番号を控え、読み込み後の更新を取りこぼさないようにする
+                version = progress_notifier.version(task_id)
+                upload = get_upload_by_task_id(task_id)
+                
+                # 前回送信したログIDより新しいログのみを取得して送信
+                for log in get_logs_since(task_id, last_log_id):
+                    log_data = {
+                        'type': 'log',
+                        'timestamp': log['timestamp'],
+                        'level': log['level'],
+                        'step_name': log['step_name'],
+                        'message': log['message'],
+                        'progress': log['progress']
+                    }
+                    yield f"data: {json.dumps(log_data)}\n\n"
+                    last_log_id = log['id']
+                
+                # ステップ進捗情報を送信（前回から変化した場合のみ）
+                if upload:
+                    step_data = {
+                        'type': 'step_progress',
+                        'current_step': upload.get('current_step', ''),
+                        'current_step_index': upload.get('current_step_index', 0),
+                        'total_steps': upload.get('total_steps', 11),
+                        'step_progress': upload.get('step_progress', 0),
+                        'estimated_remaining_time': upload.get('estimated_remaining_time', 0),
+                        'record_count': upload.get('record_count', 0),
+                        'json_files_created': upload.get('json_files_created', 0),
+                        'json_files_deleted': upload.get('json_files_deleted', 0)
+                    }
+                    # 待機中は順番と推定待ち時間も送信
+                    if upload['status'] == 'queued':
+                        step_data['queue'] = job_queue.queue_info(task_id)
+                    if step_data != last_step_data:
+                        yield f"data: {json.dumps(step_data)}\n\n"
+                        last_step_data = step_data
+                
+                # 処理が完了したかチェック
+                if upload['status'] in ['completed', 'error']:
+                    # 最終ステータスを送信
+                    final_data = {
+                        'type': 'final',
+                        'status': upload['status'],
+                        'duration': upload.get('duration', 0),
+                        'error_message': upload.get('error_message'),
+                        'is_final': True
+                    }
+                    yield f"data: {json.dumps(final_data)}\n\n"
+                    break
+                
+                # 更新の通知を待機
+                progress_notifier.wait(task_id, version, SSE_NOTIFY_TIMEOUT_SEC)
     
     return Response(
         stream_with_context(generate()),
@@ -292,9 +394,22 @@ def stream_logs(task_id):
 
 @app.route('/api/uploads')
 def api_uploads():
-    """アップロード一覧をJSON形式で取得"""
-    uploads = get_all_uploads()
-    return jsonify({'uploads': uploads})
+    """
+    アップロード一覧をJSON形式で取得（新しい順）
+    
+    クエリパラメータ:
+        limit: 1ページの件数（既定50、最大200）
+        cursor: 前回のレスポンスの next_cursor（省略時は先頭ページ）
+    """
+    limit = request.args.get('limit', UPLOADS_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), UPLOADS_PAGE_SIZE_MAX)
+    cursor = request.args.get('cursor')
+    parsed_cursor = parse_uploads_cursor(cursor)
+    if cursor and parsed_cursor is None:
+        return jsonify({'error': 'cursor が不正です'}), 400
+    
+    uploads, next_cursor = get_uploads_page(limit, parsed_cursor)
+    return jsonify({'uploads': uploads, 'next_cursor': format_uploads_cursor(next_cursor)})
 
 @app.route('/api/logs/<task_id>')
 def api_logs(task_id):
@@ -324,12 +439,13 @@ def api_task_stats(task_id):
         'json_files_deleted': upload.get('json_files_deleted', 0),
         'current_step': upload.get('current_step', ''),
         'current_step_index': upload.get('current_step_index', 0),
-        'total_steps': upload.get('total_steps', 10),
+        'total_steps': upload.get('total_steps', 11),
         'step_progress': upload.get('step_progress', 0),
         'estimated_remaining_time': upload.get('estimated_remaining_time', 0),
         'start_time': upload.get('start_time'),
         'end_time': upload.get('end_time'),
-        'duration': upload.get('duration', 0)
+        'duration': upload.get('duration', 0),
+        'queue': job_queue.queue_info(task_id) if upload.get('status') == 'queued' else None
     })
 
 @app.route('/download/<task_id>')
@@ -373,6 +489,10 @@ def internal_server_error(error):
         'error': '内部サーバーエラーが発生しました'
     }), 500
 
+# ワーカーを起動（デバッグ時のリローダーの監視プロセスでは起動しない）
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    start_job_workers()
+
 if __name__ == '__main__':
     # input_dataディレクトリが存在しない場合は作成
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
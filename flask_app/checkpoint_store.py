@@ -0,0 +1,148 @@
+"""
+チェックポイント管理モジュール
+インデックス生成の完了済みレコードをSQLiteへ保存し、同じ入力での再実行時に途中から再開する
+"""
+import hashlib
+import json
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from database import connect_sqlite
+
+CHECKPOINT_DB_PATH = Path(__file__).parent / "data" / "checkpoint" / "checkpoints.db"
+
+# この日数より古いチェックポイントは起動時に削除する
+CHECKPOINT_RETENTION_SEC = 7 * 24 * 3600
+
+# Embeddingの保存形式のバージョン（1: float64。float32で保存していた旧形式の完了済みレコードは破棄する）
+_SCHEMA_VERSION = 1
+
+
+def compute_run_key(files: Iterable[Path], *extra: str) -> str:
+    """
+    入力ファイルの内容から実行キーを計算
+
+    ファイル名には依存せず、内容が同じ入力であれば同じキーになる
+    """
+    file_hashes = []
+    for file in files:
+        digest = hashlib.sha256()
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        file_hashes.append(digest.hexdigest())
+
+    run_digest = hashlib.sha256()
+    for h in sorted(file_hashes):
+        run_digest.update(h.encode("ascii"))
+    for value in extra:
+        run_digest.update(b"\0" + value.encode("utf-8"))
+    return run_digest.hexdigest()
+
+
+class CheckpointStore:
+    """実行キーごとのrag_id割り当てと完了済みレコード（Embedding / キーワード）を保持"""
+
+    def __init__(self, db_path: Path = CHECKPOINT_DB_PATH):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path, check_same_thread=False)
+        # 複数のワーカープロセスが同時に初期化しても、スキーマの変更が競合しないよう書き込みロックを先に取る
+        self._conn.execute("BEGIN IMMEDIATE")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS records")
+            self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_key TEXT PRIMARY KEY,
+                total INTEGER NOT NULL,
+                rag_ids TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS records (
+                run_key TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                keywords TEXT NOT NULL,
+                PRIMARY KEY (run_key, idx)
+            )
+        ''')
+        self._conn.commit()
+        self.purge_expired()
+
+    def purge_expired(self, retention_sec: float = CHECKPOINT_RETENTION_SEC) -> None:
+        """保持期間を過ぎたチェックポイントを削除"""
+        threshold = time.time() - retention_sec
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM records WHERE run_key IN (SELECT run_key FROM runs WHERE created_at < ?)",
+                (threshold,)
+            )
+            self._conn.execute("DELETE FROM runs WHERE created_at < ?", (threshold,))
+
+    def get_or_create_run(self, run_key: str, rag_ids: List[str]) -> Tuple[List[str], bool]:
+        """
+        実行キーのチェックポイントを取得、無ければ作成
+
+        Args:
+            run_key: 実行キー
+            rag_ids: 新規作成時に割り当てるrag_idリスト
+
+        Returns:
+            Tuple[List[str], bool]: (使用するrag_idリスト, 既存チェックポイントから再開するか)
+        """
+        rag_ids_json = json.dumps(rag_ids)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT total, rag_ids FROM runs WHERE run_key = ?", (run_key,)
+            ).fetchone()
+            if row and row[0] == len(rag_ids):
+                return json.loads(row[1]), True
+
+            with self._conn:
+                self._conn.execute("DELETE FROM records WHERE run_key = ?", (run_key,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO runs (run_key, total, rag_ids, created_at) VALUES (?, ?, ?, ?)",
+                    (run_key, len(rag_ids), rag_ids_json, time.time())
+                )
+            return rag_ids, False
+
+    def load_records(self, run_key: str) -> Dict[int, Tuple[List[float], List[str]]]:
+        """完了済みレコードを1回のクエリでまとめて取得（インデックス → (Embedding, キーワード)）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, vector, keywords FROM records WHERE run_key = ?", (run_key,)
+            ).fetchall()
+        records = {}
+        for idx, blob, keywords in rows:
+            vector = array("d")
+            vector.frombytes(blob)
+            records[idx] = (vector.tolist(), json.loads(keywords))
+        return records
+
+    def save_records(self, run_key: str, rows: Iterable[Tuple[int, List[float], List[str]]]) -> None:
+        """完了したレコードの (インデックス, Embedding, キーワード) をまとめて保存"""
+        # 値の変換はロックの外で行い、書き込みのトランザクションを短くする
+        rows = [(run_key, idx, array("d", vector).tobytes(), json.dumps(keywords, ensure_ascii=False))
+                for idx, vector, keywords in rows]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records (run_key, idx, vector, keywords) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def delete_run(self, run_key: str) -> None:
+        """正常終了した実行のチェックポイントを削除"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records WHERE run_key = ?", (run_key,))
+            self._conn.execute("DELETE FROM runs WHERE run_key = ?", (run_key,))
+
+    def close(self) -> None:
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,116 @@
+"""
+コンテンツキャッシュ管理モジュール
+テキストのハッシュをキーに、EmbeddingとキーワードをSQLiteへ永続化する
+（Embeddingはクレンジング後のcontent、キーワードは抽出に渡すcontentのハッシュをキーにする）
+"""
+import hashlib
+import json
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from database import connect_sqlite
+
+CACHE_DB_PATH = Path(__file__).parent / "data" / "cache" / "content_cache.db"
+
+# SQLiteのバインド変数上限を超えないよう IN 句を分割する
+_LOOKUP_CHUNK_SIZE = 500
+
+# Embeddingの保存形式のバージョン（1: float64。float32で保存していた旧形式のキャッシュは破棄する）
+_SCHEMA_VERSION = 1
+
+
+def content_hash(text: str) -> str:
+    """テキストのハッシュ値を返す"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ContentCache:
+    """(モデル名, テキストのハッシュ) をキーにしたEmbedding / キーワードのキャッシュ"""
+
+    def __init__(self, db_path: Path = CACHE_DB_PATH):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path, check_same_thread=False)
+        # 複数のワーカープロセスが同時に初期化しても、スキーマの変更が競合しないよう書き込みロックを先に取る
+        self._conn.execute("BEGIN IMMEDIATE")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS embeddings")
+            self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, content_hash)
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS keywords (
+                model TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                keywords TEXT NOT NULL,
+                PRIMARY KEY (model, content_hash)
+            )
+        ''')
+        self._conn.commit()
+
+    def _lookup(self, table: str, column: str, model: str, hashes: Iterable[str]) -> Dict[str, object]:
+        """指定テーブルからハッシュに一致する値をまとめて取得"""
+        keys = list(dict.fromkeys(hashes))
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_CHUNK_SIZE):
+                chunk = keys[i:i + _LOOKUP_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = self._conn.execute(
+                    f"SELECT content_hash, {column} FROM {table} "
+                    f"WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model, *chunk]
+                )
+                found.update(cursor.fetchall())
+        return found
+
+    def _store(self, table: str, column: str, model: str, rows: Iterable[tuple]) -> None:
+        """指定テーブルに値をまとめて保存（値の変換はロックの外で行い、書き込みのトランザクションを短くする）"""
+        rows = [(model, h, value) for h, value in rows]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {table} (model, content_hash, {column}) VALUES (?, ?, ?)", rows
+            )
+
+    def get_embeddings(self, model: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """キャッシュ済みEmbeddingを取得（float64で保存されたベクトルを復元）"""
+        found = self._lookup("embeddings", "vector", model, hashes)
+        result = {}
+        for h, blob in found.items():
+            vector = array("d")
+            vector.frombytes(blob)
+            result[h] = vector.tolist()
+        return result
+
+    def put_embeddings(self, model: str, items: Dict[str, List[float]]) -> None:
+        """
+        Embeddingをfloat64のバイト列として保存
+
+        APIの値（float64）をそのまま保存するため、キャッシュから取得した場合も出力されるJSONは同じになる
+        """
+        self._store("embeddings", "vector", model,
+                    ((h, array("d", vector).tobytes()) for h, vector in items.items()))
+
+    def get_keywords(self, model: str, hashes: Iterable[str]) -> Dict[str, List[str]]:
+        """キャッシュ済みキーワードを取得"""
+        found = self._lookup("keywords", "keywords", model, hashes)
+        return {h: json.loads(value) for h, value in found.items()}
+
+    def put_keywords(self, model: str, items: Dict[str, List[str]]) -> None:
+        """キーワードリストをJSON文字列として保存"""
+        self._store("keywords", "keywords", model,
+                    ((h, json.dumps(keywords, ensure_ascii=False)) for h, keywords in items.items()))
+
+    def close(self) -> None:
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -6,18 +6,63 @@ import sqlite3
 import os
 import time
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional, Tuple
 import threading
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'uploads.db')
+# スキーマ初期化など、まとめて実行したい処理のみで使用
 db_lock = threading.Lock()
 
-def get_connection():
-    """データベース接続を取得"""
-    conn = sqlite3.connect(DB_PATH)
+# 書き込みが競合した場合に待機する最大時間（ミリ秒）
+BUSY_TIMEOUT_MS = 5000
+
+# スレッドごとの接続（SQLiteの接続はスレッド間で共有しない）
+_local = threading.local()
+
+def connect_sqlite(path, **kwargs) -> sqlite3.Connection:
+    """
+    複数のプロセスで共有するSQLiteファイルの接続を作成（WALモード・書き込み競合時の待機を設定）
+
+    キャッシュ・チェックポイント・マニフェストのDBもワーカープロセス間で共有するため、この関数で開く
+    """
+    conn = sqlite3.connect(str(path), timeout=BUSY_TIMEOUT_MS / 1000, **kwargs)
+    # WALモード: 書き込み中でも読み込みをブロックしない
+    conn.execute('PRAGMA journal_mode=WAL')
+    # WALモードではNORMALでもクラッシュ時にDBが壊れない（直近のコミットが失われる可能性のみ）
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    return conn
+
+def _open_connection() -> sqlite3.Connection:
+    """新しい接続を作成し、プラグマを設定"""
+    conn = connect_sqlite(DB_PATH, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-8000')
+    return conn
+
+def get_connection() -> sqlite3.Connection:
+    """
+    現在のスレッドのデータベース接続を取得（無ければ作成）
+    
+    接続はスレッド内で使い回すため、呼び出し側で close しないこと
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
     return conn
 
+def close_connection():
+    """現在のスレッドの接続を閉じる（スレッド終了時や接続異常時に使用）"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
 def init_db():
     """データベースの初期化"""
     with db_lock:
@@ -44,9 +89,12 @@ def init_db():
                 json_files_deleted INTEGER DEFAULT 0,
                 current_step TEXT,
                 current_step_index INTEGER DEFAULT 0,
-                total_steps INTEGER DEFAULT 10,
+                total_steps INTEGER DEFAULT 11,
                 step_progress REAL DEFAULT 0,
-                estimated_remaining_time REAL DEFAULT 0
+                estimated_remaining_time REAL DEFAULT 0,
+                index_name_short TEXT,
+                file_hash TEXT,
+                progress_version INTEGER DEFAULT 0
             )
         ''')
         
@@ -58,9 +106,12 @@ def init_db():
             ('json_files_deleted', 'INTEGER DEFAULT 0'),
             ('current_step', 'TEXT'),
             ('current_step_index', 'INTEGER DEFAULT 0'),
-            ('total_steps', 'INTEGER DEFAULT 10'),
+            ('total_steps', 'INTEGER DEFAULT 11'),
             ('step_progress', 'REAL DEFAULT 0'),
-            ('estimated_remaining_time', 'REAL DEFAULT 0')
+            ('estimated_remaining_time', 'REAL DEFAULT 0'),
+            ('index_name_short', 'TEXT'),
+            ('file_hash', 'TEXT'),
+            ('progress_version', 'INTEGER DEFAULT 0')
         ]
         
         for column_name, column_type in new_columns:
@@ -84,63 +135,110 @@ def init_db():
             )
         ''')
         
-        # ロック状態テーブル
+        # アップロード履歴の一覧（新しい順のページング）・ステータス検索用のインデックス
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_uploads_upload_date ON uploads (upload_date, id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_uploads_status ON uploads (status)
+        ''')
+        # インデックス名ごとの最新のアップロード（同一ファイルの再アップロード判定）用のインデックス
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_uploads_index_name_short ON uploads (index_name_short, upload_date, id)
+        ''')
+        # 削除対象のインデックスファイルを持つ行のみのインデックス
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_uploads_index_excel_path ON uploads (upload_date, id)
+            WHERE index_excel_path IS NOT NULL
+        ''')
+        
+        # ログの時刻順取得用のインデックス
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_logs_task_id_timestamp ON logs (task_id, timestamp)
+        ''')
+        
+        # ログをタスクごとにID順で差分取得するためのインデックス
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS lock_status (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                is_locked INTEGER NOT NULL DEFAULT 0,
-                current_task_id TEXT,
-                locked_at TEXT
+            CREATE INDEX IF NOT EXISTS idx_logs_task_id_id ON logs (task_id, id)
+        ''')
+        
+        # ジョブキューテーブル（queued → running → done）
+        # concurrency_key（インデックス名）が同じジョブは1件ずつ、異なるジョブは並列に実行する
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                task_id TEXT PRIMARY KEY,
+                concurrency_key TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                FOREIGN KEY (task_id) REFERENCES uploads (task_id)
             )
         ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, enqueued_at)
+        ''')
+        try:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+            print("[INFO] jobs.owner列を追加しました")
+        except sqlite3.OperationalError:
+            pass  # 既に列が存在する場合
         
-        # 初期ロック状態を挿入
+        # リーステーブル（有効期限付きのロック）
+        # 保持者（owner）がハートビートで expires_at を延長し続ける。期限切れのリースは他の保持者が取得できる
         cursor.execute('''
-            INSERT OR IGNORE INTO lock_status (id, is_locked) VALUES (1, 0)
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                task_id TEXT,
+                acquired_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                heartbeat_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_leases_owner ON leases (owner)
         ''')
         
         conn.commit()
-        conn.close()
 
 def create_upload_record(task_id: str, filename: str, approver_email: str, 
-                        worker_email: str) -> int:
+                        worker_email: str, index_name_short: Optional[str] = None,
+                        status: str = 'processing', file_hash: Optional[str] = None,
+                        total_steps: int = 11) -> int:
     """アップロード記録を作成"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        upload_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        cursor.execute('''
+    conn = get_connection()
+    upload_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    # 既存のDBでは列の既定値が古いステップ数のままのため、明示して登録する
+    with conn:
+        cursor = conn.execute('''
             INSERT INTO uploads (task_id, filename, approver_email, worker_email, 
-                               upload_date, status)
-            VALUES (?, ?, ?, ?, ?, 'processing')
-        ''', (task_id, filename, approver_email, worker_email, upload_date))
-        
-        upload_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return upload_id
+                               upload_date, status, index_name_short, file_hash, total_steps)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (task_id, filename, approver_email, worker_email, upload_date, status, index_name_short,
+              file_hash, total_steps))
+    
+    return cursor.lastrowid
 
 def update_upload_status(task_id: str, status: str, error_message: Optional[str] = None):
     """アップロード記録のステータスを更新"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
+    conn = get_connection()
+    
+    with conn:
         if status == 'processing':
             start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute('''
+            conn.execute('''
                 UPDATE uploads SET status = ?, start_time = ?
                 WHERE task_id = ?
             ''', (status, start_time, task_id))
         elif status in ['completed', 'error']:
             end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute('''
+            result = conn.execute('''
                 SELECT start_time FROM uploads WHERE task_id = ?
-            ''', (task_id,))
-            result = cursor.fetchone()
+            ''', (task_id,)).fetchone()
             
             duration = 0
             if result and result['start_time']:
@@ -148,179 +246,227 @@ def update_upload_status(task_id: str, status: str, error_message: Optional[str]
                 end = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S')
                 duration = (end - start).total_seconds()
             
-            cursor.execute('''
+            conn.execute('''
                 UPDATE uploads SET status = ?, end_time = ?, duration = ?, error_message = ?
                 WHERE task_id = ?
             ''', (status, end_time, duration, error_message, task_id))
-        
-        conn.commit()
-        conn.close()
 
-def update_index_excel_path(task_id: str, index_excel_path: str):
+def update_index_excel_path(task_id: str, index_excel_path: Optional[str]):
     """インデックス化データ一覧のファイルパスを更新"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+    conn = get_connection()
+    
+    with conn:
+        conn.execute('''
             UPDATE uploads SET index_excel_path = ?
             WHERE task_id = ?
         ''', (index_excel_path, task_id))
-        
-        conn.commit()
-        conn.close()
+
+def log_timestamp() -> str:
+    """ログのタイムスタンプ文字列（ミリ秒まで）を返す"""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
 def add_log(task_id: str, level: str, step_name: str, message: str, progress: int = 0):
     """ログを追加"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        
-        cursor.execute('''
+    add_logs([(task_id, log_timestamp(), level, step_name, message, progress)])
+
+def add_logs(rows: List[Tuple[str, str, str, str, str, int]]):
+    """ログをまとめて追加（(task_id, timestamp, level, step_name, message, progress) のリスト）"""
+    if not rows:
+        return
+    conn = get_connection()
+    
+    with conn:
+        conn.executemany('''
             INSERT INTO logs (task_id, timestamp, level, step_name, message, progress)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (task_id, timestamp, level, step_name, message, progress))
-        
-        conn.commit()
-        conn.close()
+        ''', rows)
 
 def get_all_uploads() -> List[Dict]:
     """すべてのアップロード記録を取得"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM uploads ORDER BY upload_date DESC
-        ''')
-        
-        uploads = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return uploads
+    conn = get_connection()
+    
+    rows = conn.execute('''
+        SELECT * FROM uploads ORDER BY upload_date DESC, id DESC
+    ''').fetchall()
+    
+    return [dict(row) for row in rows]
+
+def get_uploads_page(limit: int, cursor: Optional[Tuple[str, int]] = None
+                     ) -> Tuple[List[Dict], Optional[Tuple[str, int]]]:
+    """
+    アップロード記録を新しい順に1ページ分取得（キーセットページング）
+    
+    Args:
+        limit: 1ページの件数
+        cursor: 前ページの最後の行の (upload_date, id)。Noneの場合は先頭ページ
+        
+    Returns:
+        Tuple[List[Dict], Optional[Tuple[str, int]]]: (アップロード記録, 次ページのカーソル（最終ページはNone）)
+    """
+    conn = get_connection()
+    
+    if cursor is None:
+        rows = conn.execute('''
+            SELECT * FROM uploads ORDER BY upload_date DESC, id DESC LIMIT ?
+        ''', (limit + 1,)).fetchall()
+    else:
+        rows = conn.execute('''
+            SELECT * FROM uploads WHERE (upload_date, id) < (?, ?)
+            ORDER BY upload_date DESC, id DESC LIMIT ?
+        ''', (cursor[0], cursor[1], limit + 1)).fetchall()
+    
+    uploads = [dict(row) for row in rows[:limit]]
+    next_cursor = (uploads[-1]['upload_date'], uploads[-1]['id']) if len(rows) > limit else None
+    return uploads, next_cursor
+
+def get_uploads_with_index_file_beyond(keep: int) -> List[Dict]:
+    """新しい順に keep 件目より後のアップロード記録のうち、インデックスファイルを持つものを取得"""
+    conn = get_connection()
+    
+    # keep 件目の (upload_date, id) より古く、インデックスファイルが残っている行のみを読む
+    rows = conn.execute('''
+        SELECT task_id, index_excel_path FROM uploads
+        WHERE index_excel_path IS NOT NULL
+          AND (upload_date, id) < (
+              SELECT upload_date, id FROM uploads
+              ORDER BY upload_date DESC, id DESC LIMIT 1 OFFSET ?
+          )
+        ORDER BY upload_date DESC, id DESC
+    ''', (keep - 1,)).fetchall()
+    
+    return [dict(row) for row in rows]
 
 def get_upload_by_task_id(task_id: str) -> Optional[Dict]:
     """タスクIDでアップロード記録を取得"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM uploads WHERE task_id = ?
-        ''', (task_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        return dict(result) if result else None
+    conn = get_connection()
+    
+    result = conn.execute('''
+        SELECT * FROM uploads WHERE task_id = ?
+    ''', (task_id,)).fetchone()
+    
+    return dict(result) if result else None
+
+def get_latest_upload_for_index(index_name_short: str) -> Optional[Dict]:
+    """インデックス名の最新のアップロード記録を取得"""
+    conn = get_connection()
+    
+    result = conn.execute('''
+        SELECT * FROM uploads WHERE index_name_short = ?
+        ORDER BY upload_date DESC, id DESC
+        LIMIT 1
+    ''', (index_name_short,)).fetchone()
+    
+    return dict(result) if result else None
 
 def get_logs_by_task_id(task_id: str) -> List[Dict]:
     """タスクIDでログを取得"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM logs WHERE task_id = ? ORDER BY timestamp ASC
-        ''', (task_id,))
-        
-        logs = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return logs
-
-def set_lock(is_locked: bool, task_id: Optional[str] = None):
-    """ロック状態を設定"""
-    max_retries = 3
-    retry_delay = 0.5
+    conn = get_connection()
     
-    for attempt in range(max_retries):
-        try:
-            with db_lock:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                locked_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S') if is_locked else None
-                
-                cursor.execute('''
-                    UPDATE lock_status SET is_locked = ?, current_task_id = ?, locked_at = ?
-                    WHERE id = 1
-                ''', (1 if is_locked else 0, task_id, locked_at))
-                
-                conn.commit()
-                conn.close()
-                
-                # 成功したらリターン
-                return
-                
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"ロック設定失敗 (試行 {attempt + 1}/{max_retries}): {e}")
-                time.sleep(retry_delay)
-            else:
-                # 最後の試行でも失敗した場合
-                print(f"ロック設定の全試行が失敗しました: {e}")
-                raise
-
-def get_lock_status() -> Dict:
-    """ロック状態を取得"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM lock_status WHERE id = 1
-        ''')
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        return dict(result) if result else {'is_locked': 0, 'current_task_id': None}
+    rows = conn.execute('''
+        SELECT * FROM logs WHERE task_id = ? ORDER BY timestamp ASC
+    ''', (task_id,)).fetchall()
+    
+    return [dict(row) for row in rows]
 
-def is_locked() -> bool:
-    """ロックされているかチェック"""
-    status = get_lock_status()
-    return bool(status['is_locked'])
+def get_logs_since(task_id: str, last_id: int = 0, limit: Optional[int] = None) -> List[Dict]:
+    """タスクIDでログを取得（IDが last_id より大きいもののみ、ID順）"""
+    conn = get_connection()
+    
+    rows = conn.execute('''
+        SELECT * FROM logs WHERE task_id = ? AND id > ? ORDER BY id ASC LIMIT ?
+    ''', (task_id, last_id, -1 if limit is None else limit)).fetchall()
+    
+    return [dict(row) for row in rows]
 
 def update_processing_stats(task_id: str, record_count: Optional[int] = None,
                             json_files_created: Optional[int] = None,
                             json_files_deleted: Optional[int] = None):
     """処理統計情報を更新"""
-    with db_lock:
+    update_parts = []
+    params = []
+    
+    if record_count is not None:
+        update_parts.append('record_count = ?')
+        params.append(record_count)
+    if json_files_created is not None:
+        update_parts.append('json_files_created = ?')
+        params.append(json_files_created)
+    if json_files_deleted is not None:
+        update_parts.append('json_files_deleted = ?')
+        params.append(json_files_deleted)
+    
+    if update_parts:
+        params.append(task_id)
+        query = f"UPDATE uploads SET {', '.join(update_parts)} WHERE task_id = ?"
         conn = get_connection()
-        cursor = conn.cursor()
-        
-        update_parts = []
-        params = []
-        
-        if record_count is not None:
-            update_parts.append('record_count = ?')
-            params.append(record_count)
-        if json_files_created is not None:
-            update_parts.append('json_files_created = ?')
-            params.append(json_files_created)
-        if json_files_deleted is not None:
-            update_parts.append('json_files_deleted = ?')
-            params.append(json_files_deleted)
-        
-        if update_parts:
-            params.append(task_id)
-            query = f"UPDATE uploads SET {', '.join(update_parts)} WHERE task_id = ?"
-            cursor.execute(query, params)
-            conn.commit()
-        
-        conn.close()
+        with conn:
+            conn.execute(query, params)
+
+def bump_progress_versions(task_ids: Iterable[str]):
+    """タスクの進捗の更新番号を進める（他のプロセスのSSEへの通知に使用）"""
+    conn = get_connection()
+    
+    with conn:
+        conn.executemany('''
+            UPDATE uploads SET progress_version = progress_version + 1 WHERE task_id = ?
+        ''', [(task_id,) for task_id in task_ids])
+
+def write_progress(logs: List[Tuple[str, str, str, str, str, int]],
+                   steps: Dict[str, Tuple[str, int, float, float]],
+                   bump_task_ids: Iterable[str] = ()):
+    """
+    ログとステップ進捗を1つのトランザクションで書き込む
+
+    Args:
+        logs: (task_id, timestamp, level, step_name, message, progress) のリスト
+        steps: task_id -> (current_step, current_step_index, step_progress, estimated_remaining_time)
+        bump_task_ids: 同じトランザクションで更新番号を進めるタスク（他のプロセスのSSEへの通知）
+    """
+    bump_task_ids = list(bump_task_ids)
+    if not logs and not steps and not bump_task_ids:
+        return
+    conn = get_connection()
+    
+    with conn:
+        if logs:
+            conn.executemany('''
+                INSERT INTO logs (task_id, timestamp, level, step_name, message, progress)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', logs)
+        if steps:
+            conn.executemany('''
+                UPDATE uploads 
+                SET current_step = ?, 
+                    current_step_index = ?,
+                    step_progress = ?,
+                    estimated_remaining_time = ?
+                WHERE task_id = ?
+            ''', [(*step, task_id) for task_id, step in steps.items()])
+        if bump_task_ids:
+            conn.executemany('''
+                UPDATE uploads SET progress_version = progress_version + 1 WHERE task_id = ?
+            ''', [(task_id,) for task_id in bump_task_ids])
+
+def get_progress_versions(task_ids: List[str]) -> Dict[str, int]:
+    """タスクの進捗の更新番号を取得"""
+    if not task_ids:
+        return {}
+    conn = get_connection()
+    
+    placeholders = ', '.join('?' * len(task_ids))
+    rows = conn.execute(f'''
+        SELECT task_id, progress_version FROM uploads WHERE task_id IN ({placeholders})
+    ''', task_ids).fetchall()
+    
+    return {row['task_id']: row['progress_version'] or 0 for row in rows}
 
 def update_step_progress(task_id: str, current_step: str, current_step_index: int,
                         step_progress: float, estimated_remaining_time: float = 0):
     """ステップ進捗情報を更新"""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+    conn = get_connection()
+    
+    with conn:
+        conn.execute('''
             UPDATE uploads 
             SET current_step = ?, 
                 current_step_index = ?,
@@ -328,7 +474,238 @@ def update_step_progress(task_id: str, current_step: str, current_step_index: in
                 estimated_remaining_time = ?
             WHERE task_id = ?
         ''', (current_step, current_step_index, step_progress, estimated_remaining_time, task_id))
+
+def enqueue_job(task_id: str, concurrency_key: str, file_path: str):
+    """ジョブをキューに追加"""
+    conn = get_connection()
+    
+    with conn:
+        conn.execute('''
+            INSERT INTO jobs (task_id, concurrency_key, file_path, status, enqueued_at)
+            VALUES (?, ?, ?, 'queued', ?)
+        ''', (task_id, concurrency_key, file_path, time.time()))
+
+def job_lease_name(concurrency_key: str) -> str:
+    """ジョブの同時実行キーに対応するリース名"""
+    return f'job:{concurrency_key}'
+
+def _insert_lease(conn: sqlite3.Connection, name: str, owner: str, ttl_sec: float,
+                  task_id: Optional[str], now: float) -> bool:
+    """リースを取得（未取得または期限切れの場合のみ）。呼び出し側のトランザクション内で実行する"""
+    cursor = conn.execute('''
+        INSERT INTO leases (name, owner, task_id, acquired_at, expires_at, heartbeat_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET
+            owner = excluded.owner,
+            task_id = excluded.task_id,
+            acquired_at = excluded.acquired_at,
+            expires_at = excluded.expires_at,
+            heartbeat_at = excluded.heartbeat_at
+        WHERE leases.expires_at < excluded.acquired_at
+    ''', (name, owner, task_id, now, now + ttl_sec, now))
+    return cursor.rowcount == 1
+
+def acquire_lease(name: str, owner: str, ttl_sec: float, task_id: Optional[str] = None) -> bool:
+    """
+    リースを取得
+    
+    Returns:
+        bool: 取得できた場合True（他の保持者の有効なリースがある場合はFalse）
+    """
+    conn = get_connection()
+    
+    with conn:
+        return _insert_lease(conn, name, owner, ttl_sec, task_id, time.time())
+
+def renew_leases(owner: str, ttl_sec: float) -> int:
+    """
+    保持しているリースの有効期限を延長（ハートビート）
+    
+    Returns:
+        int: 延長したリースの数
+    """
+    conn = get_connection()
+    now = time.time()
+    
+    with conn:
+        cursor = conn.execute('''
+            UPDATE leases SET expires_at = ?, heartbeat_at = ?
+            WHERE owner = ? AND expires_at >= ?
+        ''', (now + ttl_sec, now, owner, now))
+    
+    return cursor.rowcount
+
+def release_lease(name: str, owner: str):
+    """リースを解放（他の保持者に取得し直されている場合は何もしない）"""
+    conn = get_connection()
+    
+    with conn:
+        conn.execute('''
+            DELETE FROM leases WHERE name = ? AND owner = ?
+        ''', (name, owner))
+
+def get_leases() -> List[Dict]:
+    """リースの一覧を取得"""
+    conn = get_connection()
+    
+    rows = conn.execute('''
+        SELECT * FROM leases ORDER BY acquired_at
+    ''').fetchall()
+    
+    return [dict(row) for row in rows]
+
+def expire_task_leases(task_id: str):
+    """タスクのリースを期限切れにする（手動での強制解除用）"""
+    conn = get_connection()
+    
+    with conn:
+        conn.execute('''
+            UPDATE leases SET expires_at = 0 WHERE task_id = ?
+        ''', (task_id,))
+
+def _expire_stale_jobs(conn: sqlite3.Connection, now: float, error_message: str) -> List[str]:
+    """
+    リースが期限切れになった実行中のジョブ（保持者が停止したもの）を完了にし、アップロード記録をエラーにする
+    呼び出し側のトランザクション内で実行する
+    """
+    rows = conn.execute('''
+        SELECT task_id FROM jobs AS j
+        WHERE j.status = 'running'
+          AND NOT EXISTS (
+              SELECT 1 FROM leases AS l
+              WHERE l.name = 'job:' || j.concurrency_key AND l.task_id = j.task_id AND l.expires_at >= ?
+          )
+    ''', (now,)).fetchall()
+    
+    end_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for row in rows:
+        conn.execute('''
+            UPDATE uploads
+            SET status = 'error', end_time = ?, error_message = ?,
+                duration = CASE WHEN start_time IS NULL THEN 0
+                                ELSE ROUND((julianday(?) - julianday(start_time)) * 86400) END
+            WHERE task_id = ? AND status NOT IN ('completed', 'error')
+        ''', (end_time, error_message, end_time, row['task_id']))
+        conn.execute('''
+            UPDATE jobs SET status = 'done', finished_at = ? WHERE task_id = ?
+        ''', (now, row['task_id']))
+    
+    conn.execute('''
+        DELETE FROM leases WHERE expires_at < ?
+    ''', (now,))
+    return [row['task_id'] for row in rows]
+
+def expire_stale_jobs(error_message: str) -> List[str]:
+    """
+    リースが期限切れになった実行中のジョブを完了にし、アップロード記録をエラーにする
+    
+    Returns:
+        List[str]: 完了にしたジョブのタスクID
+    """
+    conn = get_connection()
+    
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        task_ids = _expire_stale_jobs(conn, time.time(), error_message)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return task_ids
+
+def claim_next_job(owner: str, lease_sec: float, stale_error_message: str) -> Optional[Dict]:
+    """
+    実行可能なジョブを1件取り出して running にし、同時実行キーのリースを取得する
+    
+    同じ concurrency_key のリースが有効な場合は、その後ろのジョブを飛ばして次のキーのジョブを取り出す。
+    取り出す前に、リースが期限切れになったジョブ（保持者が停止したもの）をエラーにしてキーを解放する
+    
+    Args:
+        owner: リースの保持者ID
+        lease_sec: リースの有効秒数
+        stale_error_message: 期限切れのジョブに記録するエラーメッセージ
+        
+    Returns:
+        Optional[Dict]: 取り出したジョブ（実行可能なジョブが無い場合はNone）
+    """
+    conn = get_connection()
+    
+    # 選択と更新の間に他の接続（他のプロセスを含む）が同じジョブを取り出さないよう、書き込みロックを先に取る
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        now = time.time()
+        stale = _expire_stale_jobs(conn, now, stale_error_message)
+        for task_id in stale:
+            print(f"[WARNING] リースが期限切れになったジョブをエラーにしました (task_id: {task_id})")
+        
+        row = conn.execute('''
+            SELECT * FROM jobs AS j
+            WHERE j.status = 'queued'
+              AND NOT EXISTS (
+                  SELECT 1 FROM leases AS l WHERE l.name = 'job:' || j.concurrency_key
+              )
+            ORDER BY j.enqueued_at
+            LIMIT 1
+        ''').fetchone()
+        if row is None:
+            conn.commit()
+            return None
         
+        _insert_lease(conn, job_lease_name(row['concurrency_key']), owner, lease_sec, row['task_id'], now)
+        conn.execute('''
+            UPDATE jobs SET status = 'running', started_at = ?, owner = ? WHERE task_id = ?
+        ''', (now, owner, row['task_id']))
         conn.commit()
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    job = dict(row)
+    job.update(status='running', started_at=now, owner=owner)
+    return job
+
+def finish_job(task_id: str, owner: str):
+    """ジョブを完了にし、同時実行キーのリースを解放する"""
+    conn = get_connection()
+    
+    with conn:
+        conn.execute('''
+            UPDATE jobs SET status = 'done', finished_at = ? WHERE task_id = ? AND owner = ?
+        ''', (time.time(), task_id, owner))
+        conn.execute('''
+            DELETE FROM leases WHERE task_id = ? AND owner = ? AND name LIKE 'job:%'
+        ''', (task_id, owner))
+
+def get_job(task_id: str) -> Optional[Dict]:
+    """ジョブを取得"""
+    conn = get_connection()
+    
+    row = conn.execute('''
+        SELECT * FROM jobs WHERE task_id = ?
+    ''', (task_id,)).fetchone()
+    
+    return dict(row) if row else None
 
+def get_active_jobs() -> List[Dict]:
+    """待機中・実行中のジョブを取得（キューに追加された順）"""
+    conn = get_connection()
+    
+    rows = conn.execute('''
+        SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY enqueued_at
+    ''').fetchall()
+    
+    return [dict(row) for row in rows]
+
+def get_average_duration(limit: int = 20) -> Optional[float]:
+    """直近の正常終了したアップロードの平均処理時間（秒）"""
+    conn = get_connection()
+    
+    row = conn.execute('''
+        SELECT AVG(duration) AS avg_duration FROM (
+            SELECT duration FROM uploads
+            WHERE status = 'completed' AND duration > 0
+            ORDER BY upload_date DESC, id DESC LIMIT ?
+        )
+    ''', (limit,)).fetchone()
+    
+    return row['avg_duration'] if row else None
@@ -11,22 +11,41 @@ import re
 import uuid
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 from decimal import Decimal
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import asyncio
+import threading
 
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-from tenacity import retry, stop_after_attempt, wait_fixed
+from openai import AzureOpenAI, BadRequestError
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_fixed
 from langchain_openai import AzureChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import SimpleJsonOutputParser
 import requests
-from requests.auth import HTTPBasicAuth
 from tqdm import tqdm
 
+try:
+    import orjson
+except ImportError:  # orjson未インストール時は標準jsonで出力
+    orjson = None
+
+try:
+    import python_calamine  # noqa: F401
+except ImportError:  # python-calamine未インストール時はopenpyxlで読み込む
+    python_calamine = None
+
+from content_cache import ContentCache, content_hash
+from checkpoint_store import CheckpointStore, compute_run_key
+from index_manifest import IndexManifest, ManifestEntry
+from git_local_push import commit_files_local
+from tag_index import TagSummary, fetch_tag_summary
+from jenkins_client import JenkinsClient
+
 logger = logging.getLogger(__name__)
 
 # .env ファイルをロード（flask_appの1つ上の階層）
@@ -53,7 +72,10 @@ GITLAB_PROJECT_ID = os.getenv("PROJECT_ID", "")
 GITLAB_TOKEN = os.getenv("GIT_TOKEN", "")
 GITLAB_BRANCH = os.getenv("BRANCH", "main")
 GITLAB_REMOTE_PATH_PREFIX = "index/contents"
-TAG_PATTERN = re.compile(r"^(\d{3})-(\d{8})$")
+# コミット方式: "api"（Commits APIで分割コミット） / "local"（ローカルクローンで1コミット・1push）
+GIT_COMMIT_BACKEND = os.getenv("GIT_COMMIT_BACKEND", "api").lower()
+GIT_REPO_URL = os.getenv("REPO_URL", "")
+GIT_LOCAL_WORKDIR = Path(os.getenv("GIT_LOCAL_WORKDIR", str(Path(__file__).parent / "data" / "git_work")))
 TAG_MESSAGE = os.getenv("TAG_MESSAGE", "auto tag")
 
 # FastAPI設定
@@ -72,14 +94,38 @@ VERIFY_SSL = os.getenv("VERIFY_SSL", "true").lower() != "false"
 HTTP_PROXY = os.getenv('HTTP_PROXY')
 HTTPS_PROXY = os.getenv('HTTPS_PROXY')
 
-# バッチサイズ
-BATCH_SIZE = 100
+# 入力Excel設定
+RAG_SHEET_NAME = "rag"
+REQUIRED_COLUMNS = [
+    "thread_id", "group_id", "update_timestamp", "content", "content_embedding",
+    "category_id_large", "category_id_medium", "category_id_small",
+    "effective_start_date", "effective_end_date"
+]
+OPTIONAL_COLUMNS = ["rag_id", "content_en"]
+DATE_COLUMNS = ["update_timestamp", "effective_start_date", "effective_end_date"]
+# アップロード時の事前検証で確認する先頭行数
+PREFLIGHT_SAMPLE_ROWS = 100
+# 複数ファイルを並列に読み込むプロセス数
+EXCEL_READ_WORKERS = max(1, int(os.getenv("EXCEL_READ_WORKERS", str(min(4, os.cpu_count() or 1)))))
+# calamineエンジンはpython-calamineがある場合のみ使用（pandas 2.2以降が必要）
+EXCEL_READ_ENGINE = "calamine" if python_calamine is not None else "openpyxl"
+
+# Embedding / キーワードのキャッシュ（contentが変わらない行はAzureを呼ばない）
+CONTENT_CACHE_ENABLED = os.getenv("CONTENT_CACHE_ENABLED", "true").lower() != "false"
+# 新しく抽出したキーワードをキャッシュへまとめて書き込む件数
+KEYWORD_CACHE_FLUSH_SIZE = 100
+
+# 前回デプロイしたインデックスとの差分判定（変更の無い行はEmbedding・キーワード・コミットを行わない）
+INDEX_MANIFEST_ENABLED = os.getenv("INDEX_MANIFEST_ENABLED", "true").lower() != "false"
+
+# チェックポイント（同じ入力での再実行時に完了済みレコードから再開）
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "true").lower() != "false"
+CHECKPOINT_FLUSH_SIZE = 100
 
 # タイムアウト設定
 TIMEOUT = (10, 30)
 QUEUE_WAIT_SEC = 300
 BUILD_WAIT_SEC = 1800
-POLL_INTERVAL = 2.0
 
 
 # =====================================================
@@ -141,13 +187,109 @@ def parse_category_id(value) -> str:
         return "-"
 
 
+def parse_category_id_column(series: pd.Series) -> pd.Series:
+    """カテゴリID列をまとめて整数文字列またはハイフンに変換（parse_category_idの列版）"""
+    numbers = pd.to_numeric(series, errors="coerce")
+    is_integer = numbers.notna() & np.isfinite(numbers) & (numbers % 1 == 0)
+    result = pd.Series("-", index=series.index, dtype=object)
+    result[is_integer] = numbers[is_integer].astype("int64").astype(str)
+    return result
+
+
+def format_date_column(series: pd.Series) -> pd.Series:
+    """
+    YYYYMMDD形式の日付列をまとめてYYYY-MM-DD形式に変換（欠損値はそのまま）
+    
+    Raises:
+        ValueError: YYYYMMDD形式でない値が含まれる場合
+    """
+    numbers = pd.to_numeric(series, errors="coerce")
+    # 数値として読み込まれた列（20250101.0 など）は整数文字列に戻してから解釈する
+    text = series.astype(object).where(numbers.isna(), numbers.astype("Int64").astype(str))
+    text = text.where(series.notna())
+    try:
+        dates = pd.to_datetime(text, format="%Y%m%d")
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"{series.name}: YYYYMMDD形式ではない値があります - {e}")
+    return dates.dt.strftime("%Y-%m-%d").where(series.notna(), series)
+
+
 # =====================================================
 # Step 1: ファイル検証（読み込みと検証）
 # =====================================================
+def read_excel_header(file: Path, sheet_name: str = RAG_SHEET_NAME) -> List[str]:
+    """
+    Excelファイルのヘッダー行のみを読み込む（本体は読み込まない）
+    
+    Raises:
+        ValueError: 指定シートが存在しない場合
+    """
+    wb = load_workbook(file, read_only=True)
+    try:
+        if sheet_name not in wb.sheetnames:
+            raise ValueError(f"シート '{sheet_name}' が見つかりません")
+        header = next(wb[sheet_name].iter_rows(min_row=1, max_row=1, values_only=True), ())
+        return [str(value) for value in header if value is not None]
+    finally:
+        wb.close()
+
+
+def find_missing_columns(columns: List[str]) -> List[str]:
+    """必須列のうち存在しない列を返す"""
+    present = set(columns)
+    return [col for col in REQUIRED_COLUMNS if col not in present]
+
+
+def preflight_validate_excel(source, sample_rows: int = PREFLIGHT_SAMPLE_ROWS) -> None:
+    """
+    アップロード直後にragシートのヘッダー行と先頭の数行のみを読み込み、処理可能なファイルか検証
+    
+    Args:
+        source: Excelファイルのパスまたはファイルオブジェクト
+        sample_rows: 検証する先頭のデータ行数
+        
+    Raises:
+        ValueError: シート・必須列・日付形式に問題がある場合
+    """
+    try:
+        wb = load_workbook(source, read_only=True, data_only=True)
+    except Exception as e:
+        raise ValueError(f"Excelファイルを開けません: {str(e)}")
+    
+    try:
+        if RAG_SHEET_NAME not in wb.sheetnames:
+            raise ValueError(f"シート '{RAG_SHEET_NAME}' が見つかりません")
+        rows = wb[RAG_SHEET_NAME].iter_rows(min_row=1, max_row=sample_rows + 1, values_only=True)
+        header = [str(value) if value is not None else "" for value in next(rows, ())]
+        sample = [row[:len(header)] + (None,) * (len(header) - len(row)) for row in rows]
+    finally:
+        wb.close()
+    
+    missing_columns = find_missing_columns(header)
+    if missing_columns:
+        raise ValueError(f"必須列が不足しています: {', '.join(missing_columns)}")
+    
+    sample = [row for row in sample if any(value is not None for value in row)]
+    if not sample:
+        raise ValueError(f"シート '{RAG_SHEET_NAME}' にデータ行がありません")
+    
+    df_sample = pd.DataFrame(sample, columns=header)
+    for col in DATE_COLUMNS:
+        format_date_column(df_sample[col])
+
+
+def _read_rag_sheet(file: Path, columns: List[str]) -> pd.DataFrame:
+    """ragシートの指定列のみを読み込む（ワーカープロセスで実行）"""
+    return pd.read_excel(file, sheet_name=RAG_SHEET_NAME, usecols=columns, engine=EXCEL_READ_ENGINE)
+
+
 def read_and_validate_excel_files(input_dir: Path, callback=None) -> pd.DataFrame:
     """
     フォルダ内のすべてのExcelファイルを読み込み結合する
     
+    先に各ファイルのヘッダー行だけで必須列を検証し、問題がなければ
+    必要な列のみを複数プロセスで並列に読み込む
+    
     Args:
         input_dir: 入力ディレクトリ
         callback: 進捗報告用コールバック
@@ -157,9 +299,9 @@ def read_and_validate_excel_files(input_dir: Path, callback=None) -> pd.DataFram
         
     Raises:
         FileNotFoundError: Excelファイルが見つからない場合
-        ValueError: Excelファイルの読み込みに失敗した場合
+        ValueError: Excelファイルの読み込みに失敗した場合、または必須列が不足している場合
     """
-    excel_files = list(input_dir.glob("*.xlsx"))
+    excel_files = sorted(input_dir.glob("*.xlsx"))
     
     if not excel_files:
         raise FileNotFoundError(f"フォルダ内にExcelファイルが見つかりませんでした: {input_dir}")
@@ -167,24 +309,59 @@ def read_and_validate_excel_files(input_dir: Path, callback=None) -> pd.DataFram
     if callback:
         callback.log_info("ファイル検証", f"{len(excel_files)}個のExcelファイルを検出", 5)
     
+    # ヘッダー行のみで必須列を検証し、読み込む列を決定
+    usecols = []
+    for file in excel_files:
+        try:
+            header = read_excel_header(file)
+        except Exception as e:
+            error_msg = f"ファイル読み込みエラー: {file.name} - {str(e)}"
+            if callback:
+                callback.log_error("ファイル検証", error_msg, 5)
+            raise ValueError(error_msg)
+        
+        missing_columns = find_missing_columns(header)
+        if missing_columns:
+            error_msg = f"必須列が不足しています: {file.name} - {', '.join(missing_columns)}"
+            if callback:
+                callback.log_error("ファイル検証", error_msg, 5)
+            raise ValueError(error_msg)
+        
+        usecols.append([col for col in REQUIRED_COLUMNS + OPTIONAL_COLUMNS if col in header])
+    
+    if callback:
+        callback.log_info("ファイル検証", f"ヘッダー検証完了（読み込みエンジン: {EXCEL_READ_ENGINE}）", 6)
+    
+    # 本体の読み込み（複数ファイルはプロセスを分けて並列に解析）
     data_frames = []
-    with tqdm(total=len(excel_files), desc="Excel読み込み", disable=callback is None) as pbar:
-        for i, file in enumerate(excel_files):
-            try:
-                if callback:
-                    callback.log_info("ファイル検証", f"読み込み中: {file.name}", 5 + int((i / len(excel_files)) * 10))
-                
-                df = pd.read_excel(file, sheet_name="rag")
-                data_frames.append(df)
-                pbar.update(1)
+    workers = min(EXCEL_READ_WORKERS, len(excel_files))
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if executor:
+            futures = [executor.submit(_read_rag_sheet, file, columns)
+                       for file, columns in zip(excel_files, usecols)]
+        
+        with tqdm(total=len(excel_files), desc="Excel読み込み", disable=callback is None) as pbar:
+            for i, file in enumerate(excel_files):
+                try:
+                    df = futures[i].result() if executor else _read_rag_sheet(file, usecols[i])
+                    data_frames.append(df)
+                    pbar.update(1)
+                    
+                except Exception as e:
+                    error_msg = f"ファイル読み込みエラー: {file.name} - {str(e)}"
+                    if callback:
+                        callback.log_error("ファイル検証", error_msg, 5)
+                    raise ValueError(error_msg)
                 
-            except Exception as e:
-                error_msg = f"ファイル読み込みエラー: {file.name} - {str(e)}"
                 if callback:
-                    callback.log_error("ファイル検証", error_msg, 5)
-                raise ValueError(error_msg)
+                    callback.log_info("ファイル検証", f"読み込み完了: {file.name}",
+                                      5 + int(((i + 1) / len(excel_files)) * 10))
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
     
-    # データフレームを結合
+    # データフレームを結合（ファイル名順）
     merged_df = pd.concat(data_frames, ignore_index=True)
     
     if callback:
@@ -210,14 +387,8 @@ def validate_data_content(df: pd.DataFrame, callback=None) -> Tuple[pd.DataFrame
     Raises:
         ValueError: 必須列が存在しない場合
     """
-    required_columns = [
-        "thread_id", "group_id", "update_timestamp", "content", "content_embedding",
-        "category_id_large", "category_id_medium", "category_id_small",
-        "effective_start_date", "effective_end_date"
-    ]
-    
     # 必須列のチェック
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = find_missing_columns(list(df.columns))
     if missing_columns:
         error_msg = f"必須列が不足しています: {', '.join(missing_columns)}"
         if callback:
@@ -243,9 +414,196 @@ def validate_data_content(df: pd.DataFrame, callback=None) -> Tuple[pd.DataFrame
 
 
 # =====================================================
-# Step 3: UUID生成
+# Step 3: 差分判定（前回デプロイしたインデックスとの比較）
+# =====================================================
+# 差分の種類
+DIFF_NEW = "new"                # 新規
+DIFF_CONTENT = "content"        # contentの更新（Embedding・キーワードを取得し直す）
+DIFF_METADATA = "metadata"      # メタデータのみの更新（Embedding・キーワードはマニフェストから引き継ぐ）
+DIFF_UNCHANGED = "unchanged"    # 変更なし（出力・コミットしない）
+
+
+def compute_record_hashes(df: pd.DataFrame) -> List[ManifestEntry]:
+    """
+    各行の (レコードキー, contentハッシュ, メタデータハッシュ) を計算
+    
+    レコードキーは thread_id と group_id の組。値はJSONレコードと同じ変換をした後のものを使う
+    """
+    fields = build_record_fields(df)
+    metadata_names = [name for name in RECORD_FIELD_NAMES if name != "content"]
+    return [
+        (
+            json.dumps([fields["thread_id"][i], fields["group_id"][i]], ensure_ascii=False),
+            content_hash(fields["content"][i]),
+            content_hash(json.dumps([fields[name][i] for name in metadata_names], ensure_ascii=False)),
+        )
+        for i in range(len(df))
+    ]
+
+
+def _take_unmatched(candidates: Optional[List[str]], matched: set) -> Optional[str]:
+    """候補のrag_idのうち、まだ対応付けていない最初のものを返す"""
+    for rag_id in candidates or ():
+        if rag_id not in matched:
+            return rag_id
+    return None
+
+
+def diff_against_manifest(
+    hashes: List[ManifestEntry],
+    delete_list: List[str],
+    manifest_records: Dict[str, ManifestEntry],
+    callback=None
+) -> Tuple[List[Optional[str]], List[str], List[str]]:
+    """
+    登録対象の行を前回デプロイしたインデックス（マニフェスト）と比較して分類
+    
+    - レコードキーとcontentが同じデプロイ済みレコードがあれば、そのrag_idを引き継ぐ
+      （メタデータも同じなら変更なし、異なればメタデータのみの更新）
+    - 無ければ、削除対象（rag_id指定の行）のうちレコードキーが同じレコードのrag_idを引き継ぐ（contentの更新）
+    - どちらも無ければ新規
+    
+    引き継いだrag_idは削除対象から除く（削除して同じ内容を登録し直す代わりに更新する）。
+    削除対象でないレコードのcontentは上書きしない（rag_idの無い行は追加として扱う）
+    
+    Args:
+        hashes: 登録対象の行の (レコードキー, contentハッシュ, メタデータハッシュ)
+        delete_list: 削除対象rag_idリスト
+        manifest_records: デプロイ済みレコード（rag_id → (レコードキー, contentハッシュ, メタデータハッシュ)）
+        callback: 進捗報告用コールバック
+        
+    Returns:
+        Tuple[List[Optional[str]], List[str], List[str]]:
+            (行ごとの引き継ぐrag_id（新規はNone）, 行ごとの差分の種類, 削除対象rag_idリスト)
+    """
+    delete_set = set(delete_list)
+    by_content: Dict[Tuple[str, str], List[str]] = {}
+    replaced_by_key: Dict[str, List[str]] = {}
+    for rag_id, (record_key, c_hash, _) in manifest_records.items():
+        by_content.setdefault((record_key, c_hash), []).append(rag_id)
+        if rag_id in delete_set:
+            replaced_by_key.setdefault(record_key, []).append(rag_id)
+    
+    matched: set = set()
+    rag_ids: List[Optional[str]] = []
+    kinds: List[str] = []
+    for record_key, c_hash, m_hash in hashes:
+        rag_id = _take_unmatched(by_content.get((record_key, c_hash)), matched)
+        if rag_id:
+            kind = DIFF_UNCHANGED if manifest_records[rag_id][2] == m_hash else DIFF_METADATA
+        else:
+            rag_id = _take_unmatched(replaced_by_key.get(record_key), matched)
+            kind = DIFF_CONTENT if rag_id else DIFF_NEW
+        if rag_id:
+            matched.add(rag_id)
+        rag_ids.append(rag_id)
+        kinds.append(kind)
+    
+    remaining_deletes = [rag_id for rag_id in delete_list if rag_id not in matched]
+    
+    if callback:
+        counts = {kind: kinds.count(kind) for kind in (DIFF_NEW, DIFF_CONTENT, DIFF_METADATA, DIFF_UNCHANGED)}
+        callback.log_info(
+            "差分判定",
+            f"前回デプロイ分との差分: 新規{counts[DIFF_NEW]}件, content更新{counts[DIFF_CONTENT]}件, "
+            f"メタデータ更新{counts[DIFF_METADATA]}件, 変更なし{counts[DIFF_UNCHANGED]}件, "
+            f"削除{len(remaining_deletes)}件",
+            28
+        )
+    
+    return rag_ids, kinds, remaining_deletes
+
+
+# マニフェストのEmbedding・キーワードを一度に読み書きする件数
+MANIFEST_VECTOR_CHUNK_SIZE = 500
+
+
+def write_carried_records(
+    records,
+    total_records: int,
+    content_hashes: Dict[str, str],
+    manifest: IndexManifest,
+    index_name_short: str,
+    output_dir: Path,
+    callback=None
+) -> List[str]:
+    """
+    メタデータのみの更新のレコードを、マニフェストに保存したEmbedding・キーワードでファイル出力
+    
+    contentが前回デプロイ時と同じため、Embedding取得・キーワード抽出は行わない
+    
+    Args:
+        records: JSONレコードのイテラブル（マニフェストにEmbedding・キーワードがあるもの）
+        total_records: レコード総数（進捗表示用）
+        content_hashes: rag_id → contentハッシュ
+        manifest: インデックスマニフェスト
+        index_name_short: インデックス名
+        output_dir: 出力ディレクトリ
+        callback: 進捗報告用コールバック
+        
+    Returns:
+        List[str]: 出力したファイルのrag_idリスト
+        
+    Raises:
+        RuntimeError: マニフェストにEmbedding・キーワードが無いレコードがある場合
+    """
+    if callback:
+        callback.log_info("ファイル出力", f"メタデータのみ更新された{total_records}件を前回の内容から出力", 60)
+    
+    written: List[str] = []
+    records = iter(records)
+    while True:
+        chunk = [record for _, record in zip(range(MANIFEST_VECTOR_CHUNK_SIZE), records)]
+        if not chunk:
+            break
+        vectors = manifest.get_vectors(
+            index_name_short, [(record["rag_id"], content_hashes[record["rag_id"]]) for record in chunk]
+        )
+        for record in chunk:
+            if record["rag_id"] not in vectors:
+                raise RuntimeError(f"マニフェストにEmbeddingがありません: {record['rag_id']}")
+            record["content_embedding"], record["content_keywords"] = vectors[record["rag_id"]]
+        save_individual_json_files(chunk, output_dir)
+        written.extend(record["rag_id"] for record in chunk)
+    
+    return written
+
+
+def store_manifest_vectors(
+    manifest: IndexManifest,
+    index_name_short: str,
+    rag_ids: List[str],
+    content_hashes: Dict[str, str],
+    output_dir: Path
+) -> None:
+    """
+    出力したJSONファイルのEmbedding・キーワードをマニフェストに保存（次回のメタデータのみの更新で引き継ぐ）
+    
+    Args:
+        manifest: インデックスマニフェスト
+        index_name_short: インデックス名
+        rag_ids: 出力したファイルのrag_idリスト
+        content_hashes: rag_id → contentハッシュ
+        output_dir: 出力ディレクトリ
+    """
+    for i in range(0, len(rag_ids), MANIFEST_VECTOR_CHUNK_SIZE):
+        items = []
+        for rag_id in rag_ids[i:i + MANIFEST_VECTOR_CHUNK_SIZE]:
+            with (output_dir / f"{rag_id}.json").open("rb") as f:
+                record = json.load(f)
+            items.append((rag_id, content_hashes[rag_id], record["content_embedding"], record["content_keywords"]))
+        manifest.put_vectors(index_name_short, items)
+
+
+# =====================================================
+# Step 4: UUID生成
 # =====================================================
-def add_uuid_to_dataframe(df: pd.DataFrame, output_excel_path: Path, callback=None) -> pd.DataFrame:
+def add_uuid_to_dataframe(
+    df: pd.DataFrame,
+    output_excel_path: Path,
+    callback=None,
+    rag_ids: Optional[List[str]] = None
+) -> pd.DataFrame:
     """
     データフレームにUUID列を追加し、Excelファイルとして出力
     
@@ -253,26 +611,22 @@ def add_uuid_to_dataframe(df: pd.DataFrame, output_excel_path: Path, callback=No
         df: データフレーム
         output_excel_path: 出力Excelファイルパス
         callback: 進捗報告用コールバック
+        rag_ids: 割り当てるrag_idリスト（チェックポイントからの再開時に使用。Noneの場合は新規生成）
         
     Returns:
         pd.DataFrame: UUID列が追加されたデータフレーム
     """
     # UUID列を追加
-    df["rag_id"] = [str(uuid.uuid4()) for _ in range(len(df))]
+    df["rag_id"] = rag_ids if rag_ids is not None else [str(uuid.uuid4()) for _ in range(len(df))]
     
     if callback:
         callback.log_info("UUID生成", f"{len(df)}件のUUIDを生成", 30)
     
     # 日付列の変換
     df_export = df.copy()
-    date_columns = ["update_timestamp", "effective_start_date", "effective_end_date"]
-    
-    for col in date_columns:
+    for col in DATE_COLUMNS:
         if col in df_export.columns:
-            df_export[col] = df_export[col].apply(
-                lambda x: datetime.strptime(str(x), "%Y%m%d").strftime("%Y-%m-%d")
-                if pd.notna(x) else x
-            )
+            df_export[col] = format_date_column(df_export[col])
     
     # Excelファイルとして書き出す
     df_export.to_excel(output_excel_path, index=False, engine="openpyxl")
@@ -284,7 +638,7 @@ def add_uuid_to_dataframe(df: pd.DataFrame, output_excel_path: Path, callback=No
 
 
 # =====================================================
-# Step 4: データクレンジング（重複チェック）
+# Step 5: データクレンジング（重複チェック）
 # =====================================================
 def check_duplicates(df: pd.DataFrame, callback=None) -> pd.DataFrame:
     """
@@ -311,15 +665,16 @@ def check_duplicates(df: pd.DataFrame, callback=None) -> pd.DataFrame:
 
 
 # =====================================================
-# Step 5: 旧データ削除（Gitファイル削除 - ダミー実装）
+# Step 6: 旧データ削除（Gitファイル削除 - ダミー実装）
 # =====================================================
-def delete_old_files_from_git(delete_list: List[str], callback=None):
+def delete_old_files_from_git(delete_list: List[str], callback=None, output_dir: Path = OUTPUT_DIR):
     """
     Git管理下のファイルを削除する（ダミー実装）
     
     Args:
         delete_list: 削除対象のrag_idリスト
         callback: 進捗報告用コールバック
+        output_dir: 出力ディレクトリ
     """
     if not delete_list:
         if callback:
@@ -337,7 +692,7 @@ def delete_old_files_from_git(delete_list: List[str], callback=None):
     local_delete_count = 0
     with tqdm(total=len(delete_list), desc="旧データ削除", disable=callback is None) as pbar:
         for rag_id in delete_list:
-            file_path = OUTPUT_DIR / f"{rag_id}.json"
+            file_path = output_dir / f"{rag_id}.json"
             if file_path.exists():
                 try:
                     file_path.unlink()
@@ -352,54 +707,97 @@ def delete_old_files_from_git(delete_list: List[str], callback=None):
 
 
 # =====================================================
-# Step 6: JSON生成
+# Step 7: JSON生成
 # =====================================================
+# JSONレコードのフィールドのうち、Excelの列から変換するもの（rag_id以外）
+RECORD_FIELD_NAMES = [
+    "thread_id", "group_id", "update_timestamp", "content",
+    "category_id_large", "category_id_medium", "category_id_small",
+    "effective_start_date", "effective_end_date"
+]
+
+
+def build_record_fields(df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    JSONレコードのフィールド（RECORD_FIELD_NAMES）を列単位でまとめて変換
+    
+    Args:
+        df: データフレーム
+        
+    Returns:
+        Dict[str, List[str]]: フィールド名 → 行ごとの値のリスト
+        
+    Raises:
+        ValueError: 日付列に空の値、またはYYYYMMDD形式でない値がある場合
+    """
+    dates = {}
+    for col in DATE_COLUMNS:
+        if df[col].isna().any():
+            raise ValueError(f"{col}: 空の値があります")
+        dates[col] = format_date_column(df[col])
+    
+    content_en = df["content_en"].map(str) if "content_en" in df.columns else ""
+    return {
+        "thread_id": df["thread_id"].map(str).tolist(),
+        "group_id": df["group_id"].map(str).tolist(),
+        "update_timestamp": dates["update_timestamp"].tolist(),
+        "content": (df["content"].map(str) + " \n\n" + content_en).tolist(),
+        "category_id_large": parse_category_id_column(df["category_id_large"]).tolist(),
+        "category_id_medium": parse_category_id_column(df["category_id_medium"]).tolist(),
+        "category_id_small": parse_category_id_column(df["category_id_small"]).tolist(),
+        "effective_start_date": dates["effective_start_date"].tolist(),
+        "effective_end_date": dates["effective_end_date"].tolist(),
+    }
+
+
 def create_json_records(df: pd.DataFrame, callback=None) -> List[Dict]:
     """
     データフレームからJSON形式のレコードを作成
     
+    日付・カテゴリIDの変換は列単位でまとめて行い、最後に列のリストからレコードを組み立てる
+    
     Args:
         df: データフレーム
         callback: 進捗報告用コールバック
         
     Returns:
         List[Dict]: JSON形式のレコードリスト
+        
+    Raises:
+        ValueError: 日付列に空の値、またはYYYYMMDD形式でない値がある場合
     """
-    json_list = []
     total_rows = len(df)
     
-    with tqdm(total=total_rows, desc="JSON生成", disable=callback is None) as pbar:
-        for i, (idx, data) in enumerate(df.iterrows()):
-            # 進捗報告
-            if callback and i % 100 == 0:
-                progress = 55 + int((i / max(total_rows, 1)) * 5)
-                callback.log_info("JSON生成", f"処理中: {i}/{total_rows}", progress)
-            
-            # カテゴリIDの変換
-            category_id_large = parse_category_id(data.get("category_id_large"))
-            category_id_medium = parse_category_id(data.get("category_id_medium"))
-            category_id_small = parse_category_id(data.get("category_id_small"))
-            
-            # JSON レコード作成
-            index_data = {
-                "rag_id": str(data["rag_id"]),
-                "thread_id": str(data["thread_id"]),
-                "group_id": str(data["group_id"]),
-                "update_timestamp": datetime.strptime(str(data["update_timestamp"]), "%Y%m%d").strftime("%Y-%m-%d"),
-                "content": f"{data['content']} \n\n{data.get('content_en', '')}",
-                "content_embedding": [],
-                "content_keywords": [],
-                "category_id_large": category_id_large,
-                "category_id_medium": category_id_medium,
-                "category_id_small": category_id_small,
-                "effective_start_date": datetime.strptime(str(data["effective_start_date"]), "%Y%m%d").strftime("%Y-%m-%d"),
-                "effective_end_date": datetime.strptime(str(data["effective_end_date"]), "%Y%m%d").strftime("%Y-%m-%d"),
-                "extra_field_1": "",
-                "extra_field_2": ""
-            }
-            
-            json_list.append(index_data)
-            pbar.update(1)
+    if callback:
+        callback.log_info("JSON生成", f"処理中: 0/{total_rows}", 55)
+    
+    fields = build_record_fields(df)
+    columns = zip(
+        df["rag_id"].map(str).tolist(),
+        *(fields[name] for name in RECORD_FIELD_NAMES)
+    )
+    
+    json_list = [
+        {
+            "rag_id": rag_id,
+            "thread_id": thread_id,
+            "group_id": group_id,
+            "update_timestamp": update_timestamp,
+            "content": content,
+            "content_embedding": [],
+            "content_keywords": [],
+            "category_id_large": category_id_large,
+            "category_id_medium": category_id_medium,
+            "category_id_small": category_id_small,
+            "effective_start_date": effective_start_date,
+            "effective_end_date": effective_end_date,
+            "extra_field_1": "",
+            "extra_field_2": ""
+        }
+        for (rag_id, thread_id, group_id, update_timestamp, content,
+             category_id_large, category_id_medium, category_id_small,
+             effective_start_date, effective_end_date) in columns
+    ]
     
     if callback:
         callback.log_info("JSON生成", f"{len(json_list)}件のJSONレコードを作成完了", 60)
@@ -408,135 +806,102 @@ def create_json_records(df: pd.DataFrame, callback=None) -> List[Dict]:
 
 
 # =====================================================
-# Step 7: Embedding取得
+# Step 8: Embedding取得
 # =====================================================
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-def get_embedding_with_retry(embedding_client: AzureOpenAI, text: str) -> List[float]:
+try:
+    EMBEDDING_MAX_BATCH_INPUTS = min(max(int(os.getenv("EMBEDDING_MAX_BATCH_INPUTS", "256")), 1), 2048)
+except ValueError:
+    EMBEDDING_MAX_BATCH_INPUTS = 256
+
+try:
+    EMBEDDING_MAX_BATCH_TOKENS = max(int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "60000")), 1)
+except ValueError:
+    EMBEDDING_MAX_BATCH_TOKENS = 60000
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算（日本語は1文字≒1トークン、英語はそれ以下のため文字数を上限として扱う）
+    """
+    return max(len(text), 1)
+
+
+def is_embedding_input_error(error: Exception) -> bool:
     """
-    テキストのEmbeddingを取得（リトライ機能付き）
+    入力内容が原因のエラー（トークン数超過等の400エラー）か判定
     
-    Args:
-        embedding_client: Azure OpenAI クライアント
-        text: テキスト
-        
-    Returns:
-        List[float]: Embedding ベクトル
+    バッチを分割すれば成功する可能性があるのはこのエラーのみ。
+    認証エラー・レート制限・タイムアウト・通信エラーは分割しても解消しない
     """
-    response = embedding_client.embeddings.create(
-        input=text,
-        model=os.getenv("AZURE_OPENAI_API_ENGINE_EMBEDDING")
-    )
-    return response.model_dump()["data"][0]["embedding"]
+    if isinstance(error, BadRequestError) or getattr(error, "status_code", None) == 400:
+        return True
+    return "context_length_exceeded" in str(getattr(error, "code", "") or "")
 
 
-def add_embeddings_to_record(record: Dict, embedding_client: AzureOpenAI) -> Dict:
+# 入力内容が原因のエラーは同じ入力で再試行しても失敗するため、リトライしない
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(2), reraise=True,
+       retry=retry_if_not_exception_type(BadRequestError))
+def get_embeddings_with_retry(embedding_client: AzureOpenAI, texts: List[str]) -> List[List[float]]:
     """
-    単一のレコードにEmbeddingを追加
+    複数テキストのEmbeddingを1リクエストで取得（リトライ機能付き）
     
     Args:
-        record: JSONレコード
         embedding_client: Azure OpenAI クライアント
+        texts: テキストリスト
         
     Returns:
-        Dict: Embeddingが追加されたレコード
+        List[List[float]]: 入力順に並んだEmbedding ベクトルリスト
     """
-    # contentをクリーンアップ
-    content = remove_urls_and_html(record["content"])
-    
-    # Embeddingを取得
-    record["content_embedding"] = get_embedding_with_retry(embedding_client, content)
+    response = embedding_client.embeddings.create(
+        input=texts,
+        model=os.getenv("AZURE_OPENAI_API_ENGINE_EMBEDDING")
+    )
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+    for item in response.data:
+        vectors[item.index] = item.embedding
     
-    return record
+    if any(v is None for v in vectors):
+        raise ValueError("Embeddingレスポンスの件数が入力と一致しません")
+    return vectors
 
 
-def add_embeddings_batch(json_records: List[Dict], callback=None, max_workers: int = 4, step_index: int = 7) -> List[Dict]:
+def embed_batch_with_split(embedding_client: AzureOpenAI, texts: List[str]) -> List[List[float]]:
     """
-    複数レコードにEmbeddingを並列で追加
+    バッチのEmbeddingを取得し、入力内容が原因で失敗した場合はバッチを半分に分割して再試行
     
     Args:
-        json_records: JSONレコードリスト
-        callback: 進捗報告用コールバック
-        max_workers: 並列処理のワーカー数
-        step_index: 現在のステップインデックス
+        embedding_client: Azure OpenAI クライアント
+        texts: テキストリスト
         
     Returns:
-        List[Dict]: Embeddingが追加されたレコードリスト
+        List[List[float]]: 入力順に並んだEmbedding ベクトルリスト
+        
+    Raises:
+        Exception: 入力内容以外が原因のエラー、または1件単位でも取得に失敗した場合
     """
-    # Azure OpenAI クライアント作成
-    embedding_client = AzureOpenAI(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version="2024-07-01-preview"
-    )
-    
-    total_records = len(json_records)
-    processed_records = []
-    
-    if callback:
-        callback.log_info("Embedding取得", f"{total_records}件の処理を開始", 60)
-    
-    # tqdmでプログレスバーを作成
-    with tqdm(total=total_records, desc="Embedding取得", disable=callback is None) as pbar:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_record = {
-                executor.submit(add_embeddings_to_record, record, embedding_client): i 
-                for i, record in enumerate(json_records)
-            }
-            
-            for i, future in enumerate(as_completed(future_to_record)):
-                try:
-                    result = future.result()
-                    processed_records.append(result)
-                    pbar.update(1)
-                    
-                    if callback:
-                        step_progress = (i + 1) / max(total_records, 1) * 100
-                        elapsed = pbar.format_dict.get('elapsed', 0)
-                        estimated_time = elapsed / (i + 1) * (total_records - i - 1) if i > 0 else 0
-                        callback.update_step("Embedding取得", step_index, step_progress, estimated_time)
-                        
-                        if (i + 1) % 10 == 0 or i == total_records - 1:
-                            progress = 60 + int((i / max(total_records, 1)) * 10)
-                            callback.log_info("Embedding取得", f"処理中: {i+1}/{total_records}", progress)
-                    
-                except Exception as e:
-                    record_idx = future_to_record[future]
-                    if callback:
-                        callback.log_error("Embedding取得", 
-                                           f"レコード{record_idx}でエラー: {str(e)}", 65)
-                    raise
-    
-    if callback:
-        callback.log_info("Embedding取得", f"{len(processed_records)}件の処理完了", 70)
-        callback.update_step("Embedding取得", step_index, 100, 0)
-    
-    return processed_records
+    try:
+        return get_embeddings_with_retry(embedding_client, texts)
+    except Exception as e:
+        if len(texts) == 1 or not is_embedding_input_error(e):
+            raise
+        logger.warning(f"Embeddingバッチ({len(texts)}件)が失敗したため分割して再試行します: {e}")
+        mid = len(texts) // 2
+        return (
+            embed_batch_with_split(embedding_client, texts[:mid])
+            + embed_batch_with_split(embedding_client, texts[mid:])
+        )
 
 
 # =====================================================
-# Step 8: キーワード抽出
+# Step 9: キーワード抽出
 # =====================================================
-@retry(stop=stop_after_attempt(60), wait=wait_fixed(1))
-async def extract_keywords_async(content: str) -> List[str]:
-    """
-    Azure Chat を用いて非同期的にキーワードを抽出
-    
-    Args:
-        content: テキスト
-        
-    Returns:
-        List[str]: キーワードリスト
+try:
+    KEYWORD_MAX_CONCURRENCY = max(int(os.getenv("KEYWORD_MAX_CONCURRENCY", "16")), 1)
+except ValueError:
+    KEYWORD_MAX_CONCURRENCY = 16
+
+KEYWORD_PROMPT = ChatPromptTemplate.from_template(
     """
-    # Azure OpenAI クライアント
-    chat_client = AzureChatOpenAI(
-        model=os.getenv("AZURE_OPENAI_API_ENGINE_GPT"),
-        api_key=os.getenv("AOAI_ITB_API_KEY"),
-        api_version="2024-07-01-preview",
-        azure_endpoint=os.getenv("AOAI_ITB_ENDPOINT"),
-    )
-    
-    prompt = ChatPromptTemplate.from_template(
-        """
 # Role
 あなたは自然言語処理のエキスパートです。あなたの仕事は与えられたContentから重要なキーワードを抽出することです。
 
@@ -557,10 +922,37 @@ Outputs must strictly be in the form of a JSON array.
 # Output
 ## Please provide the keywords in the form of a JSON array:
 """
+)
+
+
+def build_keyword_chain():
+    """
+    キーワード抽出用のチェーン（プロンプト → Azure Chat → JSONパーサー）を作成
+    
+    クライアントとチェーンは1回の処理で1つだけ作成し、全レコードで共有する
+    """
+    chat_client = AzureChatOpenAI(
+        model=os.getenv("AZURE_OPENAI_API_ENGINE_GPT"),
+        api_key=os.getenv("AOAI_ITB_API_KEY"),
+        api_version="2024-07-01-preview",
+        azure_endpoint=os.getenv("AOAI_ITB_ENDPOINT"),
     )
+    return KEYWORD_PROMPT | chat_client | SimpleJsonOutputParser()
+
+
+@retry(stop=stop_after_attempt(60), wait=wait_fixed(1))
+async def extract_keywords_async(chain, content: str) -> List[str]:
+    """
+    Azure Chat を用いて非同期的にキーワードを抽出
     
-    llm = prompt | chat_client | SimpleJsonOutputParser()
-    response = llm.invoke({"content": content})
+    Args:
+        chain: build_keyword_chain() で作成した共有チェーン
+        content: テキスト
+        
+    Returns:
+        List[str]: キーワードリスト
+    """
+    response = await chain.ainvoke({"content": content})
     
     if isinstance(response, list):
         return response
@@ -568,131 +960,438 @@ Outputs must strictly be in the form of a JSON array.
         raise ValueError("Output is not in the expected list format.")
 
 
-def extract_keywords_for_record(record: Dict) -> Dict:
+# =====================================================
+# Step 10: ファイル出力
+# =====================================================
+# Embeddingの小数点以下の桁数（未設定の場合は丸めない）
+try:
+    JSON_FLOAT_PRECISION: Optional[int] = int(os.getenv("JSON_FLOAT_PRECISION", ""))
+except ValueError:
+    JSON_FLOAT_PRECISION = None
+
+try:
+    JSON_WRITE_WORKERS = max(int(os.getenv("JSON_WRITE_WORKERS", "8")), 1)
+except ValueError:
+    JSON_WRITE_WORKERS = 8
+
+
+def serialize_record(record: Dict, float_precision: Optional[int] = JSON_FLOAT_PRECISION) -> bytes:
     """
-    単一のレコードからキーワードを抽出
+    レコードをインデントなしのJSON（UTF-8）に変換
+    
+    orjsonがインストールされていればorjsonを使用し、無ければ標準jsonの区切り文字を詰めて出力する
     
     Args:
         record: JSONレコード
+        float_precision: Embeddingを丸める小数点以下の桁数（Noneの場合は丸めない）
         
     Returns:
-        Dict: キーワードが追加されたレコード
+        bytes: JSONバイト列
     """
+    if float_precision is not None and record.get("content_embedding"):
+        record = dict(record)
+        record["content_embedding"] = [round(v, float_precision) for v in record["content_embedding"]]
+    
+    if orjson is not None:
+        return orjson.dumps(record, default=custom_encoder)
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=custom_encoder).encode("utf-8")
+
+
+def write_json_file(record: Dict, output_dir: Path) -> Path:
+    """
+    1レコードを {rag_id}.json として保存
+    
+    一時ファイルに書き込んでからリネームするため、書きかけのファイルが残らない
+    
+    Args:
+        record: JSONレコード
+        output_dir: 出力ディレクトリ
+        
+    Returns:
+        Path: 出力ファイルパス
+    """
+    output_file = output_dir / f"{record['rag_id']}.json"
+    tmp_file = output_dir / f".{record['rag_id']}.json.tmp"
     try:
-        content = record.get("content", "")
-        keywords = asyncio.run(extract_keywords_async(content))
-        record["content_keywords"] = keywords
-        return record
-    except Exception as e:
-        # エラー時は空のキーワードリスト
-        record["content_keywords"] = []
+        with tmp_file.open("wb") as f:
+            f.write(serialize_record(record))
+        os.replace(tmp_file, output_file)
+    except Exception:
+        tmp_file.unlink(missing_ok=True)
         raise
+    return output_file
 
 
-def extract_keywords_batch(json_records: List[Dict], callback=None, max_workers: int = 4, step_index: int = 8) -> List[Dict]:
+def save_individual_json_files(
+    json_records: List[Dict],
+    output_dir: Path,
+    callback=None,
+    max_workers: int = JSON_WRITE_WORKERS
+):
     """
-    複数レコードからキーワードを並列で抽出
+    個別JSONファイルとしてスレッドプールで並列に保存
     
     Args:
         json_records: JSONレコードリスト
+        output_dir: 出力ディレクトリ
         callback: 進捗報告用コールバック
-        max_workers: 並列処理のワーカー数
-        step_index: 現在のステップインデックス
-        
-    Returns:
-        List[Dict]: キーワードが追加されたレコードリスト
+        max_workers: 並列書き込み数
     """
     total_records = len(json_records)
-    processed_records = []
     
     if callback:
-        callback.log_info("キーワード抽出", f"{total_records}件の処理を開始", 70)
+        callback.log_info("ファイル出力", f"{total_records}件のファイル出力を開始", 90)
     
-    with tqdm(total=total_records, desc="キーワード抽出", disable=callback is None) as pbar:
+    with tqdm(total=total_records, desc="ファイル出力", disable=callback is None) as pbar:
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_record = {
-                executor.submit(extract_keywords_for_record, record): i 
-                for i, record in enumerate(json_records)
-            }
+            future_to_record = {}
+            for i, record in enumerate(json_records):
+                if not record.get("rag_id"):
+                    if callback:
+                        callback.log_warning("ファイル出力", f"レコード{i}にrag_idがありません", 90)
+                    pbar.update(1)
+                    continue
+                future_to_record[executor.submit(write_json_file, record, output_dir)] = record["rag_id"]
             
             for i, future in enumerate(as_completed(future_to_record)):
-                record_idx = future_to_record[future]
+                rag_id = future_to_record[future]
                 try:
-                    result = future.result()
-                    processed_records.append(result)
+                    future.result()
+                    
+                    if callback and (i % 50 == 0 or i == len(future_to_record) - 1):
+                        progress = 90 + int((i / max(total_records, 1)) * 10)
+                        callback.log_info("ファイル出力", f"保存中: {i+1}/{total_records}", progress)
+                        
                 except Exception as e:
                     if callback:
-                        callback.log_error("キーワード抽出", 
-                                           f"レコード{record_idx}でエラー: {str(e)}", 80)
-                    record = json_records[record_idx].copy()
-                    record["content_keywords"] = []
-                    processed_records.append(record)
+                        callback.log_error("ファイル出力", 
+                                         f"ファイル保存失敗: {rag_id} - {str(e)}", 95)
+                    raise
                 finally:
                     pbar.update(1)
-                    
-                    if callback:
-                        step_progress = (i + 1) / max(total_records, 1) * 100
-                        elapsed = pbar.format_dict.get('elapsed', 0)
-                        estimated_time = elapsed / (i + 1) * (total_records - i - 1) if i > 0 else 0
-                        callback.update_step("キーワード抽出", step_index, step_progress, estimated_time)
-                        
-                        if (i + 1) % 10 == 0 or i == total_records - 1:
-                            progress = 70 + int((i / max(total_records, 1)) * 20)
-                            callback.log_info("キーワード抽出", f"処理中: {i+1}/{total_records}", progress)
     
     if callback:
-        callback.log_info("キーワード抽出", f"{len(processed_records)}件の処理完了", 90)
-        callback.update_step("キーワード抽出", step_index, 100, 0)
-    
-    return processed_records
+        callback.log_info("ファイル出力", f"{total_records}件のファイル出力完了", 100)
 
 
 # =====================================================
-# Step 9: ファイル出力
+# Step 8〜10: ストリーミング処理（Embedding → キーワード → ファイル出力）
 # =====================================================
-def save_individual_json_files(json_records: List[Dict], output_dir: Path, callback=None):
+try:
+    PIPELINE_QUEUE_SIZE = max(int(os.getenv("PIPELINE_QUEUE_SIZE", "512")), 1)
+except ValueError:
+    PIPELINE_QUEUE_SIZE = 512
+
+_PIPELINE_END = object()
+
+
+def iter_and_release(records: List[Dict]):
     """
-    個別JSONファイルとして保存
+    リストの先頭から順にレコードを返し、返したレコードはリストから取り除く
     
-    Args:
-        json_records: JSONレコードリスト
-        output_dir: 出力ディレクトリ
-        callback: 進捗報告用コールバック
+    パイプラインに渡したレコードへの参照を呼び出し元に残さないためのジェネレーター
     """
-    total_records = len(json_records)
+    records.reverse()
+    while records:
+        yield records.pop()
+
+
+class _PipelineProgress:
+    """ストリーミング処理の各ステージの完了件数を集計して進捗を報告"""
     
-    if callback:
-        callback.log_info("ファイル出力", f"{total_records}件のファイル出力を開始", 90)
+    STAGES = [
+        ("Embedding取得", 7),
+        ("キーワード抽出", 8),
+        ("ファイル出力", 9),
+    ]
     
-    with tqdm(total=total_records, desc="ファイル出力", disable=callback is None) as pbar:
-        for i, record in enumerate(json_records):
-            rag_id = record.get("rag_id")
-            if not rag_id:
-                if callback:
-                    callback.log_warning("ファイル出力", f"レコード{i}にrag_idがありません", 90)
-                pbar.update(1)
+    def __init__(self, total: int, callback=None):
+        self.total = total
+        self.callback = callback
+        self.done = [0, 0, 0]
+        self.started_at = time.time()
+    
+    def advance(self, stage: int, count: int = 1) -> None:
+        """指定ステージの完了件数を加算し、進捗を報告"""
+        self.done[stage] += count
+        if not self.callback:
+            return
+        
+        # まだ完了していない最初のステージを現在のステップとして報告
+        current = next((i for i, n in enumerate(self.done) if n < self.total), len(self.STAGES) - 1)
+        step_name, step_index = self.STAGES[current]
+        step_progress = self.done[current] / max(self.total, 1) * 100
+        
+        written = self.done[2]
+        elapsed = time.time() - self.started_at
+        estimated_time = elapsed / written * (self.total - written) if written else 0
+        self.callback.update_step(step_name, step_index, step_progress, estimated_time)
+        
+        if stage == 2 and (written % 50 == 0 or written == self.total):
+            progress = 60 + int((written / max(self.total, 1)) * 40)
+            self.callback.log_info(
+                "ファイル出力",
+                f"処理中: Embedding {self.done[0]}/{self.total}, "
+                f"キーワード {self.done[1]}/{self.total}, 出力 {written}/{self.total}",
+                progress
+            )
+
+
+async def _run_record_pipeline(
+    records,
+    output_dir: Path,
+    progress: _PipelineProgress,
+    cache: Optional[ContentCache],
+    checkpoint: Optional[CheckpointStore],
+    run_key: Optional[str],
+    max_embedding_requests: int,
+    max_keyword_concurrency: int,
+    queue_size: int
+) -> Dict[int, str]:
+    """
+    レコードを Embedding → キーワード → ファイル出力 の順に流すパイプライン本体
+    
+    各ステージは上限付きキューでつながっており、後段が詰まると前段の読み込みも止まるため、
+    メモリ上には処理中のレコードだけが保持される。
+    チェックポイント済みのレコードはAPIを呼ばずにファイル出力へ直接流す。
+    
+    Returns:
+        Dict[int, str]: 入力順インデックス → 出力したrag_id
+    """
+    loop = asyncio.get_running_loop()
+    embedding_model = os.getenv("AZURE_OPENAI_API_ENGINE_EMBEDDING", "")
+    keyword_model = os.getenv("AZURE_OPENAI_API_ENGINE_GPT", "")
+    embedding_client = AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2024-07-01-preview"
+    )
+    chain = build_keyword_chain()
+    
+    keyword_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    write_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    embedding_slots = asyncio.Semaphore(max_embedding_requests)
+    written: Dict[int, str] = {}
+    
+    # キャッシュ・チェックポイント（SQLite）の読み書きはイベントループを止めないようスレッドで実行する
+    # 完了済みレコードは1回のクエリでまとめて読み込み、出力へ流した分から手放す
+    completed = await asyncio.to_thread(checkpoint.load_records, run_key) if checkpoint else {}
+    if completed and progress.callback:
+        progress.callback.log_info("Embedding取得", f"チェックポイントから{len(completed)}件を復元します", 60)
+    
+    async def embed_batch(batch: List[Tuple[int, Dict, str, str]]) -> None:
+        try:
+            # キーワードは元のcontentから抽出するため、キャッシュのキーも抽出に渡すテキストのハッシュにする
+            # （クレンジング後のテキストをキーにするEmbeddingとは別のキー）
+            keyword_hashes = [content_hash(record.get("content", "")) for _, record, _, _ in batch]
+            cached = await asyncio.to_thread(
+                cache.get_embeddings, embedding_model, [h for _, _, _, h in batch]
+            ) if cache else {}
+            cached_keywords = await asyncio.to_thread(
+                cache.get_keywords, keyword_model, keyword_hashes
+            ) if cache else {}
+            misses = [item for item in batch if item[3] not in cached]
+            if misses:
+                vectors = await loop.run_in_executor(
+                    executor, embed_batch_with_split, embedding_client, [text for _, _, text, _ in misses]
+                )
+                fetched = {h: v for (_, _, _, h), v in zip(misses, vectors)}
+                if cache:
+                    await asyncio.to_thread(cache.put_embeddings, embedding_model, fetched)
+                cached.update(fetched)
+            
+            for (idx, record, _, h), keyword_hash in zip(batch, keyword_hashes):
+                record["content_embedding"] = cached[h]
+                progress.advance(0)
+                if keyword_hash in cached_keywords:
+                    # キャッシュ済みのキーワードはキーワード抽出を経由せずファイル出力へ流す
+                    record["content_keywords"] = cached_keywords[keyword_hash]
+                    progress.advance(1)
+                    await write_queue.put((idx, record, True, None))
+                else:
+                    await keyword_queue.put((idx, record, keyword_hash))
+        finally:
+            embedding_slots.release()
+    
+    async def embed_stage() -> None:
+        tasks = []
+        batch: List[Tuple[int, Dict, str, str]] = []
+        batch_tokens = 0
+        
+        async def flush() -> None:
+            nonlocal tasks, batch, batch_tokens
+            await embedding_slots.acquire()
+            # 失敗したバッチがあれば以降の読み込みを中止する
+            for task in tasks:
+                if task.done() and task.exception():
+                    embedding_slots.release()
+                    raise task.exception()
+            tasks = [task for task in tasks if not task.done()]
+            tasks.append(asyncio.create_task(embed_batch(batch)))
+            batch, batch_tokens = [], 0
+        
+        for idx, record in enumerate(records):
+            restored = completed.pop(idx, None)
+            if restored:
+                record["content_embedding"], record["content_keywords"] = restored
+                progress.advance(0)
+                progress.advance(1)
+                await write_queue.put((idx, record, False, None))
                 continue
             
-            output_file = output_dir / f"{rag_id}.json"
+            text = remove_urls_and_html(record["content"])
+            tokens = estimate_tokens(text)
+            if batch and (len(batch) >= EMBEDDING_MAX_BATCH_INPUTS
+                          or batch_tokens + tokens > EMBEDDING_MAX_BATCH_TOKENS):
+                await flush()
+            batch.append((idx, record, text, content_hash(text)))
+            batch_tokens += tokens
+        if batch:
+            await flush()
+        
+        await asyncio.gather(*tasks)
+        for _ in range(max_keyword_concurrency):
+            await keyword_queue.put(_PIPELINE_END)
+    
+    async def keyword_worker() -> None:
+        while True:
+            item = await keyword_queue.get()
+            if item is _PIPELINE_END:
+                return
+            idx, record, keyword_hash = item
             
             try:
-                with output_file.open("w", encoding="utf-8") as f:
-                    json.dump(record, f, ensure_ascii=False, indent=4, default=custom_encoder)
-                
-                if callback and (i % 50 == 0 or i == total_records - 1):
-                    progress = 90 + int((i / max(total_records, 1)) * 10)
-                    callback.log_info("ファイル出力", f"保存中: {i+1}/{total_records}", progress)
-                    
+                record["content_keywords"] = await extract_keywords_async(chain, record.get("content", ""))
             except Exception as e:
-                if callback:
-                    callback.log_error("ファイル出力", 
-                                     f"ファイル保存失敗: {rag_id} - {str(e)}", 95)
+                # エラー時は空のキーワードリスト（再実行時に再抽出するためキャッシュ・チェックポイントしない）
+                record["content_keywords"] = []
+                keyword_hash = None
+                if progress.callback:
+                    progress.callback.log_error("キーワード抽出", f"レコード{idx}でエラー: {str(e)}", 80)
+            
+            progress.advance(1)
+            await write_queue.put((idx, record, keyword_hash is not None, keyword_hash))
+    
+    async def keyword_stage() -> None:
+        await asyncio.gather(*(keyword_worker() for _ in range(max_keyword_concurrency)))
+        for _ in range(JSON_WRITE_WORKERS):
+            await write_queue.put(_PIPELINE_END)
+    
+    pending: List[Tuple[int, List[float], List[str]]] = []
+    # 新しく抽出したキーワード（キーワードのキャッシュキー → キーワード）
+    pending_keywords: Dict[str, List[str]] = {}
+    
+    async def write_worker() -> None:
+        nonlocal pending, pending_keywords
+        while True:
+            item = await write_queue.get()
+            if item is _PIPELINE_END:
+                return
+            idx, record, save_checkpoint, keyword_hash = item
+            await write_one(idx, record)
+            
+            if cache and keyword_hash is not None:
+                pending_keywords[keyword_hash] = record["content_keywords"]
+                if len(pending_keywords) >= KEYWORD_CACHE_FLUSH_SIZE:
+                    items, pending_keywords = pending_keywords, {}
+                    await asyncio.to_thread(cache.put_keywords, keyword_model, items)
+            if checkpoint and save_checkpoint:
+                pending.append((idx, record["content_embedding"], record["content_keywords"]))
+                if len(pending) >= CHECKPOINT_FLUSH_SIZE:
+                    rows, pending = pending, []
+                    await asyncio.to_thread(checkpoint.save_records, run_key, rows)
+    
+    async def write_stage() -> None:
+        try:
+            await asyncio.gather(*(write_worker() for _ in range(JSON_WRITE_WORKERS)))
+        finally:
+            # 失敗・中断時も出力済みのレコードはキャッシュ・チェックポイントに残す
+            if cache and pending_keywords:
+                await asyncio.to_thread(cache.put_keywords, keyword_model, pending_keywords)
+            if checkpoint and pending:
+                await asyncio.to_thread(checkpoint.save_records, run_key, pending)
+    
+    async def write_one(idx: int, record: Dict) -> None:
+        if not record.get("rag_id"):
+            if progress.callback:
+                progress.callback.log_warning("ファイル出力", f"レコード{idx}にrag_idがありません", 90)
+        else:
+            try:
+                await asyncio.to_thread(write_json_file, record, output_dir)
+            except Exception as e:
+                if progress.callback:
+                    progress.callback.log_error("ファイル出力",
+                                                f"ファイル保存失敗: {record['rag_id']} - {str(e)}", 95)
                 raise
-            finally:
-                pbar.update(1)
+            written[idx] = record["rag_id"]
+        progress.advance(2)
+    
+    with ThreadPoolExecutor(max_workers=max_embedding_requests) as executor:
+        tasks = [
+            asyncio.create_task(embed_stage()),
+            asyncio.create_task(keyword_stage()),
+            asyncio.create_task(write_stage()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            # いずれかのステージが失敗したら、キュー待ちの他ステージも止める
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
     
+    return written
+
+
+def run_record_pipeline(
+    records,
+    total_records: int,
+    output_dir: Path,
+    callback=None,
+    cache: Optional[ContentCache] = None,
+    checkpoint: Optional[CheckpointStore] = None,
+    run_key: Optional[str] = None,
+    max_embedding_requests: int = 4,
+    max_keyword_concurrency: int = KEYWORD_MAX_CONCURRENCY,
+    queue_size: int = PIPELINE_QUEUE_SIZE
+) -> List[str]:
+    """
+    Step 8〜10 をストリーミングで実行
+    
+    各レコードは準備ができ次第 Embedding取得 → キーワード抽出 → ファイル出力 へ流れ、
+    EmbeddingとキーワードのAPI呼び出しは並行して実行される。
+    
+    Args:
+        records: JSONレコードのイテラブル（iter_and_release() を推奨）
+        total_records: レコード総数（進捗表示用）
+        output_dir: 出力ディレクトリ
+        callback: 進捗報告用コールバック
+        cache: Embedding / キーワードキャッシュ（Noneの場合は使用しない）
+        checkpoint: チェックポイントストア（Noneの場合は使用しない）
+        run_key: チェックポイントの実行キー
+        max_embedding_requests: 同時に送信するEmbeddingバッチ数
+        max_keyword_concurrency: 同時に実行するキーワード抽出リクエスト数
+        queue_size: ステージ間キューの上限
+        
+    Returns:
+        List[str]: 出力したファイルのrag_idリスト（入力順）
+    """
     if callback:
-        callback.log_info("ファイル出力", f"{total_records}件のファイル出力完了", 100)
+        callback.log_info("Embedding取得", f"{total_records}件のストリーミング処理を開始", 60)
+    
+    progress = _PipelineProgress(total_records, callback)
+    written = asyncio.run(_run_record_pipeline(
+        records, output_dir, progress, cache, checkpoint, run_key,
+        max_embedding_requests, max_keyword_concurrency, queue_size
+    ))
+    rag_ids = [written[idx] for idx in sorted(written)]
+    
+    if callback:
+        callback.log_info("ファイル出力", f"{len(rag_ids)}件のファイル出力完了", 100)
+        callback.update_step("ファイル出力", 9, 100, 0)
+    
+    return rag_ids
 
 
 # =====================================================
@@ -703,7 +1402,9 @@ def process_excel_to_index(
     output_dir: Path, 
     callback=None,
     index_name_short: Optional[str] = None,
-    enable_git_deploy: bool = True
+    enable_git_deploy: bool = True,
+    index_list_path: Optional[Path] = None,
+    deploy_lock=None
 ) -> Dict[str, any]:
     """
     Excelファイルを読み込み、インデックスJSONファイルを生成するメイン処理
@@ -714,6 +1415,8 @@ def process_excel_to_index(
         callback: 進捗報告用コールバック
         index_name_short: インデックス名（短縮形）。Noneの場合は環境変数から取得
         enable_git_deploy: Git操作とデプロイを実行するか（デフォルト: True）
+        index_list_path: インデックス化データ一覧の出力先。Noneの場合は data/インデックス化データ一覧.xlsx
+        deploy_lock: コミットとタグ作成を直列化するロック（with文で使用）。Noneの場合はプロセス内のロック
         
     Returns:
         Dict: 処理結果（excel_path, git_result等）
@@ -734,6 +1437,27 @@ def process_excel_to_index(
     # Step 2: バリデーションチェック
     df_registration, delete_list = validate_data_content(df, callback)
     
+    # Step 3: 差分判定（rag_idを引き継ぐ行と、処理が必要な行を決める）
+    # メタデータのみの更新の行は、マニフェストに保存したEmbedding・キーワードを引き継ぐ
+    hashes: List[ManifestEntry] = []
+    existing_ids: List[Optional[str]] = [None] * len(df_registration)
+    kinds = [DIFF_NEW] * len(df_registration)
+    carried_ids: set = set()
+    if INDEX_MANIFEST_ENABLED:
+        hashes = compute_record_hashes(df_registration)
+        manifest = IndexManifest()
+        try:
+            manifest_records = manifest.get_records(index_name_short)
+            existing_ids, kinds, delete_list = diff_against_manifest(
+                hashes, delete_list, manifest_records, callback
+            )
+            carried_ids = manifest.get_vector_ids(
+                index_name_short,
+                [(existing_ids[i], hashes[i][1]) for i, kind in enumerate(kinds) if kind == DIFF_METADATA]
+            )
+        finally:
+            manifest.close()
+    
     # 統計情報を記録
     record_count = len(df_registration)
     json_files_deleted = len(delete_list)
@@ -743,46 +1467,108 @@ def process_excel_to_index(
             json_files_deleted=json_files_deleted
         )
     
-    # Step 3: UUID生成
-    excel_output_path = BASE_DIR / "data" / "インデックス化データ一覧.xlsx"
-    df_registration = add_uuid_to_dataframe(df_registration, excel_output_path, callback)
+    # Step 4: UUID生成（差分判定でrag_idを引き継いだ行以外）
+    # 同じ入力の再実行時は、チェックポイントに記録したrag_idを再利用して途中から再開する
+    rag_ids = [rag_id or str(uuid.uuid4()) for rag_id in existing_ids]
+    run_key = None
+    if CHECKPOINT_ENABLED:
+        # 差分判定の結果が変わると処理する行も変わるため、実行キーに含める
+        run_key = compute_run_key(input_dir.glob("*.xlsx"), index_name_short,
+                                  content_hash(json.dumps([existing_ids, kinds, sorted(carried_ids)])))
+        checkpoint = CheckpointStore()
+        try:
+            rag_ids, resumed = checkpoint.get_or_create_run(run_key, rag_ids)
+        finally:
+            checkpoint.close()
+        if resumed and callback:
+            callback.log_info("UUID生成", "前回の実行のチェックポイントが見つかりました。rag_idを再利用します", 30)
+    
+    excel_output_path = index_list_path or BASE_DIR / "data" / "インデックス化データ一覧.xlsx"
+    df_registration = add_uuid_to_dataframe(df_registration, excel_output_path, callback, rag_ids=rag_ids)
     result["excel_path"] = excel_output_path
     
-    # Step 4: データクレンジング（重複チェック）
+    # Step 5: データクレンジング（重複チェック）
     df_registration = check_duplicates(df_registration, callback)
     
-    # Step 5: 旧データ削除（ローカルのみ、Gitは後で削除）
-    delete_old_files_from_git(delete_list, callback)
+    # Step 6: 旧データ削除（ローカルのみ、Gitは後で削除）
+    delete_old_files_from_git(delete_list, callback, output_dir)
     
-    # Step 6: JSON生成
+    # Step 7: JSON生成（変更なしの行は出力・コミットしない）
+    changed = [i for i, kind in enumerate(kinds) if kind != DIFF_UNCHANGED]
+    if len(changed) < len(kinds):
+        df_registration = df_registration.iloc[changed]
     json_records = create_json_records(df_registration, callback)
     
+    # rag_idを引き継いだ行はGitでは既存ファイルの更新になる。デプロイ後にマニフェストへ反映する内容も控えておく
+    update_targets = {rag_ids[i] for i in changed if kinds[i] != DIFF_NEW}
+    manifest_upserts = [(rag_ids[i], *hashes[i]) for i in changed] if hashes else []
+    content_hashes = {rag_ids[i]: hashes[i][1] for i in changed} if hashes else {}
+    
     # メモリ効率のため、DataFrameを削除
     del df, df_registration
     
-    # Step 7: Embedding取得（並列処理）
-    json_records = add_embeddings_batch(json_records, callback, max_workers=4, step_index=6)
+    # メタデータのみの更新の行（マニフェストにEmbedding・キーワードがあるもの）はパイプラインに流さない
+    carried_records: List[Dict] = []
+    if carried_ids:
+        carried_records = [record for record in json_records if record["rag_id"] in carried_ids]
+        json_records = [record for record in json_records if record["rag_id"] not in carried_ids]
     
-    # Step 8: キーワード抽出（並列処理）
-    json_records = extract_keywords_batch(json_records, callback, max_workers=4, step_index=7)
+    # Step 8〜10: Embedding取得 → キーワード抽出 → ファイル出力 をストリーミングで実行（新規・content更新の行）
+    # Embedding / キーワードはcontentのハッシュでキャッシュし、未取得の行のみAzureを呼び出す
+    # 完了したレコードは随時チェックポイントに保存し、失敗時の再実行ではそこから再開する
+    total_records = len(json_records)
+    carried_total = len(carried_records)
+    cache = ContentCache() if CONTENT_CACHE_ENABLED else None
+    checkpoint = CheckpointStore() if run_key else None
+    manifest = IndexManifest() if hashes else None
+    try:
+        carried_written = write_carried_records(
+            iter_and_release(carried_records), carried_total, content_hashes,
+            manifest, index_name_short, output_dir, callback
+        ) if carried_total else []
+    
+        rag_ids = run_record_pipeline(
+            iter_and_release(json_records),
+            total_records=total_records,
+            output_dir=output_dir,
+            callback=callback,
+            cache=cache,
+            checkpoint=checkpoint,
+            run_key=run_key
+        )
     
-    # Step 9: ファイル出力
-    save_individual_json_files(json_records, output_dir, callback)
+        # 次回のメタデータのみの更新で引き継げるよう、取得したEmbedding・キーワードを保存しておく
+        # （マニフェストに反映されるのはデプロイが成功した場合のみ）
+        if manifest and enable_git_deploy:
+            store_manifest_vectors(manifest, index_name_short, rag_ids, content_hashes, output_dir)
+    finally:
+        if cache:
+            cache.close()
+        if checkpoint:
+            checkpoint.close()
+        if manifest:
+            manifest.close()
     
     # JSONファイル作成数を記録
-    json_files_created = len(json_records)
+    json_files_created = len(rag_ids) + len(carried_written)
     if callback:
         callback.update_stats(json_files_created=json_files_created)
     
-    # Step 10: Git操作、タグ作成、Jenkins実行、デプロイ
+    updated_ids = carried_written + [rag_id for rag_id in rag_ids if rag_id in update_targets]
+    if updated_ids:
+        rag_ids = [rag_id for rag_id in rag_ids if rag_id not in update_targets]
+    
+    # Step 11: Git操作、タグ作成、Jenkins実行、デプロイ
     if enable_git_deploy:
         try:
             git_result = git_and_deploy_flow(
-                json_records=json_records,
+                rag_ids=rag_ids,
                 delete_list=delete_list,
                 output_dir=output_dir,
                 index_name_short=index_name_short,
-                callback=callback
+                callback=callback,
+                deploy_lock=deploy_lock,
+                updated_ids=updated_ids
             )
             result["git_result"] = git_result
             result["success"] = True
@@ -794,11 +1580,27 @@ def process_excel_to_index(
     else:
         result["success"] = True
     
+    # デプロイした内容をマニフェストに反映（次回のアップロードの差分判定に使用）
+    if INDEX_MANIFEST_ENABLED and enable_git_deploy:
+        manifest = IndexManifest()
+        try:
+            manifest.apply(index_name_short, manifest_upserts, delete_list)
+        finally:
+            manifest.close()
+    
+    # 正常終了したらチェックポイントは不要
+    if run_key:
+        checkpoint = CheckpointStore()
+        try:
+            checkpoint.delete_run(run_key)
+        finally:
+            checkpoint.close()
+    
     return result
 
 
 # =====================================================
-# Step 10: Git操作、タグ作成、デプロイ
+# Step 11: Git操作、タグ作成、デプロイ
 # =====================================================
 try:
     GITLAB_RETRY_MAX_ATTEMPTS = max(int(os.getenv("GITLAB_RETRY_MAX_ATTEMPTS", "3")), 1)
@@ -812,6 +1614,14 @@ except ValueError:
 
 GITLAB_RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
 
+# 1コミットあたりのリクエストサイズ上限（バイト）とアクション数上限
+GITLAB_COMMIT_MAX_BYTES = int(os.getenv("GITLAB_COMMIT_MAX_BYTES", str(20 * 1024 * 1024)))
+GITLAB_COMMIT_MAX_ACTIONS = int(os.getenv("GITLAB_COMMIT_MAX_ACTIONS", "1000"))
+
+# コミットとタグ作成を直列化するロック（ジョブキューで複数のジョブを並列に実行するため）
+# 複数のプロセスで実行する場合は、呼び出し側からプロセス間のロックを渡す
+GIT_DEPLOY_LOCK = threading.Lock()
+
 
 def _should_retry_status(status_code: Optional[int]) -> bool:
     """判定: ステータスコードがリトライ対象か"""
@@ -888,25 +1698,100 @@ def get_latest_commit_sha(branch: str = GITLAB_BRANCH) -> str:
     return response.json()["commit"]["id"]
 
 
+def _encode_json(obj) -> bytes:
+    """リクエストボディ用にJSONをバイト列へエンコード"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def iter_commit_actions(
+    files_to_add: Iterable[Path],
+    files_to_delete: Iterable[str],
+    files_to_update: Iterable[Path] = ()
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    コミットアクションを1件ずつ読み込み・エンコードして返す
+    
+    Yields:
+        Tuple[str, bytes]: (アクション種別, エンコード済みアクション)
+    """
+    for action, files in (("create", files_to_add), ("update", files_to_update)):
+        for file_path in files:
+            content = Path(file_path).read_text(encoding="utf-8")
+            yield action, _encode_json({
+                "action": action,
+                "file_path": f"{GITLAB_REMOTE_PATH_PREFIX}/{Path(file_path).name}",
+                "content": content
+            })
+    
+    for rag_id in files_to_delete:
+        yield "delete", _encode_json({
+            "action": "delete",
+            "file_path": f"{GITLAB_REMOTE_PATH_PREFIX}/{rag_id}.json"
+        })
+
+
+def iter_commit_batches(
+    actions: Iterable[Tuple[str, bytes]],
+    max_bytes: int = GITLAB_COMMIT_MAX_BYTES,
+    max_actions: int = GITLAB_COMMIT_MAX_ACTIONS
+) -> Iterator[Tuple[List[bytes], int, int, int]]:
+    """
+    エンコード済みアクションをリクエストサイズ上限に収まるバッチにまとめる
+    
+    Yields:
+        Tuple[List[bytes], int, int, int]: (アクションリスト, 追加件数, 更新件数, 削除件数)
+    """
+    batch, batch_bytes, added, updated, deleted = [], 0, 0, 0, 0
+    for kind, encoded in actions:
+        if batch and (batch_bytes + len(encoded) > max_bytes or len(batch) >= max_actions):
+            yield batch, added, updated, deleted
+            batch, batch_bytes, added, updated, deleted = [], 0, 0, 0, 0
+        batch.append(encoded)
+        batch_bytes += len(encoded) + 1
+        if kind == "create":
+            added += 1
+        elif kind == "update":
+            updated += 1
+        else:
+            deleted += 1
+    if batch:
+        yield batch, added, updated, deleted
+
+
+def build_commit_payload(branch: str, commit_message: str, actions: List[bytes]) -> bytes:
+    """エンコード済みアクションを連結してCommits APIのリクエストボディを作成"""
+    header = _encode_json({"branch": branch, "commit_message": commit_message})
+    return header[:-1] + b',"actions":[' + b",".join(actions) + b"]}"
+
+
 def commit_files_to_gitlab_batch(
     files_to_add: List[Path],
     files_to_delete: List[str],
     branch: str = GITLAB_BRANCH,
-    callback=None
+    callback=None,
+    files_to_update: Optional[List[Path]] = None
 ) -> Tuple[int, str, List[str]]:
     """
     GitLab Commits APIで複数ファイルをバッチコミット
     
+    ファイルはバッチを組み立てる時点で1件ずつ読み込み、リクエストサイズ
+    （GITLAB_COMMIT_MAX_BYTES）を上限にバッチを区切る。
+    次のバッチの読み込み・エンコードは、現在のバッチの送信中に別スレッドで行う
+    
     Args:
         files_to_add: 追加するファイルのパスリスト
         files_to_delete: 削除するrag_idリスト
         branch: ブランチ名
         callback: 進捗報告用コールバック
+        files_to_update: 更新する（リポジトリに既に存在する）ファイルのパスリスト
         
     Returns:
         Tuple[int, str, List[str]]: (コミット数, 最後のコミットSHA, 作成されたコミットSHAリスト)
     """
-    total_files = len(files_to_add) + len(files_to_delete)
+    files_to_update = files_to_update or []
+    total_files = len(files_to_add) + len(files_to_update) + len(files_to_delete)
     
     if total_files == 0:
         if callback:
@@ -914,63 +1799,53 @@ def commit_files_to_gitlab_batch(
         return 0, "", []
     
     if callback:
-        callback.log_info("Git操作", f"コミット開始: 追加{len(files_to_add)}件, 削除{len(files_to_delete)}件", 90)
+        callback.log_info("Git操作", f"コミット開始: 追加{len(files_to_add)}件, 更新{len(files_to_update)}件, "
+                                     f"削除{len(files_to_delete)}件", 90)
     
-    # アクションリストを作成
-    actions = []
+    batches = iter_commit_batches(iter_commit_actions(files_to_add, files_to_delete, files_to_update))
+    url = f"{GITLAB_API_BASE}/projects/{GITLAB_PROJECT_ID}/repository/commits"
     
-    # 追加ファイル
-    for file_path in files_to_add:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            actions.append({
-                "action": "create",
-                "file_path": f"{GITLAB_REMOTE_PATH_PREFIX}/{file_path.name}",
-                "content": content
-            })
-        except Exception as e:
-            if callback:
-                callback.log_error("Git操作", f"ファイル読み込み失敗: {file_path.name} - {str(e)}", 90)
-            raise
-    
-    # 削除ファイル
-    for rag_id in files_to_delete:
-        actions.append({
-            "action": "delete",
-            "file_path": f"{GITLAB_REMOTE_PATH_PREFIX}/{rag_id}.json"
-        })
-    
-    # バッチ処理
     commit_count = 0
     last_commit_sha = ""
     commit_sha_list = []  # 作成されたコミットSHAのリスト（ロールバック用）
+    processed = 0
     
-    with tqdm(total=len(actions), desc="Gitコミット", disable=callback is None) as pbar:
-        for i in range(0, len(actions), BATCH_SIZE):
-            batch_actions = actions[i:i + BATCH_SIZE]
-            batch_num = (i // BATCH_SIZE) + 1
-            total_batches = (len(actions) + BATCH_SIZE - 1) // BATCH_SIZE
+    with ThreadPoolExecutor(max_workers=1) as prefetcher, \
+            tqdm(total=total_files, desc="Gitコミット", disable=callback is None) as pbar:
+        next_batch = prefetcher.submit(next, batches, None)
+        while True:
+            try:
+                batch = next_batch.result()
+            except Exception as e:
+                if callback:
+                    callback.log_error("Git操作", f"ファイル読み込み失敗: {str(e)}", 90)
+                raise
+            if batch is None:
+                break
             
-            commit_message = f"auto deploy: update index files (batch {batch_num}/{total_batches}, added: {len([a for a in batch_actions if a['action'] == 'create'])}, deleted: {len([a for a in batch_actions if a['action'] == 'delete'])})"
+            # 送信中に次のバッチを組み立てる
+            next_batch = prefetcher.submit(next, batches, None)
             
-            url = f"{GITLAB_API_BASE}/projects/{GITLAB_PROJECT_ID}/repository/commits"
-            payload = {
-                "branch": branch,
-                "commit_message": commit_message,
-                "actions": batch_actions
-            }
+            batch_actions, added, updated, deleted = batch
+            batch_num = commit_count + 1
+            commit_message = (f"auto deploy: update index files "
+                              f"(batch {batch_num}, added: {added}, updated: {updated}, deleted: {deleted})")
+            payload = build_commit_payload(branch, commit_message, batch_actions)
             
             try:
-                response = _gitlab_request("POST", url, callback=callback, json=payload)
+                response = _gitlab_request(
+                    "POST", url, callback=callback,
+                    data=payload, headers={"Content-Type": "application/json"}
+                )
                 commit_data = response.json()
                 last_commit_sha = commit_data.get("id", "")
                 commit_sha_list.append(last_commit_sha)  # コミットSHAを記録
                 commit_count += 1
+                processed += len(batch_actions)
                 
                 if callback:
-                    progress = 90 + int((i / max(len(actions), 1)) * 5)
-                    callback.log_info("Git操作", f"バッチ{batch_num}/{total_batches}完了", progress)
+                    progress = 90 + int((processed / total_files) * 5)
+                    callback.log_info("Git操作", f"バッチ{batch_num}完了（{processed}/{total_files}件）", progress)
             except requests.HTTPError as e:
                 if callback:
                     callback.log_error("Git操作", f"コミット失敗 (batch {batch_num}): {str(e)}", 90)
@@ -984,12 +1859,12 @@ def commit_files_to_gitlab_batch(
     return commit_count, last_commit_sha, commit_sha_list
 
 
-def iter_gitlab_tags(per_page: int = 100):
-    """GitLabのタグ一覧を取得"""
+def iter_gitlab_tags(per_page: int = 100, order_by: str = "updated"):
+    """GitLabのタグ一覧を降順で取得（必要な分だけページを読み込む）"""
     page = 1
     while True:
         url = f"{GITLAB_API_BASE}/projects/{GITLAB_PROJECT_ID}/repository/tags"
-        params = {"order_by": "updated", "sort": "desc", "per_page": per_page, "page": page}
+        params = {"order_by": order_by, "sort": "desc", "per_page": per_page, "page": page}
         response = _gitlab_request("GET", url, params=params)
         batch = response.json()
         if not batch:
@@ -1002,23 +1877,14 @@ def iter_gitlab_tags(per_page: int = 100):
         page += 1
 
 
+def get_tag_summary() -> TagSummary:
+    """既存タグのNNN部分の最大値と最新タグを取得"""
+    return fetch_tag_summary(lambda order_by: iter_gitlab_tags(order_by=order_by))
+
+
 def get_max_seq_from_tags() -> int:
     """既存タグのNNN部分の最大値を取得"""
-    max_seq = 0
-    has_valid_tags = False
-    
-    for name in iter_gitlab_tags():
-        if name == "initial-tag":
-            continue
-        m = TAG_PATTERN.match(name)
-        if not m:
-            continue
-        has_valid_tags = True
-        seq = int(m.group(1))
-        if seq > max_seq:
-            max_seq = seq
-    
-    return max_seq if has_valid_tags else 0
+    return get_tag_summary().max_seq
 
 
 def build_next_tag(max_seq: int, tz_name: str = "Asia/Tokyo") -> str:
@@ -1038,9 +1904,9 @@ def create_gitlab_tag(tag_name: str, ref: str, message: str = TAG_MESSAGE, callb
     try:
         _gitlab_request("POST", url, callback=callback, data=payload)
     except requests.HTTPError as e:
-        # タグが既に存在する場合は無視
+        # タグが既に存在する場合は採番の競合のためエラーにする（同じタグ名で別のデプロイを上書きしない）
         if e.response.status_code == 400 and "already exists" in e.response.text:
-            return
+            raise RuntimeError(f"タグ {tag_name} は既に存在します") from e
         raise
 
 
@@ -1127,98 +1993,25 @@ def save_deploy_config(
         raise
 
 
-def trigger_jenkins_build(session: requests.Session, params: Dict[str, str]) -> str:
-    """Jenkinsビルドをトリガーし、キューURLを返す"""
-    url = f"{JENKINS_BASE.rstrip('/')}/job/{JENKINS_JOB}/buildWithParameters?token={JENKINS_JOB_TOKEN}"
-    auth = (JENKINS_USER, JENKINS_TOKEN)
-    
-    response = session.post(
-        url,
-        params=params,
-        auth=auth,
-        allow_redirects=False,
-        timeout=TIMEOUT,
-        verify=VERIFY_SSL
-    )
-    response.raise_for_status()
-    
-    queue_url = response.headers.get("Location")
-    if not queue_url:
-        raise RuntimeError("Jenkins: queue Location header がありません")
-    return queue_url
-
-
-def resolve_queue_to_build(session: requests.Session, queue_url: str, wait_sec: int = QUEUE_WAIT_SEC) -> str:
-    """JenkinsキューからビルドURLを取得"""
-    api = queue_url.rstrip("/") + "/api/json"
-    deadline = time.time() + wait_sec
-    auth = (JENKINS_USER, JENKINS_TOKEN)
-    
-    while time.time() < deadline:
-        response = session.get(api, auth=auth, timeout=TIMEOUT, verify=VERIFY_SSL)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get("cancelled"):
-            raise RuntimeError("Jenkins: queue cancelled")
-        
-        exe = data.get("executable")
-        if exe and exe.get("url"):
-            return exe["url"]
-        
-        time.sleep(POLL_INTERVAL)
-    
-    raise TimeoutError("Jenkins: queue → build 解決タイムアウト")
-
-
-def wait_for_build_result(session: requests.Session, build_url: str, wait_sec: int = BUILD_WAIT_SEC) -> str:
-    """Jenkinsビルドの完了を待機"""
-    api = build_url.rstrip("/") + "/api/json"
-    deadline = time.time() + wait_sec
-    auth = (JENKINS_USER, JENKINS_TOKEN)
-    
-    while time.time() < deadline:
-        response = session.get(api, auth=auth, timeout=TIMEOUT, verify=VERIFY_SSL)
-        response.raise_for_status()
-        data = response.json()
-        result = data.get("result")
-        
-        if result is not None:
-            return result
-        
-        time.sleep(POLL_INTERVAL)
-    
-    raise TimeoutError("Jenkins: ビルド完了待ちタイムアウト")
-
-
 def run_jenkins_flow(params: Dict[str, str], callback=None) -> str:
     """Jenkinsジョブを実行し、結果を返す"""
     if callback:
         callback.log_info("Jenkins実行", "Jenkinsビルドを開始", 97)
     
-    session = requests.Session()
-    session.auth = HTTPBasicAuth(JENKINS_USER, JENKINS_TOKEN)
+    event_messages = {
+        "queued": ("キューに追加されました", 97),
+        "started": ("ビルドが開始されました", 98),
+    }
     
-    # deploy_automation.py と同様に、セッションのプロキシを外しつつ、
-    # 一時的に環境変数のHTTP(S)_PROXYも無効化する
-    session.auth = None
-    session.proxies = {}
-    session.verify = VERIFY_SSL
-    original_http_proxy = os.environ.pop("HTTP_PROXY", None)
-    original_https_proxy = os.environ.pop("HTTPS_PROXY", None)
+    def on_event(event: str, value: str) -> None:
+        if callback and event in event_messages:
+            message, progress = event_messages[event]
+            callback.log_info("Jenkins実行", message, progress)
     
     try:
-        queue_url = trigger_jenkins_build(session, params)
-        
-        if callback:
-            callback.log_info("Jenkins実行", "キューに追加されました", 97)
-        
-        build_url = resolve_queue_to_build(session, queue_url)
-        
-        if callback:
-            callback.log_info("Jenkins実行", "ビルドが開始されました", 98)
-        
-        result = wait_for_build_result(session, build_url)
+        with JenkinsClient(JENKINS_BASE, JENKINS_JOB, JENKINS_USER, JENKINS_TOKEN,
+                           JENKINS_JOB_TOKEN, VERIFY_SSL, TIMEOUT) as client:
+            result = client.run(params, QUEUE_WAIT_SEC, BUILD_WAIT_SEC, on_event=on_event)
         
         if callback:
             callback.log_info("Jenkins実行", f"ビルド完了: {result}", 99)
@@ -1228,18 +2021,12 @@ def run_jenkins_flow(params: Dict[str, str], callback=None) -> str:
         if callback:
             callback.log_error("Jenkins実行", f"Jenkins実行失敗: {str(e)}", 99)
         raise
-    finally:
-        # 環境変数のHTTP(S)_PROXYを元に戻す
-        if original_http_proxy is not None:
-            os.environ["HTTP_PROXY"] = original_http_proxy
-        if original_https_proxy is not None:
-            os.environ["HTTPS_PROXY"] = original_https_proxy
 
 
-def cleanup_output_files(callback=None) -> None:
+def cleanup_output_files(callback=None, output_dir: Path = OUTPUT_DIR) -> None:
     """出力ディレクトリのファイルをクリーンアップ"""
     try:
-        files = list(OUTPUT_DIR.glob("*.json"))
+        files = list(output_dir.glob("*.json"))
         deleted_count = 0
         with tqdm(total=len(files), desc="ファイルクリーンアップ", disable=callback is None) as pbar:
             for file_path in files:
@@ -1255,21 +2042,25 @@ def cleanup_output_files(callback=None) -> None:
 
 
 def git_and_deploy_flow(
-    json_records: List[Dict],
+    rag_ids: List[str],
     delete_list: List[str],
     output_dir: Path,
     index_name_short: str,
-    callback=None
+    callback=None,
+    deploy_lock=None,
+    updated_ids: Optional[List[str]] = None
 ) -> Dict[str, any]:
     """
-    Step 10: Git操作、タグ作成、Jenkins実行を統合したフロー
+    Step 11: Git操作、タグ作成、Jenkins実行を統合したフロー
     
     Args:
-        json_records: 生成されたJSONレコード
+        rag_ids: 出力したJSONファイル（新規）のrag_idリスト
         delete_list: 削除対象のrag_idリスト
         output_dir: 出力ディレクトリ
         index_name_short: インデックス名（短縮形）
         callback: 進捗報告用コールバック
+        deploy_lock: コミットとタグ作成を直列化するロック。Noneの場合はプロセス内のロック
+        updated_ids: 出力したJSONファイルのうち、既存ファイルを更新するもののrag_idリスト
         
     Returns:
         Dict: 処理結果（new_tag, old_tag, commit_count, jenkins_result等）
@@ -1287,34 +2078,41 @@ def git_and_deploy_flow(
     
     try:
         if callback:
-            callback.log_info("Step10開始", "Git操作とデプロイフローを開始", 90)
-        
-        # 1. GitLab Commits APIでバッチコミット
-        files_to_add = [output_dir / f"{r['rag_id']}.json" for r in json_records]
-        commit_count, last_commit_sha, commit_sha_list = commit_files_to_gitlab_batch(
-            files_to_add, delete_list, GITLAB_BRANCH, callback
-        )
-        result["commit_count"] = commit_count
-        
-        if commit_count == 0:
-            if callback:
-                callback.log_info("Step10完了", "コミット対象がないため終了", 100)
-            return result
+            callback.log_info("Step11開始", "Git操作とデプロイフローを開始", 90)
         
-        # 2. タグ作成
-        max_seq = get_max_seq_from_tags()
-        new_tag = build_next_tag(max_seq)
-        
-        # 最新タグを old_tag として取得
-        old_tag = ""
-        for name in iter_gitlab_tags():
-            if name != "initial-tag" and TAG_PATTERN.match(name):
-                old_tag = name
-                break
-        
-        create_gitlab_tag(new_tag, last_commit_sha or GITLAB_BRANCH, callback=callback)
-        result["new_tag"] = new_tag
-        result["old_tag"] = old_tag
+        # 1〜2 はブランチとタグ採番を共有するため、並列に実行中の他のジョブとは1件ずつ行う
+        with deploy_lock or GIT_DEPLOY_LOCK:
+            # 1. コミット（GitLab Commits APIでバッチコミット、またはローカルクローンから1コミットでpush）
+            files_to_add = [output_dir / f"{rag_id}.json" for rag_id in rag_ids]
+            files_to_update = [output_dir / f"{rag_id}.json" for rag_id in updated_ids or []]
+            if GIT_COMMIT_BACKEND == "local":
+                # ローカルクローンではファイルの上書きで更新になる
+                commit_count, last_commit_sha, commit_sha_list = commit_files_local(
+                    GIT_REPO_URL, GIT_LOCAL_WORKDIR, files_to_add + files_to_update, delete_list,
+                    GITLAB_REMOTE_PATH_PREFIX, GITLAB_BRANCH,
+                    f"auto deploy: update index files (added: {len(files_to_add)}, "
+                    f"updated: {len(files_to_update)}, deleted: {len(delete_list)})",
+                    callback
+                )
+            else:
+                commit_count, last_commit_sha, commit_sha_list = commit_files_to_gitlab_batch(
+                    files_to_add, delete_list, GITLAB_BRANCH, callback, files_to_update=files_to_update
+                )
+            result["commit_count"] = commit_count
+            
+            if commit_count == 0:
+                if callback:
+                    callback.log_info("Step11完了", "コミット対象がないため終了", 100)
+                return result
+            
+            # 2. タグ作成（NNN最大値と最新タグ（old_tag）をまとめて取得）
+            tags = get_tag_summary()
+            new_tag = build_next_tag(tags.max_seq)
+            old_tag = tags.latest_tag
+            
+            create_gitlab_tag(new_tag, last_commit_sha or GITLAB_BRANCH, callback=callback)
+            result["new_tag"] = new_tag
+            result["old_tag"] = old_tag
         
         if callback:
             callback.log_info("タグ作成", f"タグ作成完了: {new_tag}", 95)
@@ -1346,10 +2144,10 @@ def git_and_deploy_flow(
             raise RuntimeError(f"Jenkins実行が失敗しました: {jenkins_result}")
         
         # 5. ファイルクリーンアップ
-        cleanup_output_files(callback)
+        cleanup_output_files(callback, output_dir)
         
         if callback:
-            callback.log_info("Step10完了", "すべての処理が正常に完了しました", 100)
+            callback.log_info("Step11完了", "すべての処理が正常に完了しました", 100)
         
         return result
         
@@ -1357,7 +2155,7 @@ def git_and_deploy_flow(
         result["error"] = str(e)
         
         if callback:
-            callback.log_error("Step10エラー", f"エラーが発生しました: {str(e)}", 100)
+            callback.log_error("Step11エラー", f"エラーが発生しました: {str(e)}", 100)
         
         # エラー時のロールバック（作成されたコミットをrevert）
         if commit_sha_list:
@@ -1386,7 +2184,7 @@ def git_and_deploy_flow(
         
         # ファイルクリーンアップ（エラー時も実行）
         try:
-            cleanup_output_files(callback)
+            cleanup_output_files(callback, output_dir)
         except Exception:
             pass
         
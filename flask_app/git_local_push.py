@@ -0,0 +1,120 @@
+"""
+ローカルクローン経由のGitコミットモジュール
+インデックスJSONをローカルクローンへ反映し、1コミット・1回のpushでリモートへ送る
+（GitLab Commits APIでの分割コミットの代替）
+"""
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import List, Tuple
+
+try:
+    from git import Repo, GitCommandError
+except ImportError:  # GitPython未インストール時はローカルpushを使用不可
+    Repo = None
+    GitCommandError = Exception
+
+logger = logging.getLogger(__name__)
+
+# pushするパックの圧縮レベル（0〜9）
+PACK_COMPRESSION = int(os.getenv("GIT_PACK_COMPRESSION", "9"))
+
+
+def ensure_clean_clone(repo_url: str, branch: str, workdir: Path) -> "Repo":
+    """
+    作業用クローンを用意し、リモートブランチの最新に揃える
+
+    作業用クローンはこの処理専用のため、ローカルの変更は破棄する
+    """
+    if Repo is None:
+        raise RuntimeError("GitPythonがインストールされていないため、ローカルpushを使用できません")
+
+    workdir = Path(workdir)
+    if not (workdir / ".git").is_dir():
+        if workdir.exists() and any(workdir.iterdir()):
+            raise RuntimeError(f"'{workdir}' は空でない非リポジトリです。")
+        workdir.parent.mkdir(parents=True, exist_ok=True)
+        logger.info(f"クローン中: {workdir}")
+        repo = Repo.clone_from(repo_url, str(workdir), branch=branch, single_branch=True)
+    else:
+        repo = Repo(str(workdir))
+        repo.remotes.origin.set_url(repo_url)
+        repo.remotes.origin.fetch(branch)
+        repo.git.checkout("-B", branch, f"origin/{branch}")
+        repo.git.reset("--hard", f"origin/{branch}")
+        repo.git.clean("-fdq")
+
+    with repo.config_writer() as config:
+        config.set_value("pack", "compression", PACK_COMPRESSION)
+        config.set_value("core", "compression", PACK_COMPRESSION)
+    return repo
+
+
+def commit_files_local(
+    repo_url: str,
+    workdir: Path,
+    files_to_add: List[Path],
+    files_to_delete: List[str],
+    remote_path_prefix: str,
+    branch: str,
+    message: str,
+    callback=None
+) -> Tuple[int, str, List[str]]:
+    """
+    追加・削除をローカルクローンに反映して1コミットにまとめ、1回のpushで送信
+
+    Args:
+        repo_url: リモートリポジトリURL（ローカルのベアリポジトリのパスも可）
+        workdir: 作業用クローンのディレクトリ
+        files_to_add: 追加するファイルのパスリスト
+        files_to_delete: 削除するrag_idリスト
+        remote_path_prefix: リポジトリ内の配置先ディレクトリ
+        branch: ブランチ名
+        message: コミットメッセージ
+        callback: 進捗報告用コールバック
+
+    Returns:
+        Tuple[int, str, List[str]]: (コミット数, コミットSHA, 作成されたコミットSHAリスト)
+        commit_files_to_gitlab_batch と同じ形式
+    """
+    if not files_to_add and not files_to_delete:
+        if callback:
+            callback.log_info("Git操作", "コミット対象のファイルがありません", 90)
+        return 0, "", []
+
+    if callback:
+        callback.log_info("Git操作", f"ローカルクローンを準備中: {branch}", 90)
+    repo = ensure_clean_clone(repo_url, branch, workdir)
+
+    target_dir = Path(repo.working_tree_dir) / remote_path_prefix
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    for file_path in files_to_add:
+        shutil.copyfile(file_path, target_dir / Path(file_path).name)
+    for rag_id in files_to_delete:
+        (target_dir / f"{rag_id}.json").unlink(missing_ok=True)
+
+    if callback:
+        callback.log_info("Git操作",
+                          f"ローカルクローンに反映: 追加{len(files_to_add)}件, 削除{len(files_to_delete)}件", 92)
+
+    repo.git.add("-A", remote_path_prefix)
+    if not repo.is_dirty(index=True, working_tree=False, untracked_files=False):
+        if callback:
+            callback.log_info("Git操作", "リモートとの差分がないためコミットしません", 95)
+        return 0, "", []
+
+    commit = repo.index.commit(message)
+
+    try:
+        repo.remotes.origin.push(f"{branch}:{branch}").raise_if_error()
+    except GitCommandError as e:
+        if callback:
+            callback.log_error("Git操作", f"push失敗: {str(e)}", 95)
+        raise
+
+    if callback:
+        callback.log_info("Git操作", f"コミット・push完了: {commit.hexsha[:8]}", 95)
+
+    return 1, commit.hexsha, [commit.hexsha]
@@ -0,0 +1,176 @@
+"""
+インデックスマニフェスト管理モジュール
+最後にデプロイしたインデックスの各レコード（rag_id・contentハッシュ・メタデータハッシュ）を
+インデックス名ごとにSQLiteへ保存し、次のアップロードとの差分判定に使用する。
+メタデータのみの更新でAPIを呼ばずに済むよう、レコードのEmbeddingとキーワードも保存する
+"""
+import json
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+
+from database import connect_sqlite
+
+MANIFEST_DB_PATH = Path(__file__).parent / "data" / "manifest" / "index_manifest.db"
+
+# (レコードキー, contentハッシュ, メタデータハッシュ)
+ManifestEntry = Tuple[str, str, str]
+
+# SQLiteのバインド変数上限を超えないよう IN 句を分割する
+_LOOKUP_CHUNK_SIZE = 400
+
+
+class IndexManifest:
+    """インデックス名ごとの、デプロイ済みレコードのハッシュ一覧"""
+
+    def __init__(self, db_path: Path = MANIFEST_DB_PATH):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(db_path, check_same_thread=False)
+        # 複数のワーカープロセスが同時に初期化しても、スキーマの作成が競合しないよう書き込みロックを先に取る
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS records (
+                index_name_short TEXT NOT NULL,
+                rag_id TEXT NOT NULL,
+                record_key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                metadata_hash TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (index_name_short, rag_id)
+            )
+        ''')
+        # contentハッシュごとに保存し、デプロイ前に書き込んでも前回デプロイ分の値を上書きしない
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS vectors (
+                index_name_short TEXT NOT NULL,
+                rag_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                keywords TEXT NOT NULL,
+                PRIMARY KEY (index_name_short, rag_id, content_hash)
+            )
+        ''')
+        self._conn.commit()
+
+    def get_records(self, index_name_short: str) -> Dict[str, ManifestEntry]:
+        """インデックスのデプロイ済みレコードを取得（rag_id → (レコードキー, contentハッシュ, メタデータハッシュ)）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rag_id, record_key, content_hash, metadata_hash FROM records "
+                "WHERE index_name_short = ?",
+                (index_name_short,)
+            ).fetchall()
+        return {rag_id: (record_key, c_hash, m_hash) for rag_id, record_key, c_hash, m_hash in rows}
+
+    def _lookup_vectors(self, columns: str, index_name_short: str,
+                        keys: Iterable[Tuple[str, str]]) -> List[tuple]:
+        """(rag_id, contentハッシュ) に一致するvectorsテーブルの行をまとめて取得"""
+        keys = list(keys)
+        rows = []
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_CHUNK_SIZE):
+                chunk = keys[i:i + _LOOKUP_CHUNK_SIZE]
+                placeholders = ", ".join("(?, ?)" for _ in chunk)
+                rows.extend(self._conn.execute(
+                    f"SELECT {columns} FROM vectors "
+                    f"WHERE index_name_short = ? AND (rag_id, content_hash) IN (VALUES {placeholders})",
+                    [index_name_short, *(value for key in chunk for value in key)]
+                ).fetchall())
+        return rows
+
+    def get_vector_ids(self, index_name_short: str, keys: Iterable[Tuple[str, str]]) -> Set[str]:
+        """Embeddingとキーワードを保存済みのrag_idを取得（keys: (rag_id, contentハッシュ)）"""
+        return {rag_id for (rag_id,) in self._lookup_vectors("rag_id", index_name_short, keys)}
+
+    def get_vectors(
+        self,
+        index_name_short: str,
+        keys: Iterable[Tuple[str, str]]
+    ) -> Dict[str, Tuple[List[float], List[str]]]:
+        """
+        保存済みのEmbeddingとキーワードを取得
+
+        Args:
+            index_name_short: インデックス名
+            keys: 取得するレコードの (rag_id, contentハッシュ)
+
+        Returns:
+            Dict[str, Tuple[List[float], List[str]]]: rag_id → (Embedding, キーワード)
+        """
+        result = {}
+        for rag_id, blob, keywords in self._lookup_vectors("rag_id, vector, keywords", index_name_short, keys):
+            vector = array("d")
+            vector.frombytes(blob)
+            result[rag_id] = (vector.tolist(), json.loads(keywords))
+        return result
+
+    def put_vectors(
+        self,
+        index_name_short: str,
+        items: Iterable[Tuple[str, str, List[float], List[str]]]
+    ) -> None:
+        """
+        出力したレコードのEmbeddingとキーワードを保存（float64のバイト列として保存し、値を変えない）
+
+        デプロイが成功しなかった場合も、apply() でマニフェストと一致しない行として削除される
+
+        Args:
+            index_name_short: インデックス名
+            items: (rag_id, contentハッシュ, Embedding, キーワード)
+        """
+        # 値の変換はロックの外で行い、書き込みのトランザクションを短くする
+        rows = [(index_name_short, rag_id, c_hash, array("d", vector).tobytes(),
+                 json.dumps(keywords, ensure_ascii=False))
+                for rag_id, c_hash, vector, keywords in items]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO vectors "
+                    "(index_name_short, rag_id, content_hash, vector, keywords) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def apply(
+        self,
+        index_name_short: str,
+        upserts: Iterable[Tuple[str, str, str, str]],
+        deletes: Iterable[str]
+    ) -> None:
+        """
+        デプロイした変更を1トランザクションで反映
+
+        Args:
+            index_name_short: インデックス名
+            upserts: 追加・更新したレコードの (rag_id, レコードキー, contentハッシュ, メタデータハッシュ)
+            deletes: 削除したrag_id
+        """
+        now = time.time()
+        upserts = [(index_name_short, rag_id, record_key, c_hash, m_hash, now)
+                   for rag_id, record_key, c_hash, m_hash in upserts]
+        deletes = [(index_name_short, rag_id) for rag_id in deletes]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM records WHERE index_name_short = ? AND rag_id = ?", deletes
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO records "
+                    "(index_name_short, rag_id, record_key, content_hash, metadata_hash, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", upserts
+                )
+                # デプロイ済みのcontentと一致しないEmbedding・キーワードは不要
+                self._conn.execute(
+                    "DELETE FROM vectors WHERE index_name_short = ? AND NOT EXISTS ("
+                    "SELECT 1 FROM records r WHERE r.index_name_short = vectors.index_name_short "
+                    "AND r.rag_id = vectors.rag_id AND r.content_hash = vectors.content_hash)",
+                    (index_name_short,)
+                )
+
+    def close(self) -> None:
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,191 @@
+"""
+Jenkinsクライアントモジュール
+buildWithParameters の起動、キュー → ビルドの解決、ビルド完了待ちを行う
+（excel_to_index_processor.py / deploy_automation.py で共用するため、他モジュールに依存しない）
+"""
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# ポーリング間隔（秒）: 初回 → 係数倍で伸ばし、上限で頭打ち
+POLL_INITIAL_SEC = 1.0
+POLL_MAX_SEC = 15.0
+POLL_FACTOR = 1.5
+
+# 必要な項目のみ返すよう tree= で絞り込む
+QUEUE_TREE = "cancelled,executable[url]"
+BUILD_TREE = "result,building,timestamp,estimatedDuration"
+
+
+def next_poll_interval(interval: float, remaining_estimate: Optional[float] = None) -> float:
+    """
+    次のポーリング間隔を計算
+
+    Args:
+        interval: 直前の間隔
+        remaining_estimate: ビルド完了までの推定残り秒数（不明な場合はNone）
+    """
+    grown = min(interval * POLL_FACTOR, POLL_MAX_SEC)
+    if remaining_estimate is None or remaining_estimate <= 0:
+        return grown
+    if remaining_estimate < grown:
+        # 推定完了時刻が近い場合はその時刻に合わせて確認する
+        return max(remaining_estimate, POLL_INITIAL_SEC)
+    # 推定完了時刻まで長い場合は間隔を広げる
+    return min(max(grown, remaining_estimate / 2), POLL_MAX_SEC)
+
+
+class JenkinsClient:
+    """接続を使い回すJenkinsクライアント"""
+
+    def __init__(
+        self,
+        base_url: str,
+        job: str,
+        user: str,
+        token: str,
+        job_token: str = "",
+        verify_ssl: bool = True,
+        timeout: Tuple[int, int] = (10, 30)
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.job = job
+        self.job_token = job_token
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.auth = (user, token)
+        # Jenkinsへはプロキシを経由しない（環境変数のHTTP(S)_PROXYも参照しない）
+        self.session.trust_env = False
+        self.session.proxies = {}
+        ca_bundle = os.getenv("REQUESTS_CA_BUNDLE")
+        self.session.verify = ca_bundle if verify_ssl and ca_bundle else verify_ssl
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self) -> None:
+        """セッションを閉じる"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- 1回分のAPI呼び出し ----------
+    def trigger_build(self, params: Dict[str, str]) -> str:
+        """Jenkinsビルドをトリガーし、キューURLを返す"""
+        url = f"{self.base_url}/job/{self.job}/buildWithParameters"
+        response = self.session.post(
+            url,
+            params={"token": self.job_token, **params},
+            allow_redirects=False,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        queue_url = response.headers.get("Location")
+        if not queue_url:
+            raise RuntimeError("Jenkins: queue Location header がありません")
+        return queue_url
+
+    def check_queue(self, queue_url: str) -> Optional[str]:
+        """キューの状態を1回確認し、ビルドが開始していればビルドURLを返す"""
+        response = self.session.get(
+            queue_url.rstrip("/") + "/api/json",
+            params={"tree": QUEUE_TREE},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        if data.get("cancelled"):
+            raise RuntimeError("Jenkins: queue cancelled")
+        exe = data.get("executable")
+        if exe and exe.get("url"):
+            return exe["url"]
+        return None
+
+    def check_build(self, build_url: str) -> Tuple[Optional[str], Optional[float]]:
+        """
+        ビルドの状態を1回確認
+
+        Returns:
+            Tuple[Optional[str], Optional[float]]: (結果（実行中はNone）, 推定残り秒数（不明な場合はNone）)
+        """
+        response = self.session.get(
+            build_url.rstrip("/") + "/api/json",
+            params={"tree": BUILD_TREE},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        result = data.get("result")
+        if result is not None:
+            return result, None
+
+        started_ms = data.get("timestamp")
+        estimated_ms = data.get("estimatedDuration")
+        if started_ms and estimated_ms and estimated_ms > 0:
+            return None, (started_ms + estimated_ms) / 1000 - time.time()
+        return None, None
+
+    # ---------- 完了待ち ----------
+    def resolve_queue_to_build(self, queue_url: str, wait_sec: float) -> str:
+        """キューからビルドURLが決まるまで待機"""
+        deadline = time.monotonic() + wait_sec
+        interval = POLL_INITIAL_SEC
+        while time.monotonic() < deadline:
+            build_url = self.check_queue(queue_url)
+            if build_url:
+                logger.info("Queue resolved to build: %s", build_url)
+                return build_url
+            time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+            interval = next_poll_interval(interval)
+        raise TimeoutError("Jenkins: queue → build 解決タイムアウト")
+
+    def wait_for_build_result(self, build_url: str, wait_sec: float) -> str:
+        """ビルドが完了するまで待機し、結果を返す"""
+        deadline = time.monotonic() + wait_sec
+        interval = POLL_INITIAL_SEC
+        while time.monotonic() < deadline:
+            result, remaining = self.check_build(build_url)
+            if result is not None:
+                logger.info("Jenkins result: %s", result)
+                return result
+            time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+            interval = next_poll_interval(interval, remaining)
+        raise TimeoutError("Jenkins: ビルド完了待ちタイムアウト")
+
+    def run(
+        self,
+        params: Dict[str, str],
+        queue_wait_sec: float,
+        build_wait_sec: float,
+        on_event: Optional[Callable[[str, str], None]] = None
+    ) -> str:
+        """
+        ビルドの起動から完了までを実行し、結果を返す
+
+        Args:
+            on_event: 進捗通知 (イベント名, URL) を受け取る関数（"queued" / "started" / "finished"）
+        """
+        queue_url = self.trigger_build(params)
+        if on_event:
+            on_event("queued", queue_url)
+        build_url = self.resolve_queue_to_build(queue_url, queue_wait_sec)
+        if on_event:
+            on_event("started", build_url)
+        result = self.wait_for_build_result(build_url, build_wait_sec)
+        if on_event:
+            on_event("finished", result)
+        return result
@@ -0,0 +1,208 @@
+"""
+ジョブキューモジュール
+アップロードされたファイルの処理をDBのジョブキューに登録し、ワーカーで順に実行する
+（ワーカーは worker.py の別プロセス、または JOB_RUNNER=thread の場合はWebサーバー内のスレッド）
+（同じインデックス名のジョブは1件ずつ、異なるインデックス名のジョブは並列に実行する）
+
+実行中のジョブはインデックス名ごとのリース（有効期限付きのロック）を保持し、
+ハートビートで期限を延長し続ける。プロセスが停止してハートビートが途絶えたジョブは、
+期限切れ後に他のワーカーがエラーにしてインデックス名を解放する（複数のサーバープロセスでDBを共有できる）
+"""
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from database import (
+    enqueue_job, claim_next_job, finish_job, get_active_jobs, get_average_duration,
+    acquire_lease, renew_leases, release_lease
+)
+
+# 同時に実行するジョブ数
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "2")))
+# 通知が無くてもキューを確認する間隔（秒）: 別プロセスで登録されたジョブは通知で起きないため短めにする
+JOB_POLL_INTERVAL_SEC = 2.0
+# 処理時間の実績が無い場合の、待ち時間見積もり用の処理時間（秒）
+DEFAULT_JOB_DURATION_SEC = 600.0
+
+# リースの有効秒数とハートビート間隔（有効秒数の間にハートビートが無ければ停止したとみなす）
+JOB_LEASE_SEC = float(os.getenv("JOB_LEASE_SEC", "60"))
+JOB_HEARTBEAT_SEC = max(1.0, JOB_LEASE_SEC / 4)
+# 他の保持者のリースが解放されるのを待つ間隔（秒）
+LEASE_RETRY_INTERVAL_SEC = 1.0
+
+STALE_JOB_ERROR_MESSAGE = '処理中のサーバーからの応答（ハートビート）が途絶えたため、処理を中断しました。再度アップロードしてください。'
+
+
+def new_worker_id() -> str:
+    """リース保持者IDを生成（ホスト名・プロセスID・乱数）"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# このプロセスのリース保持者ID
+WORKER_ID = new_worker_id()
+
+
+class LeaseLock:
+    """
+    リースによるプロセス間のロック（with文で使用）
+
+    取得中はJobQueueのハートビートで期限が延長される（保持者IDが同じため）
+    """
+
+    def __init__(self, name: str, owner: str = WORKER_ID, ttl_sec: float = JOB_LEASE_SEC,
+                 task_id: Optional[str] = None):
+        self.name = name
+        self.owner = owner
+        self.ttl_sec = ttl_sec
+        self.task_id = task_id
+
+    def __enter__(self):
+        while not acquire_lease(self.name, self.owner, self.ttl_sec, self.task_id):
+            time.sleep(LEASE_RETRY_INTERVAL_SEC)
+        return self
+
+    def __exit__(self, *exc):
+        release_lease(self.name, self.owner)
+
+
+class JobQueue:
+    """DBのジョブキューからジョブを取り出して実行するワーカープール"""
+
+    def __init__(self, run_job: Callable[[Dict], None], workers: int = JOB_WORKERS, owner: str = WORKER_ID):
+        """
+        Args:
+            run_job: ジョブ（jobsテーブルの行）を受け取って処理する関数
+            workers: ワーカースレッド数
+            owner: リース保持者ID
+        """
+        self._run_job = run_job
+        self._workers = workers
+        self.owner = owner
+        self._running = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self) -> None:
+        """ワーカースレッドを起動（起動済みの場合は何もしない）"""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            # ハートビートは実行中のジョブが終わるまで続ける（停止時も join() で待たない）
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def stop(self) -> None:
+        """新しいジョブの取り出しをやめる（実行中のジョブは完了まで続ける）"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        stop() の後、実行中のジョブが完了してワーカースレッドが終了するまで待機
+
+        Returns:
+            bool: 全てのワーカースレッドが終了した場合True（タイムアウト時はFalse）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def submit(self, task_id: str, concurrency_key: str, file_path: str) -> None:
+        """ジョブをキューに追加し、待機中のワーカーを起こす"""
+        enqueue_job(task_id, concurrency_key, file_path)
+        self._wake()
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def _worker(self) -> None:
+        """実行可能なジョブが無い間は待機し、あれば取り出して実行する（stop() 後は終了する）"""
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+            try:
+                job = claim_next_job(self.owner, JOB_LEASE_SEC, STALE_JOB_ERROR_MESSAGE)
+            except Exception as e:
+                print(f"[ERROR] ジョブの取り出しに失敗しました: {e}")
+                job = None
+
+            if job is None:
+                with self._cond:
+                    self._cond.wait(JOB_POLL_INTERVAL_SEC)
+                continue
+
+            with self._cond:
+                self._running += 1
+            try:
+                self._run_job(job)
+            except Exception as e:
+                print(f"[ERROR] ジョブの実行に失敗しました (task_id: {job['task_id']}): {e}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+                try:
+                    finish_job(job['task_id'], self.owner)
+                except Exception as e:
+                    print(f"[ERROR] ジョブの完了記録に失敗しました (task_id: {job['task_id']}): {e}")
+                # 同じキーの後続ジョブが実行可能になったため、他のワーカーも起こす
+                self._wake()
+
+    def _heartbeat(self) -> None:
+        """実行中のジョブ（と処理中に取得したリース）の有効期限を定期的に延長する"""
+        while True:
+            time.sleep(JOB_HEARTBEAT_SEC)
+            with self._cond:
+                running = self._running
+            if running == 0:
+                continue
+            try:
+                renewed = renew_leases(self.owner, JOB_LEASE_SEC)
+                if renewed < running:
+                    # 停止とみなされてリースを失った（他のワーカーにエラーにされた）ジョブがある
+                    print(f"[WARNING] リースの延長に失敗したジョブがあります（実行中: {running}, 延長: {renewed}）")
+            except Exception as e:
+                print(f"[ERROR] リースの延長に失敗しました: {e}")
+
+    def lease_lock(self, name: str, task_id: Optional[str] = None) -> LeaseLock:
+        """このワーカープールの保持者IDでリースを取得するロック（ハートビートで延長される）"""
+        return LeaseLock(name, self.owner, JOB_LEASE_SEC, task_id)
+
+    def queue_info(self, task_id: str) -> Optional[Dict]:
+        """
+        待機中のジョブの順番と推定待ち時間を取得
+
+        Returns:
+            Optional[Dict]: position（待機中ジョブ全体での順番、1始まり）、
+                jobs_ahead（先に実行されるジョブ数）、estimated_wait_sec（推定待ち時間）。
+                待機中でない場合はNone
+        """
+        jobs = get_active_jobs()
+        job = next((j for j in jobs if j['task_id'] == task_id), None)
+        if job is None or job['status'] != 'queued':
+            return None
+
+        ahead = [j for j in jobs if j['status'] == 'running' or j['enqueued_at'] < job['enqueued_at']]
+        ahead = [j for j in ahead if j['task_id'] != task_id]
+        queued_ahead = sum(1 for j in ahead if j['status'] == 'queued')
+        same_key_ahead = sum(1 for j in ahead if j['concurrency_key'] == job['concurrency_key'])
+
+        # 同じキーのジョブは1件ずつ、全体ではワーカー数ずつ実行される
+        rounds = max(same_key_ahead, math.ceil(len(ahead) / self._workers))
+        duration = get_average_duration() or DEFAULT_JOB_DURATION_SEC
+        return {
+            'position': queued_ahead + 1,
+            'jobs_ahead': len(ahead),
+            'estimated_wait_sec': round(rounds * duration),
+        }
@@ -0,0 +1,99 @@
+"""
+ログ書き込みバッファモジュール
+処理中のログとステップ進捗をメモリに溜め、バックグラウンドスレッドでまとめてSQLiteへ書き込む
+"""
+import os
+import threading
+from collections import deque
+from typing import Dict, Tuple
+
+from database import log_timestamp, write_progress
+from progress_events import progress_notifier
+
+# 書き込み間隔（ミリ秒）と、間隔を待たずに書き込む件数
+LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "50"))
+LOG_FLUSH_MAX_ENTRIES = int(os.getenv("LOG_FLUSH_MAX_ENTRIES", "200"))
+# この件数を超えて溜まった場合は、呼び出し元で書き込みを待つ
+LOG_BUFFER_LIMIT = 10000
+
+
+class BufferedLogWriter:
+    """ログはexecutemanyでまとめて追加し、ステップ進捗はタスクごとに最新の値のみ書き込む"""
+
+    def __init__(self, interval_ms: int = LOG_FLUSH_INTERVAL_MS, max_entries: int = LOG_FLUSH_MAX_ENTRIES):
+        self._interval = interval_ms / 1000
+        self._max_entries = max_entries
+        self._cond = threading.Condition()
+        self._logs = deque()
+        self._steps: Dict[str, Tuple[str, int, float, float]] = {}
+        # flush() の書き込みとフラッシュスレッドの書き込みを直列化し、ログの順序を保つ
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_thread(self) -> None:
+        """フラッシュスレッドを起動（初回のみ）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def add_log(self, task_id: str, level: str, step_name: str, message: str, progress: int = 0) -> None:
+        """ログをバッファに追加"""
+        row = (task_id, log_timestamp(), level, step_name, message, progress)
+        with self._cond:
+            self._ensure_thread()
+            self._logs.append(row)
+            pending = len(self._logs)
+            if pending == 1 or pending >= self._max_entries:
+                self._cond.notify()
+        if pending >= LOG_BUFFER_LIMIT:
+            self.flush()
+
+    def update_step(self, task_id: str, step_name: str, step_index: int,
+                    step_progress: float, estimated_remaining_time: float = 0) -> None:
+        """ステップ進捗をバッファに記録（未書き込みの値は上書き）"""
+        with self._cond:
+            self._ensure_thread()
+            was_empty = not self._logs and not self._steps
+            self._steps[task_id] = (step_name, step_index, step_progress, estimated_remaining_time)
+            if was_empty:
+                self._cond.notify()
+
+    def flush(self) -> None:
+        """バッファの内容をすぐに書き込む"""
+        with self._write_lock:
+            with self._cond:
+                logs = list(self._logs)
+                self._logs.clear()
+                steps = self._steps
+                self._steps = {}
+            updated = {row[0] for row in logs} | set(steps)
+            try:
+                # 共有時は更新番号も同じトランザクションで進める（通知のための書き込みを増やさない）
+                write_progress(logs, steps, updated if progress_notifier.shared else ())
+            except Exception:
+                # 書き込めなかったログは次回に持ち越す
+                with self._cond:
+                    self._logs.extendleft(reversed(logs))
+                    for task_id, step in steps.items():
+                        self._steps.setdefault(task_id, step)
+                raise
+            
+            # 書き込み後に通知し、SSEがDBから最新の内容を読めるようにする
+            progress_notifier.notify(*updated)
+
+    def _run(self) -> None:
+        """データが入ったら一定時間（または一定件数）溜めてから書き込む"""
+        while True:
+            with self._cond:
+                # 空の間は待機し続ける（アイドル時はDBにアクセスしない）
+                self._cond.wait_for(lambda: self._logs or self._steps)
+                if len(self._logs) < self._max_entries:
+                    self._cond.wait(self._interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[ERROR] ログの書き込みに失敗しました: {e}")
+
+
+# プロセス内で共有するログ書き込みバッファ
+log_writer = BufferedLogWriter()
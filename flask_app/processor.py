@@ -9,7 +9,7 @@ from datetime import datetime
 from typing import Callable
 import pandas as pd
 from database import (
-    add_log, update_upload_status, set_lock
+    add_log, update_upload_status
 )
 
 # 処理ステップの定義
@@ -111,9 +111,6 @@ def run_processing(task_id: str, file_path: str, simulate_error: bool = False):
     callback = ProcessorCallback(task_id)
     
     try:
-        # ロックを設定
-        set_lock(True, task_id)
-        
         # 処理開始
         update_upload_status(task_id, 'processing')
         callback.log_info('処理開始', 'ファイル処理を開始します', 0)
@@ -148,13 +145,6 @@ def run_processing(task_id: str, file_path: str, simulate_error: bool = False):
                         os.remove(file_path)
                 except Exception as e:
                     print(f"ファイル削除失敗: {e}")
-                
-                # ロックを解除（finally節でも解除されるが、早期に解除する）
-                try:
-                    set_lock(False)
-                    print(f"[INFO] エラー発生によりロックを解除しました (task_id: {task_id})")
-                except Exception as e:
-                    print(f"ロック解除失敗（finally節で再試行します）: {e}")
                 return
         
         # すべての処理が成功
@@ -180,24 +170,3 @@ def run_processing(task_id: str, file_path: str, simulate_error: bool = False):
                 os.remove(file_path)
         except Exception as file_error:
             print(f"ファイル削除エラー: {file_error}")
-    
-    finally:
-        # ロックを確実に解除（エラーが発生しても必ず実行）
-        try:
-            set_lock(False)
-            print(f"[INFO] ロックを解除しました (task_id: {task_id})")
-        except Exception as lock_error:
-            print(f"[ERROR] ロック解除に失敗しました: {lock_error}")
-            # 最後の手段：直接データベースを更新
-            try:
-                import sqlite3
-                DB_PATH = os.path.join(os.path.dirname(__file__), 'uploads.db')
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute('UPDATE lock_status SET is_locked = 0, current_task_id = NULL WHERE id = 1')
-                conn.commit()
-                conn.close()
-                print(f"[INFO] 直接データベース操作でロックを解除しました")
-            except Exception as db_error:
-                print(f"[CRITICAL] ロック解除が完全に失敗しました: {db_error}")
-
@@ -6,13 +6,13 @@ import time
 import os
 from pathlib import Path
 import shutil
+from typing import Dict
 from database import (
-    add_log, update_upload_status, set_lock, update_index_excel_path,
-    update_processing_stats, update_step_progress
+    update_upload_status, update_index_excel_path,
+    update_processing_stats, get_uploads_with_index_file_beyond
 )
-
-# 古いインデックスファイルを削除する関数をインポート
-# 循環インポートを避けるため、関数内でインポートする
+from log_writer import log_writer
+from progress_events import progress_notifier
 
 # excel_to_index_processorをインポート
 from excel_to_index_processor import (
@@ -24,11 +24,24 @@ from excel_to_index_processor import (
 # インデックス化データ一覧の出力先ディレクトリ
 INDEX_LIST_DIR = Path(__file__).parent / 'data' / 'output_index_list'
 INDEX_LIST_DIR.mkdir(parents=True, exist_ok=True)
+# インデックス化データ一覧ファイルを保持するアップロード件数
+INDEX_FILE_KEEP_COUNT = 5
+
+
+def job_input_dir(task_id: str) -> Path:
+    """タスクごとの入力ディレクトリ（他のタスクのファイルを読み込まないよう分ける）"""
+    return INPUT_DIR / task_id
+
+
+def job_output_dir(task_id: str) -> Path:
+    """タスクごとの出力ディレクトリ"""
+    return OUTPUT_DIR / task_id
 
 # 処理ステップの定義
 PROCESSING_STEPS = [
     {"name": "ファイル検証", "description": "Excelファイルの読み込みと検証"},
     {"name": "バリデーションチェック", "description": "データの内容を確認"},
+    {"name": "差分判定", "description": "前回デプロイしたインデックスとの比較"},
     {"name": "UUID生成", "description": "rag_id列の追加"},
     {"name": "データクレンジング", "description": "重複チェックと削除対象特定"},
     {"name": "旧データ削除", "description": "既存JSONファイルの削除"},
@@ -46,28 +59,29 @@ class ProcessorCallback:
         self.task_id = task_id
         self.current_progress = 0
         self.current_step_index = 0
-        self.total_steps = 10
+        self.total_steps = len(PROCESSING_STEPS)
     
     def log_info(self, step_name: str, message: str, progress: int):
         """INFOレベルのログを記録"""
-        add_log(self.task_id, 'INFO', step_name, message, progress)
+        log_writer.add_log(self.task_id, 'INFO', step_name, message, progress)
         self.current_progress = progress
     
     def log_warning(self, step_name: str, message: str, progress: int):
         """WARNINGレベルのログを記録"""
-        add_log(self.task_id, 'WARNING', step_name, message, progress)
+        log_writer.add_log(self.task_id, 'WARNING', step_name, message, progress)
         self.current_progress = progress
     
     def log_error(self, step_name: str, message: str, progress: int):
-        """ERRORレベルのログを記録"""
-        add_log(self.task_id, 'ERROR', step_name, message, progress)
+        """ERRORレベルのログを記録（エラーはすぐに書き込む）"""
+        log_writer.add_log(self.task_id, 'ERROR', step_name, message, progress)
         self.current_progress = progress
+        self.flush()
     
     def update_step(self, step_name: str, step_index: int, step_progress: float, 
                     estimated_remaining_time: float = 0):
         """ステップ進捗を更新（tqdm用）"""
         self.current_step_index = step_index
-        update_step_progress(
+        log_writer.update_step(
             self.task_id, 
             step_name, 
             step_index, 
@@ -75,6 +89,10 @@ class ProcessorCallback:
             estimated_remaining_time
         )
     
+    def flush(self):
+        """バッファ済みのログとステップ進捗を書き込む"""
+        log_writer.flush()
+    
     def update_stats(self, record_count: int = None, json_files_created: int = None,
                     json_files_deleted: int = None):
         """統計情報を更新"""
@@ -84,42 +102,51 @@ class ProcessorCallback:
             json_files_created=json_files_created,
             json_files_deleted=json_files_deleted
         )
+        progress_notifier.publish(self.task_id)
+    
+    def update_status(self, status: str, error_message: str = None):
+        """タスクのステータスを更新"""
+        update_upload_status(self.task_id, status, error_message)
+        progress_notifier.publish(self.task_id)
 
 
-def run_processing(task_id: str, file_path: str, simulate_error: bool = False):
+def run_processing(task_id: str, file_path: str, simulate_error: bool = False,
+                   index_name_short: str = None, deploy_lock=None):
     """
     メイン処理を実行
     
     Args:
         task_id: タスクID
-        file_path: 処理対象ファイルのパス（使用しない - input_dataディレクトリから読み込む）
+        file_path: 処理対象ファイルのパス（input_data/{task_id}/ 配下）
         simulate_error: エラーをシミュレートするかどうか（実装版では使用しない）
+        index_name_short: インデックス名（短縮形）。Noneの場合は環境変数から取得
+        deploy_lock: コミットとタグ作成を他のジョブと直列化するロック（with文で使用）
     """
     callback = ProcessorCallback(task_id)
     
+    input_dir = job_input_dir(task_id)
+    output_dir = job_output_dir(task_id)
+    
     try:
-        # ロックを設定
-        set_lock(True, task_id)
-        
         # 処理開始
-        update_upload_status(task_id, 'processing')
+        callback.update_status('processing')
         callback.log_info('処理開始', 'Excel to Index処理を開始します', 0)
         
-        # Excelファイルを input_data ディレクトリに移動（既にアップロードされている場合）
-        # file_path は input_data/{task_id}_{filename}.xlsx の形式
-        # そのままで処理できるので移動は不要
-        
         # メイン処理を実行
         try:
-            # index_name_shortを環境変数または設定から取得
-            index_name_short = os.getenv("INDEX_NAME_SHORT", "default_index")
+            # index_name_shortを引数または環境変数から取得
+            if not index_name_short:
+                index_name_short = os.getenv("INDEX_NAME_SHORT", "default_index")
             
+            output_dir.mkdir(parents=True, exist_ok=True)
             result = process_excel_to_index(
-                input_dir=INPUT_DIR,
-                output_dir=OUTPUT_DIR,
+                input_dir=input_dir,
+                output_dir=output_dir,
                 callback=callback,
                 index_name_short=index_name_short,
-                enable_git_deploy=True  # Git操作とデプロイを実行
+                enable_git_deploy=True,  # Git操作とデプロイを実行
+                index_list_path=output_dir / "インデックス化データ一覧.xlsx",
+                deploy_lock=deploy_lock
             )
             
             excel_output_path = result.get("excel_path")
@@ -149,34 +176,29 @@ def run_processing(task_id: str, file_path: str, simulate_error: bool = False):
                                 'すべての処理が正常に終了しました', 
                                 100)
             
-            update_upload_status(task_id, 'completed')
-            
-            # 古いインデックスファイルを削除（最新5件のみ保持）
-            try:
-                from app import cleanup_old_index_files
-                cleanup_old_index_files()
-            except Exception as cleanup_error:
-                print(f"[WARNING] 古いファイルのクリーンアップに失敗: {cleanup_error}")
+            # 完了ステータスより先にログを書き込む（SSEが最後のログを取りこぼさないように）
+            callback.flush()
+            callback.update_status('completed')
             
         except FileNotFoundError as e:
             # ファイルが見つからない
             error_msg = f"ファイルエラー: {str(e)}"
             callback.log_error('ファイル検証', error_msg, callback.current_progress)
-            update_upload_status(task_id, 'error', error_msg)
+            callback.update_status('error', error_msg)
             raise
             
         except ValueError as e:
             # バリデーションエラー
             error_msg = f"バリデーションエラー: {str(e)}"
             callback.log_error('バリデーションチェック', error_msg, callback.current_progress)
-            update_upload_status(task_id, 'error', error_msg)
+            callback.update_status('error', error_msg)
             raise
             
         except Exception as e:
             # その他のエラー
             error_msg = f"処理エラー: {str(e)}"
             callback.log_error('システムエラー', error_msg, callback.current_progress)
-            update_upload_status(task_id, 'error', error_msg)
+            callback.update_status('error', error_msg)
             raise
         
         # アップロードされたファイルを削除
@@ -192,7 +214,7 @@ def run_processing(task_id: str, file_path: str, simulate_error: bool = False):
         error_msg = f"予期しないエラーが発生しました: {str(e)}"
         try:
             callback.log_error('システムエラー', error_msg, callback.current_progress)
-            update_upload_status(task_id, 'error', error_msg)
+            callback.update_status('error', error_msg)
         except Exception as log_error:
             print(f"ログ記録エラー: {log_error}")
         
@@ -204,22 +226,50 @@ def run_processing(task_id: str, file_path: str, simulate_error: bool = False):
             print(f"ファイル削除エラー: {file_error}")
     
     finally:
-        # ロックを確実に解除（エラーが発生しても必ず実行）
+        # バッファ済みのログを書き込む
         try:
-            set_lock(False)
-            print(f"[INFO] ロックを解除しました (task_id: {task_id})")
-        except Exception as lock_error:
-            print(f"[ERROR] ロック解除に失敗しました: {lock_error}")
-            # 最後の手段：直接データベースを更新
+            callback.flush()
+        except Exception as flush_error:
+            print(f"[ERROR] ログの書き込みに失敗しました: {flush_error}")
+        
+        # タスクごとの入力・出力ディレクトリを削除
+        shutil.rmtree(input_dir, ignore_errors=True)
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def cleanup_old_index_files():
+    """
+    古いインデックス化データ一覧ファイルを削除
+    最新5件のみを保持し、それ以降は削除する
+    """
+    try:
+        # 6件目以降でファイルが残っているアップロード記録のみを取得（新しい順）
+        uploads = get_uploads_with_index_file_beyond(INDEX_FILE_KEEP_COUNT)
+        
+        for upload in uploads:
+            index_excel_path = upload['index_excel_path']
             try:
-                import sqlite3
-                DB_PATH = os.path.join(os.path.dirname(__file__), 'uploads.db')
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute('UPDATE lock_status SET is_locked = 0, current_task_id = NULL WHERE id = 1')
-                conn.commit()
-                conn.close()
-                print(f"[INFO] 直接データベース操作でロックを解除しました")
-            except Exception as db_error:
-                print(f"[CRITICAL] ロック解除が完全に失敗しました: {db_error}")
+                if os.path.exists(index_excel_path):
+                    os.remove(index_excel_path)
+                    print(f"[INFO] 古いインデックスファイルを削除: {index_excel_path}")
+                # 削除済みの行は次回以降の対象から外す
+                update_index_excel_path(upload['task_id'], None)
+            except Exception as e:
+                print(f"[ERROR] ファイル削除失敗: {e}")
+    except Exception as e:
+        print(f"[ERROR] cleanup_old_index_files: {e}")
 
+
+def run_job(job: Dict, deploy_lock=None, simulate_error: bool = False):
+    """
+    ジョブキューから取り出したジョブを処理
+    
+    Args:
+        job: jobsテーブルの行
+        deploy_lock: コミットとタグ作成を他のジョブと直列化するロック（with文で使用）
+        simulate_error: エラーをシミュレートするかどうか
+    """
+    run_processing(job['task_id'], job['file_path'], simulate_error, job['concurrency_key'], deploy_lock)
+    
+    # 古いインデックスファイルを削除（最新5件のみ保持）
+    cleanup_old_index_files()
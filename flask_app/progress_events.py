@@ -0,0 +1,149 @@
+"""
+進捗通知モジュール
+処理中のタスクがログ・進捗をDBへ書き込んだことをSSEへ通知する
+
+ジョブを同じプロセスのスレッドで実行する場合（JOB_RUNNER=thread）は、プロセス内の通知のみ使用する。
+ワーカープロセスで実行する場合は通知をDB（uploads.progress_version）に記録し、
+Webサーバーの各プロセスでは1つの監視スレッドが、SSEで表示中のタスクの更新番号をまとめて確認する
+（更新が無いタスクほど確認の間隔を延ばす）
+"""
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from database import bump_progress_versions, get_progress_versions
+
+# 監視スレッドがDBの更新番号を確認する間隔（秒）
+# 更新が無い間は最小値から2倍ずつ最大値まで延ばし、更新があれば最小値に戻す
+PROGRESS_POLL_MIN_INTERVAL_SEC = float(os.getenv("PROGRESS_POLL_MIN_INTERVAL_SEC", "0.5"))
+PROGRESS_POLL_MAX_INTERVAL_SEC = float(os.getenv("PROGRESS_POLL_MAX_INTERVAL_SEC", "5"))
+
+
+class ProgressNotifier:
+    """タスクごとの更新番号を持ち、更新されたら待機中のスレッドを起こす"""
+
+    def __init__(self, shared: bool = True,
+                 min_interval: float = PROGRESS_POLL_MIN_INTERVAL_SEC,
+                 max_interval: float = PROGRESS_POLL_MAX_INTERVAL_SEC):
+        # shared: 他のプロセス（ワーカー）との通知にDBを使うかどうか
+        self.shared = shared
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._cond = threading.Condition()
+        self._versions = Counter()
+        # 表示中のタスク（SSEの接続数）と、最後に確認したDBの更新番号
+        self._watchers = Counter()
+        self._db_versions = {}
+        # タスクごとの確認間隔と、次に確認する時刻（time.monotonic）
+        self._poll_intervals = {}
+        self._next_polls = {}
+        self._thread = None
+
+    def publish(self, *task_ids: str) -> None:
+        """タスクの更新を通知（共有時はDBに記録し、同じプロセスの待機中のスレッドはすぐに起こす）"""
+        if not task_ids:
+            return
+        if self.shared:
+            try:
+                bump_progress_versions(task_ids)
+            except Exception as e:
+                # 通知に失敗しても処理は続ける（SSEはタイムアウト後にDBを読み直す）
+                print(f"[ERROR] 進捗の通知に失敗しました: {e}")
+        self._bump(task_ids)
+
+    def notify(self, *task_ids: str) -> None:
+        """同じプロセスの待機中のスレッドのみ起こす（DBの更新番号は呼び出し元で書き込み済みの場合）"""
+        if task_ids:
+            self._bump(task_ids)
+
+    def _bump(self, task_ids) -> None:
+        with self._cond:
+            # 表示中のタスクのみ番号を進める（表示されていないタスクの番号は保持しない）
+            for task_id in task_ids:
+                if task_id in self._watchers:
+                    self._versions[task_id] += 1
+            self._cond.notify_all()
+
+    def version(self, task_id: str) -> int:
+        """タスクの現在の更新番号"""
+        with self._cond:
+            return self._versions[task_id]
+
+    @contextmanager
+    def watch(self, task_id: str):
+        """with文の間、タスクの更新を監視する（共有時は他のプロセスによる更新もDBで確認する）"""
+        db_version = get_progress_versions([task_id]).get(task_id, 0) if self.shared else 0
+        with self._cond:
+            if self._watchers[task_id] == 0:
+                self._db_versions[task_id] = db_version
+                self._poll_intervals[task_id] = self._min_interval
+                self._next_polls[task_id] = time.monotonic() + self._min_interval
+            self._watchers[task_id] += 1
+            if self.shared and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._poll, name="progress-watcher", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._watchers[task_id] -= 1
+                if self._watchers[task_id] <= 0:
+                    del self._watchers[task_id]
+                    self._db_versions.pop(task_id, None)
+                    self._versions.pop(task_id, None)
+                    self._poll_intervals.pop(task_id, None)
+                    self._next_polls.pop(task_id, None)
+
+    def wait(self, task_id: str, last_version: int, timeout: Optional[float]) -> int:
+        """
+        更新番号が last_version から変わるまで待機
+
+        Returns:
+            int: 待機後の更新番号（タイムアウト時は last_version のまま）
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._versions[task_id] != last_version, timeout)
+            return self._versions[task_id]
+
+    def _poll(self) -> None:
+        """確認時刻になった表示中のタスクのDBの更新番号を確認し、変わったタスクを通知する"""
+        while True:
+            with self._cond:
+                # 表示中のタスクが無い間はDBにアクセスしない
+                self._cond.wait_for(lambda: self._watchers)
+                now = time.monotonic()
+                task_ids = [task_id for task_id, at in self._next_polls.items() if at <= now]
+                if not task_ids:
+                    # 次の確認時刻まで待機（新しい表示の登録時は起こされて再計算する）
+                    self._cond.wait(min(self._next_polls.values()) - now)
+                    continue
+            try:
+                versions = get_progress_versions(task_ids)
+            except Exception as e:
+                print(f"[ERROR] 進捗の確認に失敗しました: {e}")
+                versions = {}
+            with self._cond:
+                changed = [task_id for task_id, version in versions.items()
+                           if task_id in self._db_versions and self._db_versions[task_id] != version]
+                for task_id in changed:
+                    self._db_versions[task_id] = versions[task_id]
+                now = time.monotonic()
+                for task_id in task_ids:
+                    if task_id not in self._poll_intervals:
+                        continue
+                    if task_id in changed:
+                        interval = self._min_interval
+                    else:
+                        interval = min(self._poll_intervals[task_id] * 2, self._max_interval)
+                    self._poll_intervals[task_id] = interval
+                    self._next_polls[task_id] = now + interval
+            if changed:
+                self._bump(changed)
+
+
+# プロセス内で共有する通知
+progress_notifier = ProgressNotifier()
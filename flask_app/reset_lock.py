@@ -1,125 +1,92 @@
 #!/usr/bin/env python
 """
-ロック状態を手動でリセットするユーティリティスクリプト
+リース（ジョブのロック）を確認・解除するユーティリティスクリプト
+
+通常は手動での解除は不要（ハートビートが途絶えたリースは期限切れ後にワーカーが自動で解除する）。
+期限切れを待たずに解除したい場合に使用する
 
 使い方:
-    python reset_lock.py
+    python reset_lock.py                  # 期限切れのリースを解除し、停止したジョブをエラーにする
+    python reset_lock.py status           # リースと実行中・待機中のジョブを表示
+    python reset_lock.py release <task_id>  # 指定したタスクのリースを強制的に解除する
 """
-import sqlite3
 import os
+import sys
+import time
 from datetime import datetime
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'uploads.db')
+from database import DB_PATH, get_leases, get_active_jobs, expire_task_leases, expire_stale_jobs
+
+RELEASE_ERROR_MESSAGE = 'リースが手動で解除されたため、処理を中断しました。再度アップロードしてください。'
+
+
+def format_time(value):
+    """UNIX時刻を表示用の文字列に変換"""
+    return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S') if value else 'なし'
 
-def reset_lock():
-    """ロック状態を強制的にリセット"""
-    try:
-        if not os.path.exists(DB_PATH):
-            print(f"エラー: データベースファイルが見つかりません: {DB_PATH}")
-            return False
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # 現在のロック状態を確認
-        cursor.execute('SELECT * FROM lock_status WHERE id = 1')
-        result = cursor.fetchone()
-        
-        if result:
-            is_locked = result[1]
-            current_task_id = result[2]
-            locked_at = result[3]
-            
-            print("=" * 60)
-            print("現在のロック状態:")
-            print(f"  ロック状態: {'ロック中' if is_locked else '解除'}")
-            print(f"  タスクID: {current_task_id if current_task_id else 'なし'}")
-            print(f"  ロック時刻: {locked_at if locked_at else 'なし'}")
-            print("=" * 60)
-            
-            if is_locked:
-                # ロックを解除
-                cursor.execute('''
-                    UPDATE lock_status 
-                    SET is_locked = 0, current_task_id = NULL, locked_at = NULL
-                    WHERE id = 1
-                ''')
-                conn.commit()
-                print("\n✓ ロックを解除しました")
-                print(f"  時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                # 解除後の状態を確認
-                cursor.execute('SELECT * FROM lock_status WHERE id = 1')
-                new_result = cursor.fetchone()
-                print("\n新しいロック状態:")
-                print(f"  ロック状態: {'ロック中' if new_result[1] else '解除'}")
-                print("=" * 60)
-            else:
-                print("\n✓ ロックは既に解除されています")
-                print("=" * 60)
-        else:
-            print("エラー: lock_statusテーブルが初期化されていません")
-            return False
-        
-        conn.close()
-        return True
-        
-    except sqlite3.Error as e:
-        print(f"\nデータベースエラー: {e}")
-        return False
-    except Exception as e:
-        print(f"\n予期しないエラー: {e}")
-        return False
 
 def show_status():
-    """現在のロック状態のみを表示"""
-    try:
-        if not os.path.exists(DB_PATH):
-            print(f"エラー: データベースファイルが見つかりません: {DB_PATH}")
-            return
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM lock_status WHERE id = 1')
-        result = cursor.fetchone()
-        
-        if result:
-            is_locked = result[1]
-            current_task_id = result[2]
-            locked_at = result[3]
-            
-            print("=" * 60)
-            print("現在のロック状態:")
-            print(f"  ロック状態: {'ロック中' if is_locked else '解除'}")
-            print(f"  タスクID: {current_task_id if current_task_id else 'なし'}")
-            print(f"  ロック時刻: {locked_at if locked_at else 'なし'}")
-            print("=" * 60)
-        else:
-            print("エラー: lock_statusテーブルが初期化されていません")
-        
-        conn.close()
-        
-    except Exception as e:
-        print(f"エラー: {e}")
+    """リースとジョブの状態を表示"""
+    now = time.time()
+
+    print("=" * 60)
+    print("リース:")
+    leases = get_leases()
+    if not leases:
+        print("  なし")
+    for lease in leases:
+        state = '有効' if lease['expires_at'] >= now else '期限切れ'
+        print(f"  {lease['name']} [{state}]")
+        print(f"    保持者: {lease['owner']}")
+        print(f"    タスクID: {lease['task_id'] or 'なし'}")
+        print(f"    最終ハートビート: {format_time(lease['heartbeat_at'])}")
+        print(f"    有効期限: {format_time(lease['expires_at'])}")
+
+    print("ジョブ:")
+    jobs = get_active_jobs()
+    if not jobs:
+        print("  なし")
+    for job in jobs:
+        print(f"  {job['task_id']} [{job['status']}] インデックス: {job['concurrency_key']}"
+              f" 保持者: {job.get('owner') or 'なし'}")
+    print("=" * 60)
+
+
+def reset_lock(task_id=None):
+    """期限切れ（または指定したタスク）のリースを解除し、停止したジョブをエラーにする"""
+    if task_id:
+        expire_task_leases(task_id)
+        message = RELEASE_ERROR_MESSAGE
+    else:
+        message = 'リースが期限切れになったため、処理を中断しました。再度アップロードしてください。'
+
+    task_ids = expire_stale_jobs(message)
+    if task_ids:
+        for released in task_ids:
+            print(f"✓ ジョブをエラーにしてリースを解除しました: {released}")
+    else:
+        print("✓ 解除が必要なジョブはありません")
+    return True
+
 
 if __name__ == '__main__':
-    import sys
-    
     print("\n" + "=" * 60)
-    print("Flask Uploader - ロック状態管理ツール")
+    print("Flask Uploader - リース状態管理ツール")
     print("=" * 60 + "\n")
-    
-    if len(sys.argv) > 1 and sys.argv[1] == 'status':
-        # ステータス表示のみ
-        show_status()
-    else:
-        # ロックリセット
-        success = reset_lock()
-        
-        if success:
-            print("\n処理が完了しました")
-        else:
-            print("\n処理が失敗しました")
-            sys.exit(1)
 
+    if not os.path.exists(DB_PATH):
+        print(f"エラー: データベースファイルが見つかりません: {DB_PATH}")
+        sys.exit(1)
+
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == 'status':
+            show_status()
+        elif len(sys.argv) > 2 and sys.argv[1] == 'release':
+            reset_lock(sys.argv[2])
+            show_status()
+        else:
+            reset_lock()
+            show_status()
+    except Exception as e:
+        print(f"\nエラー: {e}")
+        sys.exit(1)
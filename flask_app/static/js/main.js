@@ -86,7 +86,12 @@ async function handleFormSubmit(event) {
         
         const data = await response.json();
         
-        if (data.success) {
+        if (data.success && data.duplicate) {
+            // 前回と同一のファイル - 前回のタスクのログ（処理中の場合は処理状況）に遷移
+            alert(data.message);
+            currentTaskId = data.task_id;
+            window.location.href = data.no_changes ? `/logs/${data.task_id}` : `/processing/${data.task_id}`;
+        } else if (data.success) {
             // アップロード成功 - processing ページに遷移
             currentTaskId = data.task_id;
             window.location.href = `/processing/${data.task_id}`;
@@ -333,32 +338,27 @@ async function checkLockStatus() {
         const lockMessage = document.getElementById('lockMessage');
         const uploadForm = document.getElementById('uploadForm');
         const uploadBtn = document.getElementById('uploadBtn');
+        const queueSummary = document.getElementById('queueSummary');
         
-        if (data.is_locked) {
-            // ロック中
+        // 処理中でもアップロードはキューに追加できるため、フォームは無効化しない
+        if (data.is_locked || data.queued_count > 0) {
             if (lockMessage) {
                 lockMessage.style.display = 'block';
             }
-            if (uploadForm && data.current_task_id !== currentTaskId) {
-                // 他のタスクが実行中の場合のみフォームを無効化
-                uploadForm.style.opacity = '0.5';
-                uploadForm.style.pointerEvents = 'none';
-            }
-            if (uploadBtn) {
-                uploadBtn.disabled = true;
+            if (queueSummary) {
+                queueSummary.textContent = `実行中: ${data.running_count}件 / 待機中: ${data.queued_count}件`;
             }
         } else {
-            // ロック解除
             if (lockMessage) {
                 lockMessage.style.display = 'none';
             }
-            if (uploadForm) {
-                uploadForm.style.opacity = '1';
-                uploadForm.style.pointerEvents = 'auto';
-            }
-            if (uploadBtn && !currentTaskId) {
-                uploadBtn.disabled = false;
-            }
+        }
+        if (uploadForm) {
+            uploadForm.style.opacity = '1';
+            uploadForm.style.pointerEvents = 'auto';
+        }
+        if (uploadBtn && !currentTaskId) {
+            uploadBtn.disabled = false;
         }
     } catch (error) {
         console.error('ロック状態チェックエラー:', error);
@@ -145,8 +145,24 @@ function addLogEntry(container, data) {
  * ステップ進捗を更新
  */
 function updateStepProgress(data) {
-    // 現在のステップ名
+    // 待機中は順番と推定待ち時間を表示
+    const statusBadge = document.getElementById('statusBadge');
     const stepNameElement = document.getElementById('currentStepName');
+    if (data.queue) {
+        if (statusBadge) {
+            statusBadge.textContent = '待機中';
+        }
+        if (stepNameElement) {
+            stepNameElement.textContent = `処理待ち（${data.queue.position}番目、先行ジョブ ${data.queue.jobs_ahead}件）`;
+        }
+        updateEstimatedTime(data.queue.estimated_wait_sec || 0);
+        return;
+    }
+    if (statusBadge && statusBadge.textContent === '待機中') {
+        statusBadge.textContent = '処理中';
+    }
+    
+    // 現在のステップ名
     if (stepNameElement && data.current_step) {
         stepNameElement.textContent = data.current_step;
     }
@@ -160,13 +176,13 @@ function updateStepProgress(data) {
     // 総ステップ数
     const totalStepsElement = document.getElementById('totalSteps');
     if (totalStepsElement) {
-        totalStepsElement.textContent = data.total_steps || 10;
+        totalStepsElement.textContent = data.total_steps || 11;
     }
     
     // 残りステップ数
     const remainingStepsElement = document.getElementById('remainingSteps');
     if (remainingStepsElement) {
-        const remaining = (data.total_steps || 10) - (data.current_step_index || 0);
+        const remaining = (data.total_steps || 11) - (data.current_step_index || 0);
         remainingStepsElement.textContent = remaining;
     }
     
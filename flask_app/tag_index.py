@@ -0,0 +1,42 @@
+"""
+タグインデックスモジュール
+GitLabのタグ一覧から、次のタグ採番に使うNNNの最大値と最新タグを取得する
+（excel_to_index_processor.py / deploy_automation.py で共用するため、他モジュールに依存しない）
+"""
+import re
+from typing import Callable, Iterable, NamedTuple
+
+# タグ形式: NNN-YYYYMMDD（例: 008-20250904）
+TAG_PATTERN = re.compile(r"^(\d{3})-(\d{8})$")
+INITIAL_TAG = "initial-tag"
+
+
+class TagSummary(NamedTuple):
+    """タグ一覧の集計結果"""
+    max_seq: int
+    latest_tag: str
+
+
+def first_matching_tag(names: Iterable[str]) -> str:
+    """並び順で最初に NNN-YYYYMMDD 形式に一致するタグ名を返す（無ければ空文字）"""
+    for name in names:
+        if name != INITIAL_TAG and TAG_PATTERN.match(name):
+            return name
+    return ""
+
+
+def fetch_tag_summary(iter_tags: Callable[[str], Iterable[str]]) -> TagSummary:
+    """
+    タグのNNN最大値と最新タグを取得
+
+    NNNは3桁ゼロ埋めのため、名前の降順で最初に一致したタグがNNN最大となる。
+    名前順・更新日時順それぞれの先頭数件を見るだけで済み、タグの総数に依存しない。
+    タグの採番に使うため、呼び出しのたびにAPIから取得する（キャッシュしない）
+
+    Args:
+        iter_tags: order_by（"name" / "updated"）を受け取り、降順のタグ名を遅延取得する関数
+    """
+    max_tag = first_matching_tag(iter_tags("name"))
+    latest_tag = first_matching_tag(iter_tags("updated"))
+    max_seq = int(TAG_PATTERN.match(max_tag).group(1)) if max_tag else 0
+    return TagSummary(max_seq, latest_tag)
@@ -0,0 +1,28 @@
+"""
+flask_app のテスト共通設定
+flask_app 直下のモジュール（と、リポジトリ直下のスクリプト）をインポートできるようにし、
+DBはテストごとの一時ファイルを使う
+"""
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# 同名のモジュールは flask_app 直下を優先する
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """一時ファイルのDBで初期化したdatabaseモジュール"""
+    import database
+
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(database, "_local", threading.local())
+    database.init_db()
+    yield database
+    conn = getattr(database._local, "conn", None)
+    if conn is not None:
+        conn.close()
@@ -0,0 +1,118 @@
+"""ai_search_bunseki の色付きセル抽出（xlsxのXMLを直接読む実装）を openpyxl での抽出結果と比較するテスト"""
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Color, PatternFill
+
+import ai_search_bunseki
+
+RED = PatternFill(fill_type="solid", fgColor="FFFF0000")
+WHITE = PatternFill(fill_type="solid", fgColor="FFFFFFFF")
+THEME = PatternFill(fill_type="solid", fgColor=Color(theme=4))
+
+# ふりがな（<rPh>）・書式付きの文字列（<r>）に置き換える文字列
+RICH_TEXTS = {
+    "<t>文書A</t>": '<t>文書A</t><rPh sb="0" eb="2"><t>ブンショ</t></rPh><phoneticPr fontId="1"/>',
+    "<t>q1</t>": '<r><t>q</t></r><r><rPr><b/></rPr><t>1</t></r><rPh sb="0" eb="1"><t>キュー</t></rPh>',
+}
+INLINE_CELL = re.compile(r'<c ([^>]*?)t="inlineStr"><is>(.*?)</is></c>')
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+SST_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"
+SST_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+
+
+def extract_with_openpyxl(filename):
+    """以前の openpyxl による実装"""
+    wb = load_workbook(filename)
+    sheet = wb.active
+
+    headers = [cell.value for cell in sheet[1]]
+    results = []
+
+    for row in sheet.iter_rows(min_row=2):
+        query_id = row[0].value
+        used_docs = []
+        for cell, header in zip(row[1:], headers[1:]):
+            if cell.fill and cell.fill.fill_type == "solid":
+                fg = cell.fill.fgColor.rgb
+                if fg and fg not in ["FFFFFFFF", "00000000"]:
+                    used_docs.append(header)
+        results.append({"query_id": query_id, "used_docs": used_docs})
+    return pd.DataFrame(results)
+
+
+def _to_shared_strings(parts):
+    """インライン文字列のセルを共有文字列（sharedStrings.xml）の参照に置き換える"""
+    strings = []
+
+    def to_sst(match):
+        strings.append(f"<si>{match.group(2)}</si>")
+        return f'<c {match.group(1)}t="s"><v>{len(strings) - 1}</v></c>'
+
+    sheet = "xl/worksheets/sheet1.xml"
+    parts[sheet] = INLINE_CELL.sub(to_sst, parts[sheet])
+    parts["xl/sharedStrings.xml"] = (f'<sst xmlns="{NS_MAIN}" count="{len(strings)}" '
+                                     f'uniqueCount="{len(strings)}">{"".join(strings)}</sst>')
+    parts["[Content_Types].xml"] = parts["[Content_Types].xml"].replace(
+        "</Types>", f'<Override PartName="/xl/sharedStrings.xml" ContentType="{SST_CONTENT_TYPE}"/></Types>')
+    parts["xl/_rels/workbook.xml.rels"] = parts["xl/_rels/workbook.xml.rels"].replace(
+        "</Relationships>",
+        f'<Relationship Type="{SST_TYPE}" Target="sharedStrings.xml" Id="rIdSst"/></Relationships>')
+
+
+@pytest.fixture(params=["inline", "shared"])
+def colored_xlsx(request, tmp_path):
+    """色付きセルと、ふりがな・書式付きの文字列を含むワークブック（インライン文字列 / 共有文字列）"""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["query_id", "文書A", "文書B", "文書C"])
+    ws.append(["q1", None, None, None])
+    ws.append([2, None, None, None])
+    ws.append(["q3", None, None, None])
+    ws["B2"].fill = RED
+    ws["C2"].fill = WHITE
+    ws["D2"].fill = THEME
+    ws["C3"].fill = RED
+    plain = tmp_path / "plain.xlsx"
+    wb.save(plain)
+
+    with zipfile.ZipFile(plain) as src:
+        parts = {name: src.read(name).decode("utf-8") for name in src.namelist()}
+    sheet = "xl/worksheets/sheet1.xml"
+    for old, new in RICH_TEXTS.items():
+        assert f"<is>{old}</is>" in parts[sheet]
+        parts[sheet] = parts[sheet].replace(f"<is>{old}</is>", f"<is>{new}</is>")
+    if request.param == "shared":
+        _to_shared_strings(parts)
+
+    path = tmp_path / "colored.xlsx"
+    with zipfile.ZipFile(path, "w") as dst:
+        for name, data in parts.items():
+            dst.writestr(name, data)
+    return path
+
+
+def test_matches_openpyxl_implementation(colored_xlsx):
+    expected = extract_with_openpyxl(colored_xlsx)
+    actual = ai_search_bunseki.extract_used_docs_from_colored_cells(colored_xlsx)
+
+    assert actual.to_dict("records") == expected.to_dict("records")
+    assert actual.to_dict("records") == [
+        {"query_id": "q1", "used_docs": ["文書A", "文書C"]},
+        {"query_id": 2, "used_docs": ["文書B"]},
+        {"query_id": "q3", "used_docs": []},
+    ]
+
+
+def test_inline_string_skips_phonetic_text():
+    ns = ai_search_bunseki._NS_MAIN[1:-1]
+    cell = ET.fromstring(
+        f'<c xmlns="{ns}" r="A2" t="inlineStr"><is><r><t>検索</t></r><r><t>結果</t></r>'
+        f'<rPh sb="0" eb="2"><t>ケンサク</t></rPh></is></c>'
+    )
+
+    assert ai_search_bunseki._raw_cell_value(cell) == ("str", "検索結果")
@@ -0,0 +1,48 @@
+"""iter_commit_batches のバッチ分割（リクエストサイズ・アクション数の上限）のテスト"""
+from excel_to_index_processor import iter_commit_batches
+
+
+def _actions(*kinds, size=10):
+    return [(kind, bytes([ord("a") + i]) * size) for i, kind in enumerate(kinds)]
+
+
+def test_batch_fills_up_to_max_bytes_including_separators():
+    # 10バイト × 3件 + 区切りのカンマ2つ = 32バイト
+    actions = _actions("create", "create", "update", "delete", "create")
+
+    batches = list(iter_commit_batches(actions, max_bytes=32, max_actions=100))
+
+    assert [len(batch) for batch, *_ in batches] == [3, 2]
+    assert all(len(b",".join(batch)) <= 32 for batch, *_ in batches)
+    assert [tuple(counts) for _, *counts in batches] == [(2, 1, 0), (1, 0, 1)]
+
+
+def test_batch_is_split_one_byte_below_boundary():
+    actions = _actions("create", "create", "create")
+
+    batches = list(iter_commit_batches(actions, max_bytes=31, max_actions=100))
+
+    assert [len(batch) for batch, *_ in batches] == [2, 1]
+    assert [b",".join(batch) for batch, *_ in batches] == [b"a" * 10 + b"," + b"b" * 10, b"c" * 10]
+
+
+def test_batch_is_split_at_max_actions():
+    actions = _actions("create", "update", "update", "delete", "delete")
+
+    batches = list(iter_commit_batches(actions, max_bytes=10_000, max_actions=2))
+
+    assert [len(batch) for batch, *_ in batches] == [2, 2, 1]
+    assert [tuple(counts) for _, *counts in batches] == [(1, 1, 0), (0, 1, 1), (0, 0, 1)]
+
+
+def test_oversized_action_is_sent_alone():
+    actions = [("create", b"x" * 5), ("update", b"y" * 50), ("delete", b"z" * 5)]
+
+    batches = list(iter_commit_batches(actions, max_bytes=20, max_actions=100))
+
+    assert [batch for batch, *_ in batches] == [[b"x" * 5], [b"y" * 50], [b"z" * 5]]
+    assert [tuple(counts) for _, *counts in batches] == [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
+
+
+def test_no_actions_yields_no_batches():
+    assert list(iter_commit_batches([], max_bytes=10, max_actions=1)) == []
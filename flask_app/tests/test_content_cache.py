@@ -0,0 +1,48 @@
+"""ContentCache / CheckpointStore のEmbedding保存形式のテスト"""
+import sqlite3
+from array import array
+
+from checkpoint_store import CheckpointStore
+from content_cache import ContentCache
+from excel_to_index_processor import serialize_record
+
+VECTOR = [0.1234567890123456, 1 / 3, -2.5e-7]
+
+
+def test_cache_hit_serializes_like_miss(tmp_path):
+    cache = ContentCache(tmp_path / "cache.db")
+    try:
+        cache.put_embeddings("model", {"h": VECTOR})
+        cached = cache.get_embeddings("model", ["h"])["h"]
+    finally:
+        cache.close()
+
+    assert cached == VECTOR
+    assert serialize_record({"content_embedding": cached}) == serialize_record({"content_embedding": VECTOR})
+
+
+def test_old_float32_cache_is_discarded(tmp_path):
+    db_path = tmp_path / "cache.db"
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("CREATE TABLE embeddings (model TEXT, content_hash TEXT, vector BLOB, "
+                 "PRIMARY KEY (model, content_hash))")
+    conn.execute("INSERT INTO embeddings VALUES ('model', 'h', ?)", (array("f", VECTOR).tobytes(),))
+    conn.commit()
+    conn.close()
+
+    cache = ContentCache(db_path)
+    try:
+        assert cache.get_embeddings("model", ["h"]) == {}
+    finally:
+        cache.close()
+
+
+def test_checkpoint_restores_exact_vector(tmp_path):
+    checkpoint = CheckpointStore(tmp_path / "checkpoints.db")
+    try:
+        checkpoint.get_or_create_run("run", ["id-1"])
+        checkpoint.save_records("run", [(0, VECTOR, ["kw"]), (2, [0.5], [])])
+        assert checkpoint.load_records("run") == {0: (VECTOR, ["kw"]), 2: ([0.5], [])}
+        assert checkpoint.load_records("other") == {}
+    finally:
+        checkpoint.close()
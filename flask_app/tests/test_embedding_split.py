@@ -0,0 +1,83 @@
+"""embed_batch_with_split のバッチ分割のテスト"""
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from tenacity import wait_none
+
+import excel_to_index_processor as processor
+
+
+def _status_error(error_class, status_code: int, message: str = "error"):
+    request = httpx.Request("POST", "https://example.invalid/embeddings")
+    return error_class(message, response=httpx.Response(status_code, request=request), body=None)
+
+
+class FakeEmbeddings:
+    """max_inputs 件を超える入力、または fail_texts を含む入力で error を返すEmbeddings API"""
+
+    def __init__(self, max_inputs=None, fail_texts=(), error=None):
+        self.max_inputs = max_inputs
+        self.fail_texts = set(fail_texts)
+        self.error = error
+        self.calls = []
+
+    def create(self, input, model=None):
+        self.calls.append(list(input))
+        if self.error is not None and (
+            (self.max_inputs is not None and len(input) > self.max_inputs)
+            or self.fail_texts.intersection(input)
+        ):
+            raise self.error
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+@pytest.fixture(autouse=True)
+def no_retry_wait(monkeypatch):
+    monkeypatch.setattr(processor.get_embeddings_with_retry.retry, "wait", wait_none())
+
+
+def _client(embeddings):
+    return SimpleNamespace(embeddings=embeddings)
+
+
+def test_returns_vectors_in_input_order():
+    embeddings = FakeEmbeddings()
+    vectors = processor.embed_batch_with_split(_client(embeddings), ["a", "bb", "ccc"])
+    assert vectors == [[1.0], [2.0], [3.0]]
+    assert embeddings.calls == [["a", "bb", "ccc"]]
+
+
+def test_splits_batch_on_bad_request():
+    error = _status_error(openai.BadRequestError, 400, "maximum context length exceeded")
+    embeddings = FakeEmbeddings(max_inputs=1, error=error)
+    vectors = processor.embed_batch_with_split(_client(embeddings), ["a", "bb", "ccc", "dddd"])
+    assert vectors == [[1.0], [2.0], [3.0], [4.0]]
+    # 入力エラーはリトライせずに分割する
+    assert embeddings.calls[0] == ["a", "bb", "ccc", "dddd"]
+    assert embeddings.calls.count(["a", "bb", "ccc", "dddd"]) == 1
+
+
+def test_single_input_error_is_raised():
+    error = _status_error(openai.BadRequestError, 400)
+    embeddings = FakeEmbeddings(fail_texts=["bad"], error=error)
+    with pytest.raises(openai.BadRequestError):
+        processor.embed_batch_with_split(_client(embeddings), ["ok", "bad"])
+    assert embeddings.calls == [["ok", "bad"], ["ok"], ["bad"]]
+
+
+@pytest.mark.parametrize("error", [
+    _status_error(openai.AuthenticationError, 401),
+    _status_error(openai.RateLimitError, 429),
+    openai.APITimeoutError(request=httpx.Request("POST", "https://example.invalid/embeddings")),
+    openai.APIConnectionError(request=httpx.Request("POST", "https://example.invalid/embeddings")),
+])
+def test_other_errors_are_raised_without_split(error):
+    embeddings = FakeEmbeddings(max_inputs=0, error=error)
+    with pytest.raises(type(error)):
+        processor.embed_batch_with_split(_client(embeddings), ["a", "bb", "ccc", "dddd"])
+    # リトライは行うが、分割したバッチは送らない
+    assert all(call == ["a", "bb", "ccc", "dddd"] for call in embeddings.calls)
+    assert len(embeddings.calls) == 3
@@ -0,0 +1,98 @@
+"""commit_files_local のテスト（一時ディレクトリのベアリポジトリへpush）"""
+import json
+import subprocess
+
+import pytest
+
+pytest.importorskip("git")
+
+from git_local_push import commit_files_local  # noqa: E402
+
+BRANCH = "main"
+PREFIX = "index/data"
+
+
+def _git(*args, cwd=None) -> str:
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    for var in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(var, "tester")
+    for var in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(var, "tester@example.com")
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """old.json と keep.json をコミット済みのベアリポジトリ"""
+    bare = tmp_path / "remote.git"
+    _git("init", "--bare", "-b", BRANCH, str(bare))
+
+    seed = tmp_path / "seed"
+    _git("clone", str(bare), str(seed))
+    _git("checkout", "-b", BRANCH, cwd=seed)
+    (seed / PREFIX).mkdir(parents=True)
+    (seed / PREFIX / "old.json").write_text('{"rag_id": "old"}')
+    (seed / PREFIX / "keep.json").write_text('{"rag_id": "keep"}')
+    _git("add", "-A", cwd=seed)
+    _git("commit", "-m", "initial", cwd=seed)
+    _git("push", "origin", BRANCH, cwd=seed)
+    return bare
+
+
+def _write_json(path, record):
+    path.write_text(json.dumps(record))
+    return path
+
+
+def test_commits_additions_and_deletions_in_one_push(tmp_path, remote):
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    files = [
+        _write_json(output_dir / "new-1.json", {"rag_id": "new-1"}),
+        _write_json(output_dir / "keep.json", {"rag_id": "keep", "updated": True}),
+    ]
+
+    count, sha, shas = commit_files_local(
+        str(remote), tmp_path / "work", files, ["old"], PREFIX, BRANCH, "update index"
+    )
+
+    assert count == 1
+    assert shas == [sha]
+    # リモートのブランチがpushしたコミットを指している
+    assert _git("rev-parse", BRANCH, cwd=remote).strip() == sha
+    assert _git("log", "-1", "--format=%s", BRANCH, cwd=remote).strip() == "update index"
+    assert _git("rev-list", "--count", BRANCH, cwd=remote).strip() == "2"
+
+    tree = _git("ls-tree", "-r", "--name-only", BRANCH, cwd=remote).split()
+    assert sorted(tree) == [f"{PREFIX}/keep.json", f"{PREFIX}/new-1.json"]
+    assert json.loads(_git("show", f"{BRANCH}:{PREFIX}/keep.json", cwd=remote)) == {
+        "rag_id": "keep", "updated": True
+    }
+    assert json.loads(_git("show", f"{BRANCH}:{PREFIX}/new-1.json", cwd=remote)) == {"rag_id": "new-1"}
+
+
+def test_reuses_clone_and_skips_commit_without_changes(tmp_path, remote):
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    workdir = tmp_path / "work"
+    files = [_write_json(output_dir / "new-1.json", {"rag_id": "new-1"})]
+
+    _, first_sha, _ = commit_files_local(str(remote), workdir, files, [], PREFIX, BRANCH, "add")
+    # 作業用クローンに残ったローカルの変更は次回の実行で破棄される
+    (workdir / PREFIX / "stray.json").write_text("{}")
+
+    assert commit_files_local(str(remote), workdir, files, [], PREFIX, BRANCH, "again") == (0, "", [])
+    assert not (workdir / PREFIX / "stray.json").exists()
+    assert _git("rev-parse", BRANCH, cwd=remote).strip() == first_sha
+
+
+def test_nothing_to_commit_does_not_touch_remote(tmp_path, remote):
+    before = _git("rev-parse", BRANCH, cwd=remote).strip()
+    assert commit_files_local(str(remote), tmp_path / "work", [], [], PREFIX, BRANCH, "noop") == (0, "", [])
+    assert not (tmp_path / "work").exists()
+    assert _git("rev-parse", BRANCH, cwd=remote).strip() == before
@@ -0,0 +1,102 @@
+"""前回デプロイ分との差分判定（diff_against_manifest）とマニフェストのテスト"""
+import pytest
+
+import excel_to_index_processor as processor
+from excel_to_index_processor import (
+    DIFF_CONTENT, DIFF_METADATA, DIFF_NEW, DIFF_UNCHANGED, diff_against_manifest
+)
+from index_manifest import IndexManifest
+
+
+def test_classifies_rows_against_manifest():
+    manifest_records = {
+        "id-same": ("k1", "c1", "m1"),
+        "id-meta": ("k2", "c2", "m2"),
+        "id-content": ("k3", "c3", "m3"),
+        "id-gone": ("k4", "c4", "m4"),
+    }
+    hashes = [
+        ("k1", "c1", "m1"),      # 変更なし
+        ("k2", "c2", "m2-new"),  # メタデータのみの更新
+        ("k3", "c3-new", "m3"),  # content更新（削除対象のrag_idを引き継ぐ）
+        ("k5", "c5", "m5"),      # 新規
+    ]
+    rag_ids, kinds, deletes = diff_against_manifest(
+        hashes, ["id-content", "id-gone"], manifest_records
+    )
+    assert rag_ids == ["id-same", "id-meta", "id-content", None]
+    assert kinds == [DIFF_UNCHANGED, DIFF_METADATA, DIFF_CONTENT, DIFF_NEW]
+    assert deletes == ["id-gone"]
+
+
+def test_content_change_without_delete_is_new():
+    # 削除対象でないレコードのcontentは上書きしない
+    rag_ids, kinds, deletes = diff_against_manifest(
+        [("k1", "c1-new", "m1")], [], {"id-1": ("k1", "c1", "m1")}
+    )
+    assert rag_ids == [None]
+    assert kinds == [DIFF_NEW]
+    assert deletes == []
+
+
+def test_same_record_is_matched_only_once():
+    rag_ids, kinds, _ = diff_against_manifest(
+        [("k1", "c1", "m1"), ("k1", "c1", "m1")], [], {"id-1": ("k1", "c1", "m1")}
+    )
+    assert rag_ids == ["id-1", None]
+    assert kinds == [DIFF_UNCHANGED, DIFF_NEW]
+
+
+def test_deleted_row_matching_unchanged_record_is_kept():
+    # rag_id指定で削除して同じ内容を登録し直す場合は、削除せずにrag_idを引き継ぐ
+    rag_ids, kinds, deletes = diff_against_manifest(
+        [("k1", "c1", "m1")], ["id-1"], {"id-1": ("k1", "c1", "m1")}
+    )
+    assert rag_ids == ["id-1"]
+    assert kinds == [DIFF_UNCHANGED]
+    assert deletes == []
+
+
+def test_empty_manifest_treats_all_rows_as_new():
+    rag_ids, kinds, deletes = diff_against_manifest(
+        [("k1", "c1", "m1"), ("k2", "c2", "m2")], ["id-x"], {}
+    )
+    assert rag_ids == [None, None]
+    assert kinds == [DIFF_NEW, DIFF_NEW]
+    assert deletes == ["id-x"]
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = IndexManifest(tmp_path / "manifest.db")
+    yield manifest
+    manifest.close()
+
+
+def test_apply_keeps_only_vectors_of_deployed_content(manifest):
+    manifest.put_vectors("idx", [
+        ("id-1", "c1", [0.1, 1 / 3], ["a"]),
+        ("id-2", "c2", [0.2], ["b"]),
+    ])
+    manifest.apply("idx", [("id-1", "k1", "c1", "m1"), ("id-2", "k2", "c2-new", "m2")], [])
+
+    assert manifest.get_records("idx") == {"id-1": ("k1", "c1", "m1"), "id-2": ("k2", "c2-new", "m2")}
+    # float64で保存するため、値は変わらない
+    assert manifest.get_vectors("idx", [("id-1", "c1"), ("id-2", "c2")]) == {"id-1": ([0.1, 1 / 3], ["a"])}
+
+    manifest.apply("idx", [], ["id-1"])
+    assert manifest.get_vector_ids("idx", [("id-1", "c1")]) == set()
+
+
+def test_write_carried_records_uses_manifest_vectors(manifest, tmp_path):
+    manifest.put_vectors("idx", [("id-1", "c1", [0.5, 0.25], ["kw"])])
+    record = {"rag_id": "id-1", "content": "text", "content_embedding": [], "content_keywords": []}
+
+    written = processor.write_carried_records(
+        [record], 1, {"id-1": "c1"}, manifest, "idx", tmp_path
+    )
+
+    assert written == ["id-1"]
+    assert record["content_embedding"] == [0.5, 0.25]
+    assert record["content_keywords"] == ["kw"]
+    assert (tmp_path / "id-1.json").exists()
@@ -0,0 +1,109 @@
+"""JenkinsClient のテスト（リポジトリ直下の jenkins_stub_server.py を空きポートで起動する）"""
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import jenkins_client
+import jenkins_stub_server
+from jenkins_client import BUILD_TREE, QUEUE_TREE, JenkinsClient, next_poll_interval
+
+
+@pytest.fixture
+def stub_url(monkeypatch):
+    """キュー待ち・ビルド時間を短くしたスタブサーバーのURL"""
+    monkeypatch.setattr(jenkins_stub_server, "QUEUE_DELAY_SEC", 0.2)
+    monkeypatch.setattr(jenkins_stub_server, "BUILD_SEC", 0.4)
+    monkeypatch.setattr(jenkins_stub_server, "requests_seen", [])
+    monkeypatch.setattr(jenkins_client, "POLL_INITIAL_SEC", 0.05)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), jenkins_stub_server.StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _requests(kind):
+    """スタブが受け付けたリクエストのうち、パスに kind を含むものの (メソッド, パス, クエリ) リスト"""
+    result = []
+    for method, path in jenkins_stub_server.requests_seen:
+        parts = urlsplit(path)
+        if kind in parts.path:
+            result.append((method, parts.path, parse_qs(parts.query)))
+    return result
+
+
+def test_run_triggers_build_and_waits_for_result(stub_url):
+    events = []
+    with JenkinsClient(stub_url, "stub", "user", "token", "job-token") as client:
+        result = client.run({"NEW_TAG": "001-20250101"}, queue_wait_sec=10, build_wait_sec=10,
+                            on_event=lambda event, value: events.append((event, value)))
+
+    assert result == "SUCCESS"
+    assert [event for event, _ in events] == ["queued", "started", "finished"]
+    queue_url, build_url = events[0][1], events[1][1]
+    assert urlsplit(queue_url).path.startswith("/queue/item/")
+    assert urlsplit(build_url).path.startswith("/job/stub/")
+
+    [(method, path, query)] = _requests("/buildWithParameters")
+    assert (method, path) == ("POST", "/job/stub/buildWithParameters")
+    assert query == {"token": ["job-token"], "NEW_TAG": ["001-20250101"]}
+
+
+def test_polls_request_only_needed_fields(stub_url):
+    with JenkinsClient(stub_url, "stub", "user", "token", "job-token") as client:
+        client.run({"NEW_TAG": "001-20250101"}, queue_wait_sec=10, build_wait_sec=10)
+
+    queue_polls = _requests("/queue/item/")
+    build_polls = [request for request in _requests("/api/json") if request[1].startswith("/job/stub/")]
+    # キューはビルド開始まで、ビルドは完了まで複数回確認する
+    assert len(queue_polls) >= 2
+    assert len(build_polls) >= 2
+    assert all(query == {"tree": [QUEUE_TREE]} for _, _, query in queue_polls)
+    assert all(query == {"tree": [BUILD_TREE]} for _, _, query in build_polls)
+
+
+def test_check_build_reports_remaining_estimate(stub_url):
+    with JenkinsClient(stub_url, "stub", "user", "token") as client:
+        build_url = client.resolve_queue_to_build(client.trigger_build({}), wait_sec=10)
+        result, remaining = client.check_build(build_url)
+
+    assert result is None
+    assert 0 < remaining <= jenkins_stub_server.BUILD_SEC
+
+
+def test_next_poll_interval_grows_to_max_without_estimate():
+    intervals = [1.0]
+    for _ in range(8):
+        intervals.append(next_poll_interval(intervals[-1]))
+
+    assert intervals == pytest.approx([1.0, 1.5, 2.25, 3.375, 5.0625, 7.59375, 11.390625, 15.0, 15.0])
+
+
+@pytest.mark.parametrize("interval, remaining, expected", [
+    (4.0, 2.0, 2.0),     # 推定完了が近い: その時刻に合わせる
+    (4.0, 0.3, 1.0),     # ただし初回の間隔より短くしない
+    (1.0, 10.0, 5.0),    # 推定完了まで長い: 残り時間の半分まで広げる
+    (1.0, 100.0, 15.0),  # 上限で頭打ち
+    (2.0, -5.0, 3.0),    # 推定時刻を過ぎた: 通常どおり伸ばす
+])
+def test_next_poll_interval_follows_remaining_estimate(interval, remaining, expected):
+    assert next_poll_interval(interval, remaining) == pytest.approx(expected)
+
+
+def test_wait_for_build_result_sleeps_adaptively(monkeypatch):
+    # (結果, 推定残り秒数) の順に返すビルド
+    states = iter([(None, None), (None, 10.0), (None, 2.0), (None, None), ("SUCCESS", None)])
+    sleeps = []
+    monkeypatch.setattr(jenkins_client.time, "sleep", sleeps.append)
+
+    client = JenkinsClient("http://jenkins.invalid", "job", "user", "token")
+    monkeypatch.setattr(client, "check_build", lambda build_url: next(states))
+
+    assert client.wait_for_build_result("http://jenkins.invalid/job/job/1/", wait_sec=600) == "SUCCESS"
+    # 1.0 → 1.5（推定不明）→ 5.0（残り10秒の半分）→ 2.0（残り2秒に合わせる）
+    assert sleeps == pytest.approx([1.0, 1.5, 5.0, 2.0])
@@ -0,0 +1,134 @@
+"""ジョブキューとリースの状態遷移のテスト（DBは一時ファイル）"""
+import threading
+
+import pytest
+
+from job_queue import JobQueue, LeaseLock
+
+STALE_MESSAGE = "stale"
+
+
+@pytest.fixture
+def db(temp_db):
+    return temp_db
+
+
+def _enqueue(db, task_id, key):
+    db.create_upload_record(task_id, f"{task_id}.xlsx", "approver@example.com", "worker@example.com",
+                            key, status="queued")
+    db.enqueue_job(task_id, key, f"/input/{task_id}.xlsx")
+
+
+def _claim(db, owner="w1", lease_sec=60.0):
+    job = db.claim_next_job(owner, lease_sec, STALE_MESSAGE)
+    return job["task_id"] if job else None
+
+
+def test_jobs_with_same_key_run_one_at_a_time(db):
+    _enqueue(db, "a", "idx1")
+    _enqueue(db, "b", "idx1")
+    _enqueue(db, "c", "idx2")
+
+    # idx1 のリースが有効な間は b を飛ばして c を取り出す
+    assert _claim(db) == "a"
+    assert _claim(db) == "c"
+    assert _claim(db) is None
+    assert db.get_job("a")["status"] == "running"
+    assert db.get_job("b")["status"] == "queued"
+
+    db.finish_job("a", "w1")
+    assert db.get_job("a")["status"] == "done"
+    assert _claim(db) == "b"
+    assert [job["task_id"] for job in db.get_active_jobs()] == ["b", "c"]
+
+
+def test_finish_by_other_owner_is_ignored(db):
+    _enqueue(db, "a", "idx1")
+    assert _claim(db, owner="w1") == "a"
+
+    db.finish_job("a", "w2")
+    assert db.get_job("a")["status"] == "running"
+    assert [lease["owner"] for lease in db.get_leases()] == ["w1"]
+
+
+def test_expired_job_is_failed_and_key_released(db):
+    _enqueue(db, "a", "idx1")
+    _enqueue(db, "b", "idx1")
+    assert _claim(db, owner="w1") == "a"
+
+    # 保持者のハートビートが途絶えた（リースが期限切れ）
+    db.expire_task_leases("a")
+
+    assert _claim(db, owner="w2") == "b"
+    assert db.get_job("a")["status"] == "done"
+    upload = db.get_upload_by_task_id("a")
+    assert upload["status"] == "error"
+    assert upload["error_message"] == STALE_MESSAGE
+    # 停止した保持者の完了記録は、他の保持者が取り直したリースを解放しない
+    db.finish_job("a", "w1")
+    assert [(lease["owner"], lease["task_id"]) for lease in db.get_leases()] == [("w2", "b")]
+
+
+def test_expire_stale_jobs_keeps_live_jobs(db):
+    _enqueue(db, "a", "idx1")
+    _enqueue(db, "b", "idx2")
+    _claim(db, owner="w1")
+    _claim(db, owner="w1")
+    db.expire_task_leases("b")
+
+    assert db.expire_stale_jobs(STALE_MESSAGE) == ["b"]
+    assert db.get_job("a")["status"] == "running"
+    assert db.get_upload_by_task_id("a")["status"] == "queued"
+
+
+def test_lease_acquire_renew_release(db):
+    assert db.acquire_lease("deploy", "w1", 60)
+    assert not db.acquire_lease("deploy", "w2", 60)
+    assert db.renew_leases("w1", 60) == 1
+
+    # 他の保持者のリースは解放できない
+    db.release_lease("deploy", "w2")
+    assert [lease["owner"] for lease in db.get_leases()] == ["w1"]
+
+    db.release_lease("deploy", "w1")
+    assert db.get_leases() == []
+    assert db.acquire_lease("deploy", "w2", 60)
+
+
+def test_expired_lease_is_taken_over(db):
+    assert db.acquire_lease("deploy", "w1", -1)
+    assert db.acquire_lease("deploy", "w2", 60)
+    # 期限切れ後に取り直されたリースは延長されない
+    assert db.renew_leases("w1", 60) == 0
+    assert [lease["owner"] for lease in db.get_leases()] == ["w2"]
+
+
+def test_lease_lock_releases_on_exit(db):
+    with LeaseLock("git_deploy", owner="w1", ttl_sec=60, task_id="a"):
+        assert not db.acquire_lease("git_deploy", "w2", 60)
+    assert db.acquire_lease("git_deploy", "w2", 60)
+
+
+def test_stopped_queue_finishes_running_job_without_claiming_more(db):
+    _enqueue(db, "a", "idx1")
+    _enqueue(db, "b", "idx2")
+    started, release = threading.Event(), threading.Event()
+    ran = []
+
+    def run(job):
+        ran.append(job["task_id"])
+        started.set()
+        release.wait(5)
+
+    queue = JobQueue(run, workers=1, owner="w1")
+    queue.start()
+    assert started.wait(5)
+
+    queue.stop()
+    assert not queue.join(timeout=0.1)
+    release.set()
+    assert queue.join(timeout=5)
+
+    assert ran == ["a"]
+    assert db.get_job("a")["status"] == "done"
+    assert db.get_job("b")["status"] == "queued"
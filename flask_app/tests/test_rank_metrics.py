@@ -0,0 +1,78 @@
+"""ai_search_bunseki の順位指標とブートストラップ信頼区間のテスト"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from ai_search_bunseki import compute_rank_metrics, evaluate_variants, paired_bootstrap_ci
+
+# 1〜3位の割引 1 / log2(rank + 1)
+D1, D2, D3 = 1.0, 1 / np.log2(3), 0.5
+
+
+def test_rank_metrics_on_hand_computed_hits():
+    hits = np.array([
+        [False, True, False],   # 2位のみ命中、採択2件
+        [True, False, True],    # 1位と3位が命中、採択2件
+        [False, False, False],  # 命中なし、採択1件
+        [False, False, True],   # 3位のみ命中、採択5件（理想DCGはk=3件分）
+    ])
+    n_relevant = [2, 2, 1, 5]
+
+    metrics = compute_rank_metrics(hits, n_relevant)
+
+    np.testing.assert_allclose(metrics["mrr"], [1 / 2, 1, 0, 1 / 3])
+    np.testing.assert_allclose(metrics["ndcg"], [
+        D2 / (D1 + D2),
+        (D1 + D3) / (D1 + D2),
+        0,
+        D3 / (D1 + D2 + D3),
+    ])
+    np.testing.assert_allclose(metrics["recall"], [1 / 2, 1, 0, 1 / 5])
+
+
+def test_rank_metrics_without_relevant_docs_are_zero():
+    metrics = compute_rank_metrics(np.zeros((1, 3), dtype=bool), [0])
+
+    assert [metrics[name][0] for name in ("mrr", "ndcg", "recall")] == [0, 0, 0]
+
+
+def _scores(seed=1, n_queries=30):
+    rng = np.random.default_rng(seed)
+    return rng.random((3, 2, n_queries))
+
+
+def test_bootstrap_ci_is_reproducible_with_seed():
+    scores = _scores()
+
+    first = paired_bootstrap_ci(scores, n_boot=500, seed=42, n_jobs=4, chunk_size=64)
+    # チャンクの並列数が変わっても同じシードなら同じ結果になる
+    second = paired_bootstrap_ci(scores, n_boot=500, seed=42, n_jobs=1, chunk_size=64)
+    other = paired_bootstrap_ci(scores, n_boot=500, seed=7, n_jobs=4, chunk_size=64)
+
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+    assert not np.array_equal(first[0], other[0])
+
+
+def test_bootstrap_ci_of_baseline_is_zero():
+    lower, upper, p_le_zero = paired_bootstrap_ci(_scores(), baseline_idx=1, n_boot=200)
+
+    np.testing.assert_array_equal(lower[1], 0)
+    np.testing.assert_array_equal(upper[1], 0)
+    np.testing.assert_array_equal(p_le_zero[1], 1)
+
+
+def test_bootstrap_ci_rejects_empty_query_set():
+    with pytest.raises(ValueError):
+        paired_bootstrap_ci(np.empty((2, 3, 0)))
+
+
+def test_evaluate_variants_rejects_empty_query_set():
+    variants = {
+        "a": pd.DataFrame({"query_id": ["q1"], "topk_docs": ["d1,d2"]}),
+        "b": pd.DataFrame({"query_id": ["q2"], "topk_docs": ["d1"]}),
+    }
+    df_llm = pd.DataFrame({"query_id": ["q1", "q2"], "used_docs": ["d1", "d1"]})
+
+    with pytest.raises(ValueError, match="評価対象のクエリがありません"):
+        evaluate_variants(variants, df_llm, k=2)
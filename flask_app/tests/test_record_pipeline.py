@@ -0,0 +1,131 @@
+"""run_record_pipeline のキャッシュの使い方のテスト（Embedding / キーワードAPIは差し替える）"""
+import json
+
+import pytest
+
+import excel_to_index_processor as processor
+from checkpoint_store import CheckpointStore
+from content_cache import ContentCache, content_hash
+
+KEYWORD_MODEL = "gpt-test"
+EMBEDDING_MODEL = "embedding-test"
+
+
+@pytest.fixture
+def fake_apis(monkeypatch):
+    """Embeddingはテキストの長さ、キーワードは抽出に渡されたcontentそのものを返すAPI"""
+    calls = {"embed": [], "keywords": []}
+
+    def fake_embed(client, texts):
+        calls["embed"].append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    async def fake_extract(chain, content):
+        calls["keywords"].append(content)
+        return [content]
+
+    monkeypatch.setenv("AZURE_OPENAI_API_ENGINE_GPT", KEYWORD_MODEL)
+    monkeypatch.setenv("AZURE_OPENAI_API_ENGINE_EMBEDDING", EMBEDDING_MODEL)
+    monkeypatch.setattr(processor, "AzureOpenAI", lambda **kwargs: None)
+    monkeypatch.setattr(processor, "build_keyword_chain", lambda: None)
+    monkeypatch.setattr(processor, "embed_batch_with_split", fake_embed)
+    monkeypatch.setattr(processor, "extract_keywords_async", fake_extract)
+    return calls
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ContentCache(tmp_path / "cache.db")
+    yield cache
+    cache.close()
+
+
+def _run(records, output_dir, cache, checkpoint=None, run_key=None):
+    return processor.run_record_pipeline(
+        iter([dict(record) for record in records]), len(records), output_dir,
+        cache=cache, checkpoint=checkpoint, run_key=run_key
+    )
+
+
+def _load(output_dir, rag_id):
+    return json.loads((output_dir / f"{rag_id}.json").read_text(encoding="utf-8"))
+
+
+def test_keywords_are_not_shared_between_contents_with_same_cleaned_text(tmp_path, fake_apis, cache):
+    # URLだけが異なり、クレンジング後のテキスト（Embeddingのキー）は同じになるレコード
+    records = [
+        {"rag_id": "a", "content": "手順は https://example.com/a を参照"},
+        {"rag_id": "b", "content": "手順は https://example.com/b を参照"},
+    ]
+    assert (processor.remove_urls_and_html(records[0]["content"])
+            == processor.remove_urls_and_html(records[1]["content"]))
+
+    _run(records, tmp_path, cache)
+    # 2回目はキャッシュから取得し、それぞれ自分のcontentから抽出したキーワードになる
+    fake_apis["keywords"].clear()
+    _run(records, tmp_path, cache)
+
+    assert fake_apis["keywords"] == []
+    for record in records:
+        assert _load(tmp_path, record["rag_id"])["content_keywords"] == [record["content"]]
+    stored = cache.get_keywords(KEYWORD_MODEL, [content_hash(record["content"]) for record in records])
+    assert stored == {content_hash(record["content"]): [record["content"]] for record in records}
+
+
+def test_keyword_cache_key_is_hash_of_extracted_text(tmp_path, fake_apis, cache):
+    records = [{"rag_id": "a", "content": "<b>太字</b>の説明"}]
+
+    _run(records, tmp_path, cache)
+
+    assert fake_apis["keywords"] == [records[0]["content"]]
+    cleaned = processor.remove_urls_and_html(records[0]["content"])
+    assert cache.get_keywords(KEYWORD_MODEL, [content_hash(cleaned)]) == {}
+    assert cache.get_keywords(KEYWORD_MODEL, [content_hash(records[0]["content"])]) == {
+        content_hash(records[0]["content"]): [records[0]["content"]]
+    }
+
+
+def test_keywords_are_looked_up_and_stored_in_batches(tmp_path, fake_apis, cache, monkeypatch):
+    records = [{"rag_id": f"r{i}", "content": f"内容{i}"} for i in range(5)]
+    lookups, stores = [], []
+    get_keywords, put_keywords = cache.get_keywords, cache.put_keywords
+    monkeypatch.setattr(cache, "get_keywords", lambda model, hashes: lookups.append(list(hashes))
+                        or get_keywords(model, hashes))
+    monkeypatch.setattr(cache, "put_keywords", lambda model, items: stores.append(dict(items))
+                        or put_keywords(model, items))
+
+    _run(records, tmp_path, cache)
+
+    # 1つのEmbeddingバッチにつき1回の検索、抽出したキーワードはまとめて1回で保存
+    assert len(fake_apis["embed"]) == 1
+    assert [len(hashes) for hashes in lookups] == [5]
+    assert [len(items) for items in stores] == [5]
+
+    fake_apis["keywords"].clear()
+    _run(records, tmp_path, cache)
+
+    assert fake_apis["keywords"] == []
+    assert len(stores) == 1
+
+
+def test_completed_records_are_restored_from_checkpoint(tmp_path, fake_apis, monkeypatch):
+    records = [{"rag_id": f"r{i}", "content": f"内容{i}"} for i in range(3)]
+    checkpoint = CheckpointStore(tmp_path / "checkpoints.db")
+    loads = []
+    load_records = checkpoint.load_records
+    monkeypatch.setattr(checkpoint, "load_records", lambda run_key: loads.append(run_key)
+                        or load_records(run_key))
+    try:
+        checkpoint.get_or_create_run("run", [record["rag_id"] for record in records])
+        checkpoint.save_records("run", [(0, [0.25], ["保存済み"]), (2, [0.5], [])])
+
+        assert _run(records, tmp_path, None, checkpoint, "run") == ["r0", "r1", "r2"]
+    finally:
+        checkpoint.close()
+
+    # 完了済みレコードは1回のクエリで読み込み、APIを呼ばずに出力する
+    assert loads == ["run"]
+    assert fake_apis["embed"] == [[records[1]["content"]]]
+    assert fake_apis["keywords"] == [records[1]["content"]]
+    assert _load(tmp_path, "r0")["content_keywords"] == ["保存済み"]
+    assert _load(tmp_path, "r2")["content_embedding"] == [0.5]
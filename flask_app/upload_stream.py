@@ -0,0 +1,57 @@
+"""
+アップロード受信モジュール
+リクエスト本文のファイルをチャンクごとにディスクへ書き込みながらSHA-256を計算する
+（Werkzeugのメモリ上のバッファや一時ファイルからのコピーを経由しない）
+"""
+import hashlib
+import os
+import tempfile
+
+from flask import Request
+
+
+class HashingFileStream:
+    """書き込んだ内容のSHA-256を計算するディスク上のファイル（閉じた時点で保存されていなければ削除）"""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.uploading')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self._saved = False
+
+    def write(self, data: bytes) -> int:
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        """書き込んだ内容のSHA-256（16進数）"""
+        return self._sha256.hexdigest()
+
+    def save_as(self, dst: str) -> None:
+        """ファイルを閉じて dst に移動（同じファイルシステム内のため、コピーしない）"""
+        self._file.close()
+        os.replace(self.path, dst)
+        self.path = dst
+        self._saved = True
+
+    def close(self) -> None:
+        self._file.close()
+        if not self._saved:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class HashingRequest(Request):
+    """アップロードファイルを HashingFileStream で受信するリクエスト"""
+
+    # 受信中のファイルを書き込むディレクトリ（移動先と同じファイルシステムにする）
+    upload_dir = tempfile.gettempdir()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFileStream(self.upload_dir)
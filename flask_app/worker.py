@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+ジョブワーカープロセス
+Webサーバーとは別のプロセスでジョブキュー（jobsテーブル）のジョブを実行する
+
+Webサーバーはジョブをキューに登録するだけで、進捗・ログはDB経由で共有される。
+Excel読み込みやJSON生成のCPU負荷がリクエスト処理と競合せず、
+Webサーバーを再起動しても実行中のジョブは中断されない
+
+SIGTERM / SIGINT（Ctrl+C）を受けると新しいジョブの取り出しをやめ、実行中のジョブの完了を待って終了する。
+WORKER_SHUTDOWN_GRACE_SEC を過ぎても完了しないジョブは強制終了し、リースの期限切れ後にエラーになる
+（もう一度 SIGTERM / SIGINT を送るとすぐに強制終了する）
+
+使い方:
+    python worker.py                           # JOB_WORKERS 個のワーカープロセスを起動
+    python worker.py --processes 4             # ワーカープロセス数を指定
+    python worker.py --processes 2 --threads 2 # 1プロセスあたりの同時実行ジョブ数を指定
+
+同じホストで起動できるワーカー（監視プロセス）は1つのみ。起動済みの場合はすぐに終了する
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from typing import List, Optional
+
+from database import init_db, acquire_lease, renew_leases, release_lease, get_leases
+from job_queue import JobQueue, JOB_WORKERS, JOB_LEASE_SEC, new_worker_id
+from log_writer import log_writer
+from processor_new import run_job
+
+# 子プロセスの生存を確認する間隔（秒）: 監視プロセスのリースもこの間隔で延長する
+SUPERVISE_INTERVAL_SEC = 5.0
+# 停止時に、実行中のジョブの完了を待つ最大時間（秒）
+WORKER_SHUTDOWN_GRACE_SEC = float(os.getenv("WORKER_SHUTDOWN_GRACE_SEC", "600"))
+# 停止中に子プロセスの終了を確認する間隔（秒）
+SHUTDOWN_CHECK_INTERVAL_SEC = 1.0
+
+# ホストごとの監視プロセスのリース名
+SUPERVISOR_LEASE_NAME = f"worker_supervisor:{socket.gethostname()}"
+
+
+def worker_supervisor_running() -> bool:
+    """このホストでワーカーの監視プロセスが動いているか（リースが有効か）"""
+    now = time.time()
+    return any(lease['name'] == SUPERVISOR_LEASE_NAME and lease['expires_at'] >= now
+               for lease in get_leases())
+
+
+def create_job_queue(workers: int, owner: Optional[str] = None) -> JobQueue:
+    """
+    ジョブを実行するジョブキューを作成
+
+    Args:
+        workers: ワーカースレッド数
+        owner: リース保持者ID（省略時は新しく生成）
+    """
+    owner = owner or new_worker_id()
+
+    def run(job):
+        # コミットとタグ作成は、他のプロセスのジョブも含めて1件ずつ行う
+        run_job(job, queue.lease_lock('git_deploy', job['task_id']))
+
+    queue = JobQueue(run, workers, owner)
+    return queue
+
+
+def run_worker_process(threads: int = 1) -> None:
+    """ワーカープロセスの本体（SIGTERMを受けるまでジョブを実行し、実行中のジョブの完了後に終了する）"""
+    # 端末の Ctrl+C（プロセスグループへのSIGINT）で実行中のジョブが中断されないよう、
+    # 監視プロセスとは別のプロセスグループにする（停止は監視プロセスからSIGTERMで伝える）
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    queue = create_job_queue(threads)
+    queue.start()
+    stopping.wait()
+
+    # 猶予時間を過ぎても終わらない場合は監視プロセスが強制終了する
+    queue.stop()
+    queue.join()
+    log_writer.flush()
+
+
+def start_worker_processes(processes: int, threads: int) -> List[multiprocessing.Process]:
+    """
+    ワーカープロセスを起動
+
+    Excel読み込みでプロセスプールを使うため、デーモンプロセスにはしない
+    （デーモンプロセスは子プロセスを作成できない）
+    """
+    ctx = multiprocessing.get_context('spawn')
+    children = []
+    for i in range(processes):
+        child = ctx.Process(target=run_worker_process, args=(threads,), name=f"job-worker-process-{i}")
+        child.start()
+        children.append(child)
+    return children
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='ジョブキューのジョブを実行するワーカー')
+    parser.add_argument('--processes', type=int, default=JOB_WORKERS,
+                        help=f'ワーカープロセス数（既定: {JOB_WORKERS}）')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='1プロセスあたりの同時実行ジョブ数（既定: 1）')
+    args = parser.parse_args(argv)
+
+    init_db()
+
+    # 同じホストで複数の監視プロセスが動くと、同時実行数が増えてしまうため1つに限る
+    owner = new_worker_id()
+    if not acquire_lease(SUPERVISOR_LEASE_NAME, owner, JOB_LEASE_SEC):
+        print("[INFO] このホストのワーカーは起動済みのため終了します")
+        return
+
+    processes = max(1, args.processes)
+    threads = max(1, args.threads)
+    print(f"[INFO] ワーカーを起動します（プロセス数: {processes}, スレッド数: {threads}）")
+    children = start_worker_processes(processes, threads)
+
+    # 停止の期限（time.monotonic）。停止要求を受けるまではNone
+    deadline = None
+
+    def shutdown(signum, frame):
+        nonlocal deadline
+        if deadline is not None:
+            # 停止中にもう一度要求された場合は、実行中のジョブを待たずに終了する
+            deadline = time.monotonic()
+            return
+        print(f"[INFO] 実行中のジョブの完了を待って停止します（最大{WORKER_SHUTDOWN_GRACE_SEC:.0f}秒）")
+        deadline = time.monotonic() + WORKER_SHUTDOWN_GRACE_SEC
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # 異常終了した子プロセスは起動し直す
+    while True:
+        time.sleep(SUPERVISE_INTERVAL_SEC if deadline is None else SHUTDOWN_CHECK_INTERVAL_SEC)
+        # 停止中も、子プロセスが終わるまでは同じホストで別のワーカーが起動しないようリースを延長する
+        if renew_leases(owner, JOB_LEASE_SEC) == 0:
+            print("[WARNING] 監視プロセスのリースの延長に失敗しました")
+        if deadline is not None:
+            if not any(child.is_alive() for child in children):
+                break
+            if time.monotonic() >= deadline:
+                # 実行中のジョブはリースの期限切れ後に他のワーカーがエラーにする
+                print("[WARNING] 完了しなかったジョブがあるため、ワーカープロセスを強制終了します")
+                for child in children:
+                    if child.is_alive():
+                        child.kill()
+                for child in children:
+                    child.join()
+                break
+            continue
+        for i, child in enumerate(children):
+            if not child.is_alive():
+                print(f"[WARNING] ワーカープロセスが終了しました（exitcode: {child.exitcode}）。再起動します")
+                children[i] = start_worker_processes(1, threads)[0]
+
+    release_lease(SUPERVISOR_LEASE_NAME, owner)
+    print("[INFO] ワーカーを停止しました")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Jenkinsスタブサーバー（動作確認用）
+buildWithParameters → キュー → ビルド完了 の流れを模擬し、
+flask_app/jenkins_client.py の待機をローカルで確認する（flask_app/tests のテストでも使用）
+
+使い方:
+    python jenkins_stub_server.py            # スタブを起動してビルドの起動から完了までを確認
+    python jenkins_stub_server.py --serve    # スタブのみ起動（JENKINS_BASE=http://127.0.0.1:8089）
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flask_app.jenkins_client import JenkinsClient
+
+QUEUE_DELAY_SEC = 2.0   # キュー待ち時間
+BUILD_SEC = 6.0         # ビルド時間
+RESULT = "SUCCESS"
+
+_ids = itertools.count(1)
+_queued = {}   # queue_id -> 登録時刻
+_lock = threading.Lock()
+# 受け付けたリクエスト (メソッド, パス（クエリ文字列を含む）)
+requests_seen = []
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        requests_seen.append(("POST", self.path))
+        if "/buildWithParameters" not in self.path:
+            self.send_error(404)
+            return
+        with _lock:
+            queue_id = next(_ids)
+            _queued[queue_id] = time.time()
+        self.send_response(201)
+        self.send_header("Location", f"http://{self.headers['Host']}/queue/item/{queue_id}/")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        requests_seen.append(("GET", self.path))
+        parts = self.path.split("?")[0].strip("/").split("/")
+        # /queue/item/<id>/api/json
+        if parts[:2] == ["queue", "item"]:
+            queued_at = _queued.get(int(parts[2]))
+            if queued_at is None:
+                self.send_error(404)
+            elif time.time() - queued_at < QUEUE_DELAY_SEC:
+                self._send_json({"cancelled": False, "executable": None})
+            else:
+                self._send_json({"executable": {"url": f"http://{self.headers['Host']}/job/stub/{parts[2]}/"}})
+            return
+        # /job/stub/<id>/api/json
+        if parts[:2] == ["job", "stub"]:
+            queued_at = _queued.get(int(parts[2]))
+            if queued_at is None:
+                self.send_error(404)
+                return
+            started = queued_at + QUEUE_DELAY_SEC
+            done = time.time() >= started + BUILD_SEC
+            self._send_json({
+                "result": RESULT if done else None,
+                "building": not done,
+                "timestamp": int(started * 1000),
+                "estimatedDuration": int(BUILD_SEC * 1000),
+            })
+            return
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+        print(f"[stub] {self.command} {self.path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jenkinsスタブサーバー")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--serve", action="store_true", help="スタブのみ起動する")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    if args.serve:
+        print(f"Jenkinsスタブ起動: http://127.0.0.1:{args.port}")
+        server.serve_forever()
+        return
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = JenkinsClient(f"http://127.0.0.1:{args.port}", "stub", "user", "token", "job-token", verify_ssl=False)
+
+    start = time.time()
+    result = client.run({"NEW_TAG": "001-20250101"}, queue_wait_sec=30, build_wait_sec=60,
+                        on_event=lambda event, value: print(f"{event}: {value}"))
+    print(f"結果: {result}（{time.time() - start:.1f}秒）")
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()